@@ -1,11 +1,16 @@
-from typing import Tuple, List, Optional, Dict, Any
+from typing import Tuple, List, Optional, Dict, Any, Callable, Awaitable, Set
 from .models import (
     ConnectionState,
     ClientMessage,
     Effect,
     ChorusState,
+    CycleBudget,
     StepEnum,
     Message,
+    MessageRecord,
+    MessageStatus,
+    ModelRoute,
+    CycleContext,
     ActionResponse,
     ExperienceResponse,
     IntentionResponse,
@@ -14,8 +19,16 @@ from .models import (
     YieldResponse
 )
 from .database import DatabaseClient
-from .utils import chat_completion, get_embedding, structured_chat_completion
+from .vector_store import PayloadFilter
+from .message_writer import MessageWriter
+from .completion_cache import CompletionCache
+from .retrieval import group_by_thread
+from .context import ContextBuilder, get_token_counter
+from .utils import chat_completion, get_embedding, structured_chat_completion, parse_structured_response
 from .config import Config
+from contextvars import ContextVar
+import asyncio
+import time
 import uuid
 from datetime import datetime, UTC
 import logging
@@ -23,39 +36,190 @@ import json
 
 logger = logging.getLogger(__name__)
 
+EffectSink = Callable[[Effect], Awaitable[None]]
+
+# Sink of the cycle running in the current task, so step LLM calls can forward token deltas
+_cycle_sink: ContextVar[Optional[EffectSink]] = ContextVar("chorus_cycle_sink", default=None)
+# Budget of the cycle running in the current task; step LLM calls charge their tokens to it
+_cycle_budget: ContextVar[Optional[CycleBudget]] = ContextVar("chorus_cycle_budget", default=None)
+# Set by a step function that answered with an error placeholder instead of a completion
+_step_failed: ContextVar[bool] = ContextVar("chorus_step_failed", default=False)
+
+# Sent to the client when the cycle has no answer at all; stored as rejected
+NO_RESPONSE = "Unable to complete a response within the cycle budget"
+
 class ChorusCycle:
-    def __init__(self, database: DatabaseClient, config: Config):
+    # Steps of one iteration, in the order their effects are emitted. YIELD runs
+    # after UPDATE decides not to loop.
+    STEP_ORDER: List[StepEnum] = [
+        StepEnum.ACTION,
+        StepEnum.EXPERIENCE,
+        StepEnum.INTENTION,
+        StepEnum.OBSERVATION,
+        StepEnum.UPDATE
+    ]
+
+    # Earlier steps in the same iteration whose output each step reads from the
+    # cycle context. EXPERIENCE and INTENTION both build on ACTION only, so they
+    # run together; the other steps wait for the group before them.
+    STEP_DEPENDENCIES: Dict[StepEnum, Set[StepEnum]] = {
+        StepEnum.ACTION: set(),
+        StepEnum.EXPERIENCE: {StepEnum.ACTION},
+        StepEnum.INTENTION: {StepEnum.ACTION},
+        StepEnum.OBSERVATION: {StepEnum.EXPERIENCE, StepEnum.INTENTION},
+        StepEnum.UPDATE: {StepEnum.OBSERVATION}
+    }
+
+    # Priors are user inputs and final answers; intermediate step outputs and
+    # rejected messages are filtered out inside the index
+    PRIOR_FILTER = PayloadFilter(
+        exclude_steps=tuple(step.value for step in STEP_DEPENDENCIES),
+        exclude_statuses=(MessageStatus.REJECTED.value,)
+    )
+
+    # Shared opening of every step prompt. It, the user input and the cycle
+    # context only ever grow, so consecutive steps send a common prefix that
+    # providers can serve from their prompt cache.
+    PREAMBLE = """
+        You are running the Chorus Cycle: a sequence of steps (Action, Experience, Intention,
+        Observation, Update, Yield) that together answer the user's prompt. The user's prompt
+        follows, then the outputs of the steps completed so far, then the instructions for the
+        current step. Respond only in the JSON format the current step asks for.
+        """
+
+    def __init__(
+        self,
+        database: DatabaseClient,
+        config: Config,
+        stream_tokens: bool = False,
+        writer: Optional[MessageWriter] = None,
+        completion_cache: Optional[CompletionCache] = None
+    ):
         self.database = database
         self.config = config
+        # Persists the prompt and step outputs write-behind, off the user-facing path
+        self.writer = writer
+        # Also stream each step's tokens as delta frames while the model generates
+        self.stream_tokens = stream_tokens
+        # Serves repeated identical step prompts without calling the model; None disables it
+        self.completion_cache = completion_cache
+
+    async def _complete(self, step: StepEnum, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        on_delta = None
+        sink = _cycle_sink.get()
+        if self.stream_tokens and sink is not None:
+            async def on_delta(delta: str):
+                await sink(Effect(
+                    type="chorus_response",
+                    payload={"step": step.value, "delta": delta, "final": False}
+                ))
+
+        route = self.route(step)
+        response_format = {"type": "json_object"}
+        cache_key = None
+        if self.completion_cache is not None:
+            temperature = route.temperature if route.temperature is not None else self.config.TEMPERATURE
+            if temperature > self.config.COMPLETION_CACHE_MAX_TEMPERATURE:
+                self.completion_cache.bypassed += 1
+            else:
+                params = {"max_tokens": route.max_tokens, "temperature": temperature, "response_format": response_format}
+                cache_key = self.completion_cache.key(route.model, step.value, messages, params)
+                content = await self.completion_cache.get(cache_key)
+                if content is not None:
+                    logger.info(f"Serving cached completion for {step.value}")
+                    if on_delta is not None:
+                        await on_delta(content)
+                    return {"status": "success", "content": content, "model": route.model, "cached": True, "usage": {"total_tokens": 0}}
+
+        result = await structured_chat_completion(
+            messages,
+            self.config,
+            response_format=response_format,
+            on_delta=on_delta,
+            route=route
+        )
+        # Only cache answers from the routed model itself, not errors or fallbacks
+        if cache_key is not None and result["status"] == "success" and result.get("model", route.model) == route.model:
+            await self.completion_cache.put(cache_key, result["content"])
+        budget = _cycle_budget.get()
+        if budget is not None:
+            budget.tokens_used += result.get("usage", {}).get("total_tokens", 0)
+        return result
+
+    def route(self, step: StepEnum) -> ModelRoute:
+        """Model and sampling settings for `step` from STEP_ROUTES; unlisted steps use CHAT_MODEL."""
+        return ModelRoute(**self.config.STEP_ROUTES.get(step.value, {"model": self.config.CHAT_MODEL}))
+
+    def new_budget(self) -> CycleBudget:
+        return CycleBudget(
+            max_iterations=self.config.CYCLE_MAX_ITERATIONS,
+            max_tokens=self.config.CYCLE_MAX_TOKENS,
+            time_limit=self.config.CYCLE_TIME_LIMIT,
+            exit_confidence=self.config.LOOP_EXIT_CONFIDENCE,
+            started_at=time.monotonic()
+        )
 
     async def handle_client_message(
-        self, state: ConnectionState, message: ClientMessage
+        self, state: ConnectionState, message: ClientMessage, sink: Optional[EffectSink] = None
     ) -> Tuple[ConnectionState, List[Effect]]:
+        """
+        Handle one client message. Effects are passed to `sink` as soon as they are
+        produced; without a sink they are collected and returned instead.
+        """
         logger.info(f"Handling client message: {message.type}")
         effects = []
         new_state = state.copy(deep=True)
 
+        if sink is None:
+            async def sink(effect: Effect):
+                effects.append(effect)
+
         if message.type == "get_thread_messages":
             thread_id = message.data.get("thread_id")
-            messages = await self.database.get_messages(thread_id)
-            effects.append(Effect(type="send_messages", payload={"messages": messages}))
+            cursor = message.data.get("cursor")
+            if not thread_id or not isinstance(thread_id, str):
+                await sink(Effect(type="error", payload={"message": "No thread_id provided"}))
+                return new_state, effects
+            try:
+                limit = int(message.data.get("limit", self.config.THREAD_PAGE_SIZE))
+            except (TypeError, ValueError):
+                await sink(Effect(type="error", payload={"message": f"Invalid limit: {message.data.get('limit')!r}"}))
+                return new_state, effects
+            limit = max(1, min(limit, self.config.THREAD_PAGE_SIZE))
+            if cursor is not None and (isinstance(cursor, bool) or not isinstance(cursor, int)):
+                # Cursors are the seq values returned as next_cursor, never anything else
+                await sink(Effect(type="error", payload={"message": f"Invalid cursor: {cursor!r}"}))
+                return new_state, effects
+            # Send the history a page at a time so a long thread is never held in memory at once
+            while True:
+                messages, next_cursor = await self.database.get_messages(thread_id, cursor=cursor, limit=limit)
+                await sink(Effect(type="send_messages", payload={
+                    "thread_id": thread_id,
+                    "messages": messages,
+                    "cursor": cursor,
+                    "next_cursor": next_cursor,
+                    "done": next_cursor is None
+                }))
+                if next_cursor is None:
+                    break
+                cursor = next_cursor
 
         elif message.type == "create_thread":
             user_id = message.data.get("user_id")
             thread_name = message.data.get("name")
             new_thread = await self.database.create_chat_thread(user_id, thread_name)
-            effects.append(Effect(type="new_thread", payload={"thread": new_thread}))
+            await sink(Effect(type="new_thread", payload={"thread": new_thread}))
 
         elif message.type == "submit_prompt":
             logger.info("Processing submit_prompt")
             thread_id = message.data.get("thread_id", "default")
             prompt = message.data.get("content")
-            logger.info(f"Thread ID: {thread_id}, Prompt: {prompt}")
+            logger.debug("Thread ID: %s, Prompt: %s", thread_id, prompt)
 
             # Validate prompt
             if not prompt:
                 logger.error("No prompt content provided")
-                effects.append(Effect(
+                await sink(Effect(
                     type="error",
                     payload={"message": "No prompt content provided"}
                 ))
@@ -69,77 +233,257 @@ class ChorusCycle:
                 priors=None,
                 current_response=None
             )
-            effects, new_chorus_state = await self.run_chorus_cycle(chorus_state, prompt)
+            new_chorus_state = await self.run_chorus_cycle(chorus_state, prompt, sink)
 
         return new_state, effects
 
-    async def run_chorus_cycle(self, state: ChorusState, input: str) -> Tuple[List[Effect], ChorusState]:
-        logger.info(f"Starting chorus cycle with input: {input}")
-        effects = []
+    async def run_chorus_cycle(self, state: ChorusState, input: str, sink: EffectSink) -> ChorusState:
+        logger.debug("Starting chorus cycle with input: %s", input)
         new_state = state.copy(deep=True)
+        # The prompt keeps its place ahead of the step outputs in the thread, but is
+        # only saved once the cycle is over so EXPERIENCE cannot retrieve it as a prior
+        prompt_seq = self.database.next_sequence()
+        budget = self.new_budget()
+        sink_token = _cycle_sink.set(sink)
+        budget_token = _cycle_budget.set(budget)
 
-        # Run steps until we complete the cycle
-        while True:
-            logger.info(f"Running step: {new_state.current_step}")
-            new_state, step_effects = await self.run_step(new_state, input)
-            effects.extend(step_effects)
+        try:
+            # Run steps until we complete the cycle or the budget runs out
+            while True:
+                reason = budget.exhausted()
+                if reason is not None:
+                    new_state = await self._force_yield(new_state, input, sink, budget, reason)
+                    break
+
+                logger.info(f"Running step: {new_state.current_step}")
+                if self.config.PARALLEL_STEPS:
+                    step = self.run_steps_concurrently(new_state, input, sink)
+                else:
+                    step = self.run_step(new_state, input, sink)
+                try:
+                    new_state = await asyncio.wait_for(step, timeout=budget.remaining())
+                except asyncio.TimeoutError:
+                    new_state = await self._force_yield(new_state, input, sink, budget, "deadline")
+                    break
+
+                # Break after YIELD step
+                if new_state.current_step == StepEnum.YIELD:
+                    break
+        finally:
+            _cycle_budget.reset(budget_token)
+            _cycle_sink.reset(sink_token)
+            await self._persist_output("user", input, None, state.thread_id, seq=prompt_seq)
+
+        return new_state
+
+    async def _force_yield(
+        self, state: ChorusState, input: str, sink: EffectSink, budget: CycleBudget, reason: str
+    ) -> ChorusState:
+        logger.info(f"Cycle budget exhausted ({reason}); forcing YIELD")
+        budget.exit_reason = reason
+        new_state = state.copy(deep=True)
+        new_state.current_step = StepEnum.YIELD
+        await self._yield_step(new_state, input, sink)
+        return new_state
+
+    async def _yield_step(self, state: ChorusState, input: str, sink: EffectSink):
+        budget = _cycle_budget.get()
+        _step_failed.set(False)
+        if budget is not None and budget.exit_reason in ("max_tokens", "deadline"):
+            # No budget left for another completion; answer with what the cycle already has
+            yield_response = budget.best_partial_result()
+            if yield_response is None:
+                yield_response = NO_RESPONSE
+                _step_failed.set(True)
+        else:
+            yield_response = await self.run_yield(input, state.messages, context=state.context)
+        failed = _step_failed.get()
+        logger.debug("YIELD step response: %s", yield_response)
+
+        payload = {
+            "step": "yield",
+            "content": yield_response,
+            "priors": [],
+            "final": True
+        }
+        if budget is not None:
+            payload["budget"] = budget.usage()
+        await sink(Effect(type="chorus_response", payload=payload))
+        # Failure placeholders stay in the thread but, rejected, are never retrieved as priors
+        await self._persist_output(
+            "assistant", yield_response, StepEnum.YIELD.value, state.thread_id,
+            status=MessageStatus.REJECTED.value if failed else MessageStatus.APPROVED.value
+        )
 
-            # Break after YIELD step
-            if new_state.current_step == StepEnum.YIELD:
+    def independent_steps(self, start: StepEnum) -> List[StepEnum]:
+        """
+        Return `start` followed by the consecutive steps after it that read no
+        output produced earlier in the same group, so they can run together.
+        """
+        order = self.STEP_ORDER[self.STEP_ORDER.index(start):]
+        group = [order[0]]
+        for step in order[1:]:
+            if self.STEP_DEPENDENCIES[step] & set(group):
                 break
+            group.append(step)
+        return group
 
-        return effects, new_state
+    async def run_steps_concurrently(self, state: ChorusState, input: str, sink: EffectSink) -> ChorusState:
+        if state.current_step not in self.STEP_ORDER:
+            return await self.run_step(state, input, sink)
 
-    async def run_step(self, state: ChorusState, input: str) -> Tuple[ChorusState, List[Effect]]:
-        logger.info(f"Running step {state.current_step} with input: {input}")
-        effects = []
-        new_state = state.copy(deep=True)
+        group = self.independent_steps(state.current_step)
+        logger.info(f"Running steps concurrently: {[step.value for step in group]}")
+        tasks = [asyncio.create_task(self._call_step(state, step, input)) for step in group]
 
-        step_function = getattr(self, f"run_{state.current_step.value}")
+        # Finish steps in cycle order so emitted effects stay deterministic
+        new_state = state
+        try:
+            for task in tasks:
+                response, priors, summary, failed = await task
+                new_state = await self._finish_step(new_state, response, priors, summary, failed, input, sink)
+        finally:
+            for task in tasks:
+                task.cancel()
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    task.result()[2].cancel()  # a summary never awaited by _finish_step
+        return new_state
+
+    async def run_step(self, state: ChorusState, input: str, sink: EffectSink) -> ChorusState:
+        logger.debug("Running step %s with input: %s", state.current_step, input)
+        response, priors, summary, failed = await self._call_step(state, state.current_step, input)
+        return await self._finish_step(state, response, priors, summary, failed, input, sink)
+
+    async def _call_step(
+        self, state: ChorusState, step: StepEnum, input: str
+    ) -> Tuple[Any, Optional[List[Dict[str, Any]]], "asyncio.Task[str]", bool]:
+        """
+        Run `step` against the cycle context so far; returns its response, priors,
+        a task producing its context summary, and whether the step failed.
+        """
+        step_function = getattr(self, f"run_{step.value}")
         logger.info(f"Calling step function: {step_function.__name__}")
+        _step_failed.set(False)
 
         # Call step function with correct arguments
-        if state.current_step == StepEnum.EXPERIENCE:
-            response, priors = await step_function(input, state.messages, state.priors)
-            logger.info(f"Experience step response: {response}, priors: {len(priors) if priors else 0}")
+        if step == StepEnum.EXPERIENCE:
+            response, priors = await step_function(input, state.messages, state.priors, context=state.context)
+            logger.debug("Experience step response: %s, priors: %d", response, len(priors) if priors else 0)
         else:
-            response = await step_function(input, state.messages)
+            response = await step_function(input, state.messages, context=state.context)
             priors = None
-            logger.info(f"Step response: {response}")
+            logger.debug("Step response: %s", response)
+        # Start the summary now so concurrent steps summarize concurrently, but
+        # let _finish_step send the step's result before waiting for it
+        summary = asyncio.create_task(self._summarize_output(response))
+        return response, priors, summary, _step_failed.get()
+
+    async def _summarize_output(self, response: Any) -> str:
+        """
+        Compact a step's output for the cycle context. Short outputs are kept
+        verbatim; longer ones are summarized with SUMMARY_MODEL.
+        """
+        text = response if isinstance(response, str) else json.dumps(response)
+        if get_token_counter(self.config.CHAT_MODEL).count(text) <= self.config.CONTEXT_SUMMARY_THRESHOLD:
+            return text
+
+        result = await structured_chat_completion(
+            [
+                {"role": "system", "content": "Summarize this step output in a few sentences, keeping every decision, fact and open question."},
+                {"role": "user", "content": text}
+            ],
+            self.config,
+            route=ModelRoute(model=self.config.SUMMARY_MODEL, max_tokens=self.config.CONTEXT_SUMMARY_TOKENS)
+        )
+        budget = _cycle_budget.get()
+        if budget is not None:
+            budget.tokens_used += result.get("usage", {}).get("total_tokens", 0)
+        if result["status"] != "success" or not result["content"]:
+            # Keep the context bounded even when the summary fails
+            return text[:self.config.CONTEXT_SUMMARY_TOKENS * 4]
+        return result["content"]
+
+    def _step_messages(
+        self, step_prompt: str, input: str, context: Optional[CycleContext], extra: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """Build a step prompt: shared preamble, user input, cycle context, then the step's own instructions."""
+        messages = [
+            {"role": "system", "content": self.PREAMBLE},
+            {"role": "user", "content": input}
+        ]
+        if context is not None and context.entries:
+            messages.append({"role": "assistant", "content": f"Cycle context so far:\n{context.render()}"})
+        messages.append({"role": "system", "content": step_prompt})
+        if extra:
+            messages.append({"role": "user", "content": extra})
+        return messages
+
+    async def _finish_step(
+        self,
+        state: ChorusState,
+        response: Any,
+        priors: Optional[List[Dict[str, Any]]],
+        summary: "asyncio.Task[str]",
+        failed: bool,
+        input: str,
+        sink: EffectSink
+    ) -> ChorusState:
+        new_state = state.copy(deep=True)
 
         # Update state with response and priors
         new_state.current_response = response
         if priors is not None:
             new_state.priors = priors
 
-        effects.append(Effect(
-            type="chorus_response",
-            payload={
-                "step": state.current_step.value,
-                "content": response,
-                "priors": state.priors if state.priors else []
-            }
-        ))
+        try:
+            # Emit this step's result now rather than at the end of the cycle, and
+            # before waiting on its context summary
+            await sink(Effect(
+                type="chorus_response",
+                payload={
+                    "step": state.current_step.value,
+                    "content": response,
+                    "priors": state.priors if state.priors else [],
+                    "final": True
+                }
+            ))
+
+            await self._persist_output(
+                "assistant", response, state.current_step.value, state.thread_id,
+                status=MessageStatus.REJECTED.value if failed else MessageStatus.APPROVED.value
+            )
+            new_state.context = state.context.append(state.current_step, await summary)
+        finally:
+            summary.cancel()
+
+        budget = _cycle_budget.get()
+        if budget is not None:
+            # Only real completions can stand in for the final answer
+            if failed:
+                budget.partial_results.pop(state.current_step.value, None)
+            else:
+                budget.partial_results[state.current_step.value] = response
 
         # Handle step transitions
         if state.current_step == StepEnum.UPDATE:
-            if isinstance(response, dict) and response.get("loop"):
+            loop = isinstance(response, dict) and response.get("loop")
+            if budget is not None:
+                budget.iterations += 1
+                reason = budget.stop_reason(response.get("answer_confidence", 0.0)) if loop else "complete"
+                if reason is not None:
+                    if loop:
+                        logger.info(f"Ending loop early: {reason}")
+                    budget.exit_reason = reason
+                    loop = False
+
+            if loop:
                 new_state.current_step = StepEnum.ACTION  # Loop back to start
                 logger.info("Looping back to ACTION step")
             else:
                 new_state.current_step = StepEnum.YIELD  # Move to final step
                 logger.info("Moving to YIELD step")
                 # Execute YIELD step immediately
-                yield_response = await self.run_yield(input, state.messages)
-                logger.info(f"YIELD step response: {yield_response}")
-                effects.append(Effect(
-                    type="chorus_response",
-                    payload={
-                        "step": "yield",
-                        "content": yield_response,
-                        "priors": []
-                    }
-                ))
+                await self._yield_step(new_state, input, sink)
         elif state.current_step == StepEnum.YIELD:
             logger.info("Completed YIELD step - cycle finished")
         else:
@@ -147,9 +491,9 @@ class ChorusCycle:
             new_state.current_step = StepEnum(list(StepEnum)[list(StepEnum).index(state.current_step) + 1].value)
             logger.info(f"Moving to next step: {new_state.current_step}")
 
-        return new_state, effects
+        return new_state
 
-    async def run_action(self, input: str, messages: List[Message]) -> str:
+    async def run_action(self, input: str, messages: List[Message], context: Optional[CycleContext] = None) -> str:
         logger.info("Running ACTION step")
         action_prompt = """
         This is the Chorus Cycle, a decision-making model that turns the OODA loop on its head.
@@ -164,24 +508,23 @@ class ChorusCycle:
             "reasoning": "Brief explanation of your response"
         }
         """
-        messages = [
-            {"role": "system", "content": action_prompt},
-            {"role": "user", "content": input}
-        ]
-        logger.info(f"Action messages: {messages}")
-        result = await structured_chat_completion(
-            messages,
-            self.config,
-            response_format={"type": "json_object"}
-        )
-        logger.info(f"Action result: {result}")
-        try:
-            content = json.loads(result["content"])
-            return content.get("proposed_response", result["content"])
-        except:
+        messages = self._step_messages(action_prompt, input, context)
+        logger.debug("Action messages: %s", messages)
+        result = await self._complete(StepEnum.ACTION, messages)
+        logger.debug("Action result: %s", result)
+        response = parse_structured_response(result["content"], ActionResponse)
+        if response is None:
+            self._report_failure(result)
             return result["content"]
-
-    async def run_experience(self, input: str, messages: List[Message], priors: Optional[List[Dict[str, Any]]] = None) -> Tuple[str, List[Dict[str, Any]]]:
+        return response.proposed_response
+
+    async def run_experience(
+        self,
+        input: str,
+        messages: List[Message],
+        priors: Optional[List[Dict[str, Any]]] = None,
+        context: Optional[CycleContext] = None
+    ) -> Tuple[str, List[Dict[str, Any]]]:
         logger.info("Running EXPERIENCE step")
         experience_prompt = """
         This is step 2 of the Chorus Cycle, Experience: Search your memory for relevant context that could help refine the response from step 1.
@@ -196,32 +539,48 @@ class ChorusCycle:
             }
         }
         """
-        embedding = await get_embedding(input, self.config.EMBEDDING_MODEL)
-        retrieved_priors = await self.database.search_similar(
-            self.config.MESSAGES_COLLECTION,
-            embedding,
-            self.config.SEARCH_LIMIT
-        )
+        if priors is not None:
+            # Looping back through the cycle with the same input; reuse this cycle's priors
+            logger.info(f"Reusing {len(priors)} priors from earlier iteration")
+            retrieved_priors = priors
+        else:
+            embedding = await get_embedding(input, self.config.EMBEDDING_MODEL)
+            retrieved_priors = await self.database.search_similar(
+                self.config.MESSAGES_COLLECTION,
+                embedding,
+                self.config.PRIOR_LIMIT,
+                search_filter=self.PRIOR_FILTER,
+                query_text=input
+            )
+            retrieved_priors = group_by_thread(retrieved_priors)
+
+        # Pack priors, then recent history, into the prompt budget
+        builder = ContextBuilder(self.config.PROMPT_TOKEN_BUDGET, get_token_counter(self.config.CHAT_MODEL))
+        base_messages = self._step_messages(experience_prompt, input, context)
+        for message in base_messages:
+            builder.reserve(message["content"])
+        builder.add_section("priors", retrieved_priors, priority=1, max_tokens=self.config.PRIOR_TOKEN_BUDGET)
+        history = [{"id": message.id, "content": f"{message.author}: {message.content}"} for message in reversed(messages)]
+        builder.add_section("history", history, priority=2)
+        packed = builder.build()
+        retrieved_priors = packed["priors"]
 
         # Format priors for context
-        context = "\n".join([f"Source {i+1}: {prior['content']}" for i, prior in enumerate(retrieved_priors)])
-
-        messages = [
-            {"role": "system", "content": experience_prompt},
-            {"role": "user", "content": f"Sources:\n{context}\n\nUser query: {input}"}
-        ]
-        result = await structured_chat_completion(
-            messages,
-            self.config,
-            response_format={"type": "json_object"}
-        )
-        try:
-            content = json.loads(result["content"])
-            return content.get("synthesis", result["content"]), retrieved_priors
-        except:
+        sources = "\n".join([f"Source {i+1}: {prior['content']}" for i, prior in enumerate(retrieved_priors)])
+        sources = f"Sources:\n{sources}"
+        if packed["history"]:
+            conversation = "\n".join(item["content"] for item in reversed(packed["history"]))
+            sources = f"Conversation:\n{conversation}\n\n{sources}"
+
+        messages = base_messages + [{"role": "user", "content": sources}]
+        result = await self._complete(StepEnum.EXPERIENCE, messages)
+        response = parse_structured_response(result["content"], ExperienceResponse)
+        if response is None:
+            self._report_failure(result)
             return result["content"], retrieved_priors
+        return response.synthesis, retrieved_priors
 
-    async def run_intention(self, input: str, messages: List[Message]) -> str:
+    async def run_intention(self, input: str, messages: List[Message], context: Optional[CycleContext] = None) -> str:
         logger.info("Running INTENTION step")
         intention_prompt = """
         This is step 3 of the Chorus Cycle, Intention: Analyze your planned actions and consider potential consequences.
@@ -233,23 +592,16 @@ class ChorusCycle:
             "confidence": 0.8  // A number between 0 and 1
         }
         """
-        messages = [
-            {"role": "system", "content": intention_prompt},
-            {"role": "user", "content": input}
-        ]
-        result = await structured_chat_completion(
-            messages,
-            self.config,
-            response_format={"type": "json_object"}
-        )
-        try:
-            content = json.loads(result["content"])
-            return f"Explicit: {content.get('explicit_intent')}\nImplicit: {content.get('implicit_intent')}"
-        except Exception as e:
-            logger.error(f"Error parsing intention response: {e}")
+        messages = self._step_messages(intention_prompt, input, context)
+        result = await self._complete(StepEnum.INTENTION, messages)
+        response = parse_structured_response(result["content"], IntentionResponse)
+        if response is None:
+            logger.error("Error parsing intention response")
+            _step_failed.set(True)
             return "Error analyzing intention"
+        return f"Explicit: {response.explicit_intent}\nImplicit: {response.implicit_intent}"
 
-    async def run_observation(self, input: str, messages: List[Message]) -> str:
+    async def run_observation(self, input: str, messages: List[Message], context: Optional[CycleContext] = None) -> str:
         logger.info("Running OBSERVATION step")
         observation_prompt = """
         This is step 4 of the Chorus Cycle, Observation: Reflect on your analysis and intentions.
@@ -264,23 +616,16 @@ class ChorusCycle:
             "confidence": 0.8  // A number between 0 and 1
         }
         """
-        messages = [
-            {"role": "system", "content": observation_prompt},
-            {"role": "user", "content": input}
-        ]
-        result = await structured_chat_completion(
-            messages,
-            self.config,
-            response_format={"type": "json_object"}
-        )
-        try:
-            content = json.loads(result["content"])
-            return content["context_analysis"]
-        except Exception as e:
-            logger.error(f"Error parsing observation response: {e}")
+        messages = self._step_messages(observation_prompt, input, context)
+        result = await self._complete(StepEnum.OBSERVATION, messages)
+        response = parse_structured_response(result["content"], ObservationResponse)
+        if response is None:
+            logger.error("Error parsing observation response")
+            _step_failed.set(True)
             return "Error making observations"
+        return response.context_analysis
 
-    async def run_update(self, input: str, messages: List[Message]) -> Dict[str, Any]:
+    async def run_update(self, input: str, messages: List[Message], context: Optional[CycleContext] = None) -> Dict[str, Any]:
         logger.info("Running UPDATE step")
         update_prompt = """
         This is step 5 of the Chorus Cycle, Update: Based on your observations,
@@ -288,38 +633,32 @@ class ChorusCycle:
         You must make a binary choice:
         - Return loop: true if you need another iteration through the cycle
         - Return loop: false if you're ready to yield the final response
-        Explain your reasoning for this decision.
+        Explain your reasoning for this decision, and rate separately how confident
+        you are that the current answer already fully addresses the prompt.
 
         Respond in this JSON format:
         {
             "loop": true,  // or false
             "reasoning": "Explanation for the decision",
-            "confidence": 0.8,  // A number between 0 and 1
+            "answer_confidence": 0.6,  // Between 0 and 1: how likely the current answer is good enough as it is
             "key_insights": ["List of key insights that led to this decision"]
         }
         """
-        messages = [
-            {"role": "system", "content": update_prompt},
-            {"role": "user", "content": input}
-        ]
-        result = await structured_chat_completion(
-            messages,
-            self.config,
-            response_format={"type": "json_object"}
-        )
-        try:
-            content = json.loads(result["content"])
-            return {
-                "loop": content["loop"],
-                "reasoning": content["reasoning"],
-                "insights": content.get("key_insights", []),
-                "confidence": content.get("confidence", 0.5)
-            }
-        except Exception as e:
-            logger.error(f"Error parsing update response: {e}")
+        messages = self._step_messages(update_prompt, input, context)
+        result = await self._complete(StepEnum.UPDATE, messages)
+        response = parse_structured_response(result["content"], UpdateResponse)
+        if response is None:
+            logger.error("Error parsing update response")
+            _step_failed.set(True)
             return {"loop": False, "reasoning": "Error in update step"}
+        return {
+            "loop": response.loop,
+            "reasoning": response.reasoning,
+            "insights": response.key_insights,
+            "answer_confidence": response.answer_confidence
+        }
 
-    async def run_yield(self, input: str, messages: List[Message]) -> str:
+    async def run_yield(self, input: str, messages: List[Message], context: Optional[CycleContext] = None) -> str:
         logger.info("Running YIELD step")
         yield_prompt = """
         This is the final step of the Chorus Cycle, Yield: Synthesize the accumulated context
@@ -334,44 +673,77 @@ class ChorusCycle:
             "synthesis_quality": "Brief assessment of response completeness"
         }
         """
-        messages = [
-            {"role": "system", "content": yield_prompt},
-            {"role": "user", "content": input}
-        ]
-        result = await structured_chat_completion(
-            messages,
-            self.config,
-            response_format={"type": "json_object"}
-        )
-        logger.info(f"Yield result: {result}")
-        try:
-            content = json.loads(result["content"])
-            return content.get("final_response", result["content"])
-        except Exception as e:
-            logger.error(f"Error parsing yield response: {e}")
+        messages = self._step_messages(yield_prompt, input, context)
+        result = await self._complete(StepEnum.YIELD, messages)
+        logger.debug("Yield result: %s", result)
+        response = parse_structured_response(result["content"], YieldResponse)
+        if response is None:
+            logger.error("Error parsing yield response")
+            _step_failed.set(True)
             return "Error generating final response"
+        return response.final_response
+
+    @staticmethod
+    def _report_failure(result: Dict[str, Any]):
+        # Unparseable JSON from the model is still its answer; only a failed call is a placeholder
+        if result.get("status") != "success":
+            _step_failed.set(True)
 
     async def handle_connection_error(self, error: Exception, state: ConnectionState) -> Tuple[ConnectionState, str]:
         new_state = state.copy(deep=True)
         new_state.error_state = {"message": str(error)}
         return new_state, f"An error occurred: {str(error)}"
 
-    async def _commit_message(self, role: str, content: str, step: str, thread_id: str, embedding: Optional[List[float]] = None):
-        """Record a message in the database with the given role, content, and step."""
+    async def _commit_message(
+        self, role: str, content: str, step: str, thread_id: str, embedding: Optional[List[float]] = None,
+        seq: Optional[int] = None, status: str = MessageStatus.APPROVED.value
+    ):
+        """
+        Record a message in the database with the given role, content, and step.
+
+        With a write-behind writer the message is queued and embedded off the
+        request path; the returned future resolves once it has been stored.
+        """
+        if self.writer is not None:
+            return self.writer.submit(MessageRecord(
+                id=str(uuid.uuid4()),
+                thread_id=thread_id,
+                role=role,
+                content=content,
+                created_at=datetime.now(UTC).isoformat(),
+                vector=embedding,
+                step=step,
+                status=status,
+                seq=seq
+            ))
+
         if embedding is None:
             embedding = await get_embedding(content, self.config.EMBEDDING_MODEL)
 
-        if not embedding:
+        if not embedding or not any(embedding):
             logger.error("Failed to generate embedding for the message.")
             return
 
-        message = Message(
+        message = MessageRecord(
             id=str(uuid.uuid4()),
             thread_id=thread_id,
             role=role,
             content=content,
             created_at=datetime.now(UTC).isoformat(),
             vector=embedding,
-            step=step
+            step=step,
+            status=status,
+            seq=seq
         )
         await self.database.save_message(message)
+
+    async def _persist_output(
+        self, role: str, content: Any, step: Optional[str], thread_id: str, seq: Optional[int] = None,
+        status: str = MessageStatus.APPROVED.value
+    ):
+        """Queue a cycle input or step output for storage; a no-op without a write-behind writer."""
+        if self.writer is None or not content:
+            return
+        if not isinstance(content, str):
+            content = json.dumps(content)
+        await self._commit_message(role, content, step, thread_id, seq=seq, status=status)
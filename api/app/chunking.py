@@ -0,0 +1,68 @@
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+import tiktoken
+
+# Rough characters per token, used to size encode windows and when no tokenizer is available
+CHARS_PER_TOKEN = 4
+
+def _token_chars(encoder: tiktoken.Encoding, tokens: List[int]) -> int:
+    """Number of whole characters covered by `tokens`; a character split across the last token is left out."""
+    return len(encoder.decode_bytes(tokens).decode("utf-8", errors="ignore"))
+
+def iter_chunk_spans(
+    text: str,
+    chunk_tokens: int,
+    overlap_tokens: int,
+    encoder: Optional[tiktoken.Encoding] = None
+) -> Iterator[Tuple[int, int]]:
+    """
+    Yield (start, end) character offsets of overlapping chunks of `text`.
+
+    Chunks hold at most `chunk_tokens` tokens of `encoder` and consecutive
+    chunks share `overlap_tokens`. Only a window a little larger than one
+    chunk is tokenized at a time, so the document is never tokenized or
+    copied whole. Without an encoder, sizes are estimated at CHARS_PER_TOKEN
+    characters per token.
+    """
+    if chunk_tokens <= 0:
+        raise ValueError("chunk_tokens must be positive")
+    overlap_tokens = max(0, min(overlap_tokens, chunk_tokens - 1))
+    size = len(text)
+    start = 0
+    while start < size:
+        if encoder is None:
+            end = min(size, start + chunk_tokens * CHARS_PER_TOKEN)
+            next_start = start + (chunk_tokens - overlap_tokens) * CHARS_PER_TOKEN
+        else:
+            window = (chunk_tokens + 1) * CHARS_PER_TOKEN
+            while True:
+                stop = min(size, start + window)
+                tokens = encoder.encode_ordinary(text[start:stop])
+                if len(tokens) > chunk_tokens or stop >= size:
+                    break
+                window *= 2
+            if len(tokens) <= chunk_tokens:
+                yield start, size
+                return
+            end = start + max(1, _token_chars(encoder, tokens[:chunk_tokens]))
+            next_start = start + _token_chars(encoder, tokens[:chunk_tokens - overlap_tokens])
+
+        yield start, end
+        if end >= size:
+            return
+        start = next_start if next_start > start else end
+
+def iter_chunks(
+    text: str,
+    chunk_tokens: int,
+    overlap_tokens: int,
+    encoder: Optional[tiktoken.Encoding] = None
+) -> Iterator[str]:
+    """Lazily yield token-bounded chunks of `text`, slicing each one only when it is requested."""
+    for start, end in iter_chunk_spans(text, chunk_tokens, overlap_tokens, encoder):
+        yield text[start:end]
+
+def batched(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+class SQLiteCompletionStore:
+    """
+    Disk tier for cached completions, one row per key in a local SQLite file.
+
+    Calls are synchronous and serialized by a lock; CompletionCache runs them
+    in a worker thread so they never block the event loop.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100000):
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, expires_at REAL NOT NULL, stored_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS completions_stored_at ON completions (stored_at)")
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._db.execute("SELECT content, expires_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] < time.time():
+                self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            return row
+
+    def put(self, key: str, content: str, expires_at: float):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions (key, content, expires_at, stored_at) VALUES (?, ?, ?, ?)",
+                (key, content, expires_at, time.time())
+            )
+            # Expired rows go first, then the oldest beyond the size limit
+            self._db.execute("DELETE FROM completions WHERE expires_at < ?", (time.time(),))
+            self._db.execute(
+                "DELETE FROM completions WHERE key IN ("
+                "SELECT key FROM completions ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class CompletionCache:
+    """
+    Cache of step completions: an in-memory LRU over an optional SQLite tier.
+
+    Keys cover the model, the step, a hash of the full message list and the
+    sampling parameters, so a hit is only served for the exact same prompt.
+    Entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0, disk: Optional[SQLiteCompletionStore] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk = disk
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    @staticmethod
+    def key(model: str, step: str, messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+        digest = hashlib.sha256(json.dumps([messages, params], sort_keys=True).encode("utf-8")).hexdigest()
+        return f"{model}:{step}:{digest}"
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] >= time.time():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        self._entries.pop(key, None)
+        if self.disk is not None:
+            entry = await asyncio.to_thread(self.disk.get, key)
+            if entry is not None:
+                self.disk_hits += 1
+                self._remember(key, entry[0], entry[1])
+                return entry[0]
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, content: str):
+        expires_at = time.time() + self.ttl
+        self._remember(key, content, expires_at)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.put, key, content, expires_at)
+
+    def _remember(self, key: str, content: str, expires_at: float):
+        self._entries[key] = (content, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "size": len(self._entries)
+        }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+_completion_cache: Optional[CompletionCache] = None
+
+def get_completion_cache(config: Optional[Config] = None) -> CompletionCache:
+    """Return the process-wide completion cache, creating it on first use."""
+    global _completion_cache
+    if _completion_cache is None:
+        config = config or Config()
+        disk = None
+        if config.COMPLETION_CACHE_PATH:
+            disk = SQLiteCompletionStore(config.COMPLETION_CACHE_PATH, config.COMPLETION_CACHE_DISK_SIZE)
+        _completion_cache = CompletionCache(config.COMPLETION_CACHE_SIZE, config.COMPLETION_CACHE_TTL, disk)
+    return _completion_cache
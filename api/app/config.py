@@ -7,10 +7,49 @@ class Config:
     # Qdrant configuration
     QDRANT_URL: str = os.getenv("QDRANT_URL", "http://localhost:6333")
     QDRANT_API_KEY: str = os.getenv("QDRANT_API_KEY", "")
+    QDRANT_POOL_SIZE: int = int(os.getenv("QDRANT_POOL_SIZE", "32"))
+    QDRANT_MAX_CONCURRENCY: int = int(os.getenv("QDRANT_MAX_CONCURRENCY", "64"))
     MESSAGES_COLLECTION: str = "choir"
     CHAT_THREADS_COLLECTION: str = "chat_threads"
     USERS_COLLECTION: str = "users"
-    SEARCH_LIMIT: int = 80
+    # Where search_similar/save_messages keep vectors: "qdrant", "hot" (local cache
+    # in front of Qdrant, warmed at startup) or "local" (in-process only, for tests and benchmarks)
+    VECTOR_STORE: str = os.getenv("VECTOR_STORE", "qdrant")
+    LOCAL_INDEX_PATH: str = os.getenv("LOCAL_INDEX_PATH", "")  # directory for memory-mapped indexes; empty keeps them in RAM
+    LOCAL_INDEX_CAPACITY: int = int(os.getenv("LOCAL_INDEX_CAPACITY", "1024"))  # initial rows; grows as needed
+    LOCAL_INDEX_QUANTIZE: bool = os.getenv("LOCAL_INDEX_QUANTIZE", "False").lower() in ("true", "1", "t")  # int8 rows
+    # Compact collection storage, applied by scripts/migrate_compact_collections.py:
+    # "scalar" (int8, 4x smaller), "product" (PQ at PRODUCT_COMPRESSION) or "none"
+    VECTOR_QUANTIZATION: str = os.getenv("VECTOR_QUANTIZATION", "none")
+    QUANTIZATION_ALWAYS_RAM: bool = os.getenv("QUANTIZATION_ALWAYS_RAM", "True").lower() in ("true", "1", "t")
+    PRODUCT_COMPRESSION: str = os.getenv("PRODUCT_COMPRESSION", "x16")  # x4, x8, x16, x32 or x64
+    VECTORS_ON_DISK: bool = os.getenv("VECTORS_ON_DISK", "False").lower() in ("true", "1", "t")  # originals on disk, codes in RAM
+    # Quantized searches fetch SEARCH_OVERSAMPLING x the limit on codes, then rescore them with the original vectors
+    SEARCH_OVERSAMPLING: float = float(os.getenv("SEARCH_OVERSAMPLING", "2.0"))
+    SEARCH_RESCORE: bool = os.getenv("SEARCH_RESCORE", "True").lower() in ("true", "1", "t")
+    SEARCH_LIMIT: int = 80  # candidates fetched before reranking
+    # Hybrid retrieval: a local BM25 index over message content, fused with dense results by reciprocal rank
+    HYBRID_SEARCH: bool = os.getenv("HYBRID_SEARCH", "True").lower() in ("true", "1", "t")
+    RRF_K: int = int(os.getenv("RRF_K", "60"))  # higher flattens the weight of top ranks
+    BM25_K1: float = float(os.getenv("BM25_K1", "1.2"))
+    BM25_B: float = float(os.getenv("BM25_B", "0.75"))
+    # Prior selection: MMR trades relevance (1.0) against diversity (0.0)
+    PRIOR_LIMIT: int = int(os.getenv("PRIOR_LIMIT", "12"))
+    MMR_DIVERSITY: float = float(os.getenv("MMR_DIVERSITY", "0.7"))
+    DUPLICATE_SIMILARITY: float = float(os.getenv("DUPLICATE_SIMILARITY", "0.95"))  # cosine; at or above counts as a duplicate
+    PRIORS_PER_THREAD: int = int(os.getenv("PRIORS_PER_THREAD", "3"))
+    PRIOR_TOKEN_BUDGET: int = int(os.getenv("PRIOR_TOKEN_BUDGET", "3000"))
+    # Prompt tokens per step; with MAX_TOKENS for the reply this must fit the model's context window
+    PROMPT_TOKEN_BUDGET: int = int(os.getenv("PROMPT_TOKEN_BUDGET", "12000"))
+    # Persist prompts and step outputs through the write-behind queue
+    PERSIST_MESSAGES: bool = os.getenv("PERSIST_MESSAGES", "True").lower() in ("true", "1", "t")
+    WRITE_BEHIND_FLUSH_SIZE: int = int(os.getenv("WRITE_BEHIND_FLUSH_SIZE", "64"))
+    WRITE_BEHIND_FLUSH_INTERVAL: float = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.5"))  # seconds
+    WRITE_BEHIND_MAX_RETRIES: int = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "3"))  # per batch, for transient failures
+    WRITE_BEHIND_RETRY_BACKOFF: float = float(os.getenv("WRITE_BEHIND_RETRY_BACKOFF", "0.5"))  # seconds, doubled per retry
+    THREAD_PAGE_SIZE: int = int(os.getenv("THREAD_PAGE_SIZE", "50"))  # messages per thread_messages frame
+    RETRIEVAL_CACHE_TTL: float = float(os.getenv("RETRIEVAL_CACHE_TTL", "30"))  # seconds
+    RETRIEVAL_CACHE_SIZE: int = int(os.getenv("RETRIEVAL_CACHE_SIZE", "256"))
     VECTOR_SIZE: int = 1536
 
     # API configuration
@@ -32,17 +71,69 @@ class Config:
 
     # Model configuration
     EMBEDDING_MODEL: str = "text-embedding-ada-002"
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "16"))
+    EMBEDDING_BATCH_WAIT: float = float(os.getenv("EMBEDDING_BATCH_WAIT", "0.01"))  # seconds
+    EMBEDDING_CACHE_SIZE: int = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))  # in-memory entries
+    EMBEDDING_CACHE_PATH: str = os.getenv("EMBEDDING_CACHE_PATH", "")  # empty disables the disk tier
+    EMBEDDING_CACHE_DISK_CAPACITY: int = int(os.getenv("EMBEDDING_CACHE_DISK_CAPACITY", "100000"))
     CHAT_MODEL: str = "azure/gpt-4o-2024-08-06"
     SUMMARY_MODEL: str = "azure/gpt-4o-mini"
     MAX_TOKENS: int = 4000
     TEMPERATURE: float = 0.7
+    # Per-step routing: lightweight steps run on the fast model, and each route
+    # falls back to the other model if its own fails after retries
+    FAST_MODEL: str = os.getenv('FAST_MODEL', SUMMARY_MODEL)
+    STEP_ROUTES: dict = {
+        "action": {"model": CHAT_MODEL, "fallback_model": FAST_MODEL},
+        "experience": {"model": CHAT_MODEL, "fallback_model": FAST_MODEL},
+        "intention": {"model": FAST_MODEL, "max_tokens": 1000, "temperature": 0.3, "fallback_model": CHAT_MODEL},
+        "observation": {"model": FAST_MODEL, "max_tokens": 1500, "fallback_model": CHAT_MODEL},
+        "update": {"model": FAST_MODEL, "max_tokens": 500, "temperature": 0.2, "fallback_model": CHAT_MODEL},
+        "yield": {"model": CHAT_MODEL, "fallback_model": FAST_MODEL},
+    }
 
-    # Chunking configuration
-    CHUNK_SIZE: int = 10000
-    CHUNK_OVERLAP: int = 5000
+    # Completion cache for repeated identical step prompts (opt-in); steps sampled
+    # above COMPLETION_CACHE_MAX_TEMPERATURE always call the model, so by default only
+    # near-deterministic steps are replayed and sampled steps keep their variety
+    COMPLETION_CACHE: bool = os.getenv('COMPLETION_CACHE', 'False').lower() in ('true', '1', 't')
+    COMPLETION_CACHE_SIZE: int = int(os.getenv('COMPLETION_CACHE_SIZE', '1024'))  # in-memory entries
+    COMPLETION_CACHE_TTL: float = float(os.getenv('COMPLETION_CACHE_TTL', '3600'))  # seconds
+    COMPLETION_CACHE_PATH: str = os.getenv('COMPLETION_CACHE_PATH', '')  # SQLite file; empty disables the disk tier
+    COMPLETION_CACHE_DISK_SIZE: int = int(os.getenv('COMPLETION_CACHE_DISK_SIZE', '100000'))
+    COMPLETION_CACHE_MAX_TEMPERATURE: float = float(os.getenv('COMPLETION_CACHE_MAX_TEMPERATURE', '0.2'))
+
+    # LLM gateway configuration
+    LLM_BACKEND: str = os.getenv('LLM_BACKEND', 'litellm')  # "fake" answers locally without calling Azure
+    LLM_MAX_CONCURRENCY: int = int(os.getenv('LLM_MAX_CONCURRENCY', '16'))  # in-flight completions per process
+    LLM_TIMEOUT: float = float(os.getenv('LLM_TIMEOUT', '60'))  # seconds per attempt, or between stream chunks
+    LLM_MAX_RETRIES: int = int(os.getenv('LLM_MAX_RETRIES', '3'))
+    LLM_RETRY_BACKOFF: float = float(os.getenv('LLM_RETRY_BACKOFF', '0.5'))  # seconds, doubled per retry
+    # Send a duplicate request once a call runs past this latency percentile; 0 disables hedging
+    LLM_HEDGE_PERCENTILE: float = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+    LLM_HEDGE_MIN_SAMPLES: int = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+
+    # Chorus cycle configuration
+    # Run steps that don't depend on each other concurrently; False keeps strict step-by-step order
+    PARALLEL_STEPS: bool = os.getenv('PARALLEL_STEPS', 'True').lower() in ('true', '1', 't')
+    # Per-cycle budget; when it runs out YIELD is forced with the best partial results
+    CYCLE_MAX_ITERATIONS: int = int(os.getenv('CYCLE_MAX_ITERATIONS', '3'))
+    CYCLE_MAX_TOKENS: int = int(os.getenv('CYCLE_MAX_TOKENS', '60000'))
+    CYCLE_TIME_LIMIT: float = float(os.getenv('CYCLE_TIME_LIMIT', '120'))  # seconds
+    # Stop looping once UPDATE rates the current answer at least this likely to be good enough
+    LOOP_EXIT_CONFIDENCE: float = float(os.getenv('LOOP_EXIT_CONFIDENCE', '0.9'))
+    # Step outputs over this many tokens are summarized with SUMMARY_MODEL before joining the cycle context
+    CONTEXT_SUMMARY_THRESHOLD: int = int(os.getenv('CONTEXT_SUMMARY_THRESHOLD', '300'))
+    CONTEXT_SUMMARY_TOKENS: int = int(os.getenv('CONTEXT_SUMMARY_TOKENS', '150'))
+
+    # Chunking configuration, in embedding-model tokens (text-embedding-ada-002 accepts up to 8191)
+    CHUNK_SIZE: int = int(os.getenv('CHUNK_SIZE', '8000'))
+    CHUNK_OVERLAP: int = int(os.getenv('CHUNK_OVERLAP', '200'))
 
     # WebSocket configuration
     WS_URL: str = os.getenv('WS_URL', 'ws://localhost:8000/ws')
+    WS_SEND_QUEUE_SIZE: int = int(os.getenv('WS_SEND_QUEUE_SIZE', '64'))  # pending frames per socket
+    # Stream step tokens to the client as chorus_response delta frames
+    STREAM_RESPONSES: bool = os.getenv('STREAM_RESPONSES', 'True').lower() in ('true', '1', 't')
 
     # Debug mode
     DEBUG: bool = os.getenv('DEBUG', 'False').lower() in ('true', '1', 't')
@@ -0,0 +1,134 @@
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait after a failed tokenizer load before trying again
+ENCODER_RETRY_INTERVAL = 60.0
+
+_encoders: Dict[str, tiktoken.Encoding] = {}
+_encoder_failures: Dict[str, float] = {}  # model -> time.monotonic() of the last failed load
+
+def get_encoder(model: str) -> Optional[tiktoken.Encoding]:
+    """
+    Return the tiktoken encoding for `model`, loaded once per process.
+
+    Provider prefixes such as "azure/" are ignored; unknown models fall back to
+    cl100k_base. Returns None when no encoding can be loaded (for example when
+    the BPE file cannot be downloaded), in which case counts are estimated.
+    A failed load is not remembered for good: it is retried once
+    ENCODER_RETRY_INTERVAL has passed.
+    """
+    encoder = _encoders.get(model)
+    if encoder is not None:
+        return encoder
+    failed_at = _encoder_failures.get(model)
+    if failed_at is not None and time.monotonic() - failed_at < ENCODER_RETRY_INTERVAL:
+        return None
+    name = model.split("/")[-1]
+    try:
+        try:
+            encoder = tiktoken.encoding_for_model(name)
+        except KeyError:
+            encoder = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"Could not load tokenizer for {model}, estimating token counts: {e}")
+        _encoder_failures[model] = time.monotonic()
+        return None
+    _encoder_failures.pop(model, None)
+    _encoders[model] = encoder
+    return encoder
+
+def count_tokens(text: str, model: str) -> int:
+    encoder = get_encoder(model)
+    if encoder is None:
+        return max(1, len(text) // 4)
+    return len(encoder.encode(text, disallowed_special=()))
+
+class TokenCounter:
+    """Token counts for one model, memoized per message id so stored messages are encoded once."""
+
+    def __init__(self, model: str, max_entries: int = 10000):
+        self.model = model
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+
+    def count(self, text: str, key: Optional[str] = None) -> int:
+        if key is None:
+            return count_tokens(text, self.model)
+        tokens = self._counts.get(key)
+        if tokens is None:
+            tokens = count_tokens(text, self.model)
+            # Estimates are not memoized, so exact counts take over once the tokenizer loads
+            if get_encoder(self.model) is not None:
+                self._counts[key] = tokens
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        else:
+            self._counts.move_to_end(key)
+        return tokens
+
+_counters: Dict[str, TokenCounter] = {}
+
+def get_token_counter(model: str) -> TokenCounter:
+    """Return the process-wide token counter for `model`, creating it on first use."""
+    counter = _counters.get(model)
+    if counter is None:
+        counter = TokenCounter(model)
+        _counters[model] = counter
+    return counter
+
+@dataclass
+class ContextSection:
+    name: str
+    priority: int
+    max_tokens: Optional[int]
+    items: List[Dict[str, Any]] = field(default_factory=list)
+
+class ContextBuilder:
+    """
+    Pack prompt context into a fixed token budget by priority.
+
+    Text added with reserve() (system prompt, user input) is always kept.
+    Sections are then filled lowest priority number first; within a section
+    items are taken in the order given, and an item that does not fit is
+    skipped so smaller ones after it can still use the space. Each section
+    can also carry its own cap.
+    """
+
+    def __init__(self, max_tokens: int, counter: TokenCounter):
+        self.max_tokens = max_tokens
+        self.counter = counter
+        self.reserved = 0
+        self._sections: List[ContextSection] = []
+
+    def reserve(self, text: str) -> int:
+        tokens = self.counter.count(text)
+        self.reserved += tokens
+        return tokens
+
+    def add_section(self, name: str, items: List[Dict[str, Any]], priority: int, max_tokens: Optional[int] = None):
+        """Add candidate items, each a dict with "content" and optionally an "id" used to memoize its count."""
+        self._sections.append(ContextSection(name, priority, max_tokens, list(items)))
+
+    def build(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Return the items kept for each section, in their original order."""
+        remaining = self.max_tokens - self.reserved
+        packed: Dict[str, List[Dict[str, Any]]] = {}
+        for section in sorted(self._sections, key=lambda s: s.priority):
+            allowance = remaining if section.max_tokens is None else min(remaining, section.max_tokens)
+            kept = []
+            for item in section.items:
+                tokens = self.counter.count(item.get("content", ""), item.get("id"))
+                if tokens <= allowance:
+                    kept.append(item)
+                    allowance -= tokens
+                    remaining -= tokens
+            if len(kept) < len(section.items):
+                logger.info(f"Context section {section.name} kept {len(kept)} of {len(section.items)} items")
+            packed[section.name] = kept
+        return packed
@@ -1,47 +1,305 @@
-from qdrant_client import QdrantClient, models
+from qdrant_client import AsyncQdrantClient, models
 from qdrant_client.http.exceptions import ApiException, UnexpectedResponse
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, UTC
+from collections import OrderedDict
+import asyncio
+import hashlib
+import time
 import uuid
+import numpy as np
 from .config import Config
 from .utils import logger
-from .models import User, Thread, Message
+from .models import User, Thread, Message, MessageRecord
+from .retrieval import mmr_select, reciprocal_rank_fusion
+from .sparse_index import BM25Index
+from .vector_store import CachedVectorStore, LocalVectorStore, PayloadFilter, QdrantVectorStore, VectorHit, VectorPoint, VectorStore
+
+def create_qdrant_client(config: Config) -> AsyncQdrantClient:
+    """Create the process-wide async Qdrant client with a pooled HTTP connection."""
+    return AsyncQdrantClient(
+        url=config.QDRANT_URL,
+        api_key=config.QDRANT_API_KEY,
+        timeout=60,  # Add timeout for cloud connection
+        https=True,  # Force HTTPS for cloud connection
+        pool_size=config.QDRANT_POOL_SIZE
+    )
+
+class RetrievalCache:
+    """
+    Short-TTL cache of search results keyed by collection, limit, filter and query vector.
+
+    A write drops the entries whose filter admits any of the written
+    payloads, so cached priors never hide a message saved since; writes a
+    filter excludes, such as intermediate step outputs under the prior
+    filter, leave its entries in place.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        # Write counters per (collection, filter) searched so far; few distinct filters are ever used
+        self._generations: Dict[Tuple[str, Optional[PayloadFilter]], int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(
+        collection: str, query_vector: List[float], limit: int, search_filter: Optional[PayloadFilter] = None, query_text: Optional[str] = None
+    ) -> tuple:
+        digest = hashlib.sha1(np.asarray(query_vector, dtype=np.float32).tobytes()).hexdigest()
+        return (collection, limit, search_filter, query_text, digest)
+
+    def get(self, key: tuple) -> Optional[List[Dict[str, Any]]]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return [dict(result) for result in entry[1]]
+
+    def generation(self, collection: str, search_filter: Optional[PayloadFilter] = None) -> int:
+        return self._generations.setdefault((collection, search_filter), 0)
+
+    def put(self, key: tuple, results: List[Dict[str, Any]], generation: int):
+        # A write this search could see landed while it was in flight; its results may be stale
+        if generation != self.generation(key[0], key[2]):
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, [dict(result) for result in results])
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, collection: str, payloads: Optional[List[Dict[str, Any]]] = None):
+        """Drop results a write to `collection` may have changed; without `payloads` every entry goes."""
+        def affected(search_filter: Optional[PayloadFilter]) -> bool:
+            return payloads is None or search_filter is None or any(search_filter.matches(payload) for payload in payloads)
+
+        for generation_key in self._generations:
+            if generation_key[0] == collection and affected(generation_key[1]):
+                self._generations[generation_key] += 1
+        for key in [key for key in self._entries if key[0] == collection and affected(key[2])]:
+            del self._entries[key]
+
+def collection_params(config: Config, vectors: Optional[models.VectorParams] = None) -> Dict[str, Any]:
+    """
+    create_collection arguments for the configured vector storage.
+
+    Size and distance come from `vectors` (an existing collection's params)
+    when given, else VECTOR_SIZE and cosine. With quantization the compressed codes are searched (kept in RAM with
+    QUANTIZATION_ALWAYS_RAM) while the original vectors can live on disk and
+    are only read to rescore the oversampled candidates.
+    """
+    if config.VECTOR_QUANTIZATION == "scalar":
+        quantization = models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8, quantile=0.99, always_ram=config.QUANTIZATION_ALWAYS_RAM
+            )
+        )
+    elif config.VECTOR_QUANTIZATION == "product":
+        quantization = models.ProductQuantization(
+            product=models.ProductQuantizationConfig(
+                compression=models.CompressionRatio(config.PRODUCT_COMPRESSION), always_ram=config.QUANTIZATION_ALWAYS_RAM
+            )
+        )
+    elif config.VECTOR_QUANTIZATION == "none":
+        quantization = None
+    else:
+        raise ValueError(f"Unknown VECTOR_QUANTIZATION {config.VECTOR_QUANTIZATION!r}; expected scalar, product or none")
+    return {
+        "vectors_config": models.VectorParams(
+            size=vectors.size if vectors else config.VECTOR_SIZE,
+            distance=vectors.distance if vectors else models.Distance.COSINE,
+            on_disk=config.VECTORS_ON_DISK
+        ),
+        "quantization_config": quantization,
+        "on_disk_payload": config.VECTORS_ON_DISK
+    }
+
+def search_params(config: Config) -> Optional[models.SearchParams]:
+    """Oversampling and rescoring for searches over quantized collections; None when vectors are stored whole."""
+    if config.VECTOR_QUANTIZATION == "none":
+        return None
+    return models.SearchParams(
+        quantization=models.QuantizationSearchParams(rescore=config.SEARCH_RESCORE, oversampling=config.SEARCH_OVERSAMPLING)
+    )
+
+def create_vector_store(config: Config, qdrant: QdrantVectorStore) -> VectorStore:
+    """Pick where search_similar and save_messages keep vectors, per VECTOR_STORE."""
+    if config.VECTOR_STORE == "qdrant":
+        return qdrant
+    local = LocalVectorStore(config.VECTOR_SIZE, config.LOCAL_INDEX_PATH or None, config.LOCAL_INDEX_CAPACITY, config.LOCAL_INDEX_QUANTIZE)
+    if config.VECTOR_STORE == "local":
+        return local
+    if config.VECTOR_STORE == "hot":
+        return CachedVectorStore(local, qdrant)
+    raise ValueError(f"Unknown VECTOR_STORE {config.VECTOR_STORE!r}; expected qdrant, hot or local")
 
 class DatabaseClient:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, client: Optional[AsyncQdrantClient] = None, vector_store: Optional[VectorStore] = None):
         self.config = config
-        # Initialize with cloud configuration
-        self.client = QdrantClient(
-            url=config.QDRANT_URL,
-            api_key=config.QDRANT_API_KEY,
-            timeout=60,  # Add timeout for cloud connection
-            https=True  # Force HTTPS for cloud connection
+        # Share the client created at startup; only build one when used standalone
+        self.client = client if client is not None else create_qdrant_client(config)
+        # Bound in-flight requests so bursts queue here instead of exhausting the pool
+        self._semaphore = asyncio.Semaphore(config.QDRANT_MAX_CONCURRENCY)
+        # Backs search_similar and save_messages; everything else talks to Qdrant directly
+        self.vector_store = vector_store or create_vector_store(
+            config, QdrantVectorStore(self.client, self._call, search_params(config))
         )
-        # Verify collections exist
+        self.retrieval_cache = RetrievalCache(config.RETRIEVAL_CACHE_TTL, config.RETRIEVAL_CACHE_SIZE)
+        # Keyword side of hybrid search over the messages collection; fill it with warm_sparse_index()
+        self.sparse_index = BM25Index(config.BM25_K1, config.BM25_B) if config.HYBRID_SEARCH else None
+        self._last_seq = 0
+
+    async def _call(self, method, **kwargs):
+        """Await a Qdrant client call under the in-flight request bound."""
+        async with self._semaphore:
+            return await method(**kwargs)
+
+    async def verify_collections(self):
+        """Verify required collections exist. Run once at startup, not per connection."""
+        aliases = None
         for collection in [self.config.MESSAGES_COLLECTION, self.config.CHAT_THREADS_COLLECTION, self.config.USERS_COLLECTION]:
-            if not self.client.collection_exists(collection):
+            if await self.client.collection_exists(collection):
+                continue
+            # Compacted collections are reached through an alias under the original name
+            if aliases is None:
+                aliases = await self._aliases()
+            if collection not in aliases:
                 raise RuntimeError(f"Required collection {collection} does not exist")
 
-    async def search_similar(self, collection: str, query_vector: List[float], limit: int = 10) -> List[Dict[str, Any]]:
+    async def _aliases(self) -> Dict[str, str]:
+        response = await self._call(self.client.get_aliases)
+        return {alias.alias_name: alias.collection_name for alias in response.aliases}
+
+    async def close(self):
+        self.vector_store.close()
+        await self.client.close()
+
+    async def warm_vector_cache(self, batch_size: int = 1024) -> int:
+        """Load the messages collection into a hot local vector cache. Returns points loaded."""
+        if not isinstance(self.vector_store, CachedVectorStore):
+            return 0
+        loaded = 0
+        offset = None
+        while True:
+            points, offset = await self._call(
+                self.client.scroll,
+                collection_name=self.config.MESSAGES_COLLECTION,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True
+            )
+            await self.vector_store.local.upsert(
+                self.config.MESSAGES_COLLECTION,
+                [VectorPoint(str(point.id), point.vector, point.payload or {}) for point in points]
+            )
+            loaded += len(points)
+            if offset is None:
+                logger.info(f"Warmed local vector cache with {loaded} messages")
+                return loaded
+
+    async def warm_sparse_index(self, batch_size: int = 1024) -> int:
+        """
+        Build the BM25 index from the messages collection. Returns messages indexed.
+
+        save_messages keeps it current afterwards; messages written by other
+        processes are not seen until the next warm-up.
+        """
+        if self.sparse_index is None:
+            return 0
+        indexed = 0
+        offset = None
+        while True:
+            points, offset = await self._call(
+                self.client.scroll,
+                collection_name=self.config.MESSAGES_COLLECTION,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False
+            )
+            for point in points:
+                payload = point.payload or {}
+                self.sparse_index.add(str(point.id), payload.get("content", ""), payload)
+            indexed += len(points)
+            if offset is None:
+                logger.info(f"Built keyword index over {indexed} messages")
+                return indexed
+
+    async def search_similar(
+        self,
+        collection: str,
+        query_vector: List[float],
+        limit: int = 10,
+        search_filter: Optional[PayloadFilter] = None,
+        query_text: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Return up to `limit` diverse messages similar to `query_vector`.
+
+        A candidate pool of SEARCH_LIMIT is fetched and reranked with MMR.
+        `search_filter` scopes the search by thread, role, step, status, token
+        value or creation time; it is applied inside the index, backed by the
+        payload indexes from ensure_indexes(), so excluded messages never take
+        a candidate slot. On a quantized collection the pool is found on the compressed codes with
+        SEARCH_OVERSAMPLING and rescored against the original vectors, so
+        compact storage costs little recall.
+
+        With `query_text` and HYBRID_SEARCH, BM25 keyword matches from the
+        sparse index are fused with the dense candidates by reciprocal rank,
+        so exact names and identifiers are found even when their embedding is
+        not close; the fused score then stands in for relevance in MMR.
+        """
         try:
             # Validate vector size
             if len(query_vector) != self.config.VECTOR_SIZE:
                 logger.error(f"Invalid vector size: got {len(query_vector)}, expected {self.config.VECTOR_SIZE}")
                 return []
 
-            logger.info(f"Searching with query embedding of length {len(query_vector)}, limit={limit}, collection={collection}")
-            search_result = self.client.search(
-                collection_name=collection,
-                query_vector=query_vector,
-                limit=self.config.SEARCH_LIMIT,
-                with_payload=True,
-                with_vectors=False
+            hybrid = bool(query_text) and self.sparse_index is not None and collection == self.config.MESSAGES_COLLECTION
+            cache_key = self.retrieval_cache.key(collection, query_vector, limit, search_filter, query_text if hybrid else None)
+            cached = self.retrieval_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Search served {len(cached)} cached results, collection={collection}")
+                return cached
+            generation = self.retrieval_cache.generation(collection, search_filter)
+
+            # Fetch a wider candidate pool with vectors so near-duplicates can be pruned here
+            candidates = max(limit, self.config.SEARCH_LIMIT)
+            logger.info(f"Searching with query embedding of length {len(query_vector)}, limit={limit}, candidates={candidates}, collection={collection}")
+            search_result = await self.vector_store.search(
+                collection, query_vector, candidates, with_vectors=True, search_filter=search_filter
             )
             logger.info(f"Search returned {len(search_result)} results")
 
-            return [
+            relevance = None
+            if hybrid:
+                search_result, relevance = await self._fuse_keyword_matches(
+                    collection, query_vector, query_text, search_result, candidates, search_filter
+                )
+
+            if search_result:
+                selected = mmr_select(
+                    query_vector,
+                    np.stack([result.vector for result in search_result]),
+                    limit,
+                    diversity=self.config.MMR_DIVERSITY,
+                    duplicate_threshold=self.config.DUPLICATE_SIMILARITY,
+                    groups=[result.payload.get('thread_id', '') for result in search_result],
+                    per_group=self.config.PRIORS_PER_THREAD,
+                    relevance=relevance
+                )
+                search_result = [search_result[i] for i in selected]
+                logger.info(f"Reranked to {len(search_result)} diverse results")
+
+            results = [
                 {
-                    "id": str(result.id),
+                    "id": result.id,
                     "content": result.payload.get('content', ''),
                     "thread_id": result.payload.get('thread_id', ''),
                     "created_at": result.payload.get('created_at', ''),
@@ -52,65 +310,310 @@ class DatabaseClient:
                 }
                 for result in search_result
             ]
+            self.retrieval_cache.put(cache_key, results, generation)
+            return results
         except Exception as e:
             logger.error(f"Error during search operation: {e}", exc_info=True)
             return []
 
-    async def save_message(self, message: Message):
-        """Save a message and update the thread's message list atomically."""
-        try:
-            # First, upsert the message
-            self.client.upsert(
+    async def _fuse_keyword_matches(
+        self,
+        collection: str,
+        query_vector: List[float],
+        query_text: str,
+        dense: List[VectorHit],
+        candidates: int,
+        search_filter: Optional[PayloadFilter]
+    ) -> Tuple[List[VectorHit], List[float]]:
+        """Fuse dense hits with BM25 matches; returns the fused pool and each hit's fused score, scaled to a top of 1."""
+        keyword = self.sparse_index.search(query_text, candidates, search_filter)
+        logger.info(f"Keyword search returned {len(keyword)} results")
+        fused = reciprocal_rank_fusion([[hit.id for hit in dense], [doc_id for doc_id, _ in keyword]], self.config.RRF_K)[:candidates]
+        if not fused:
+            return [], []
+
+        hits = {hit.id: hit for hit in dense}
+        missing = [doc_id for doc_id, _ in fused if doc_id not in hits]
+        if missing:
+            query = np.asarray(query_vector, dtype=np.float32)
+            query = query / max(float(np.linalg.norm(query)), 1e-12)
+            for hit in await self.vector_store.retrieve(collection, missing):
+                # Keyword-only matches report their cosine similarity like dense hits
+                hit.score = float(hit.vector @ query / max(float(np.linalg.norm(hit.vector)), 1e-12))
+                hits[hit.id] = hit
+        pool = [(hits[doc_id], score) for doc_id, score in fused if doc_id in hits]
+        top = pool[0][1] if pool else 1.0
+        return [hit for hit, _ in pool], [score / top for _, score in pool]
+
+    def next_sequence(self) -> int:
+        """
+        Next append position for a message: microseconds since the epoch, bumped
+        so it never repeats or goes backwards within this process. Allocating it
+        locally keeps saves append-only, with no read of the thread first.
+        Other processes (replicas, the ingest CLI) can produce the same value;
+        thread paging never splits a run of equal seqs, so ties are not skipped.
+        """
+        seq = max(time.time_ns() // 1000, self._last_seq + 1)
+        self._last_seq = seq
+        return seq
+
+    async def ensure_indexes(self):
+        """Create the payload indexes thread queries and filtered searches rely on. Safe to repeat."""
+        for field_name, field_schema in [
+            ("thread_id", models.PayloadSchemaType.KEYWORD),
+            ("seq", models.PayloadSchemaType.INTEGER),
+            ("created_at", models.PayloadSchemaType.DATETIME),
+            ("role", models.PayloadSchemaType.KEYWORD),
+            ("step", models.PayloadSchemaType.KEYWORD),
+            ("status", models.PayloadSchemaType.KEYWORD),
+            ("token_value", models.PayloadSchemaType.INTEGER)
+        ]:
+            await self._call(
+                self.client.create_payload_index,
                 collection_name=self.config.MESSAGES_COLLECTION,
-                points=[
-                    models.PointStruct(
-                        id=message.id,
-                        vector=message.vector,
-                        payload={
-                            "content": message.content,
-                            "thread_id": message.thread_id,
-                            "role": message.role,
-                            "created_at": message.created_at,
-                            "step": message.step,
-                            "status": message.status
-                        }
-                    )
-                ]
+                field_name=field_name,
+                field_schema=field_schema
             )
 
-            # Then, update the thread's message list using scroll and atomic update
-            scroll_filter = models.Filter(
-                must=[
-                    models.FieldCondition(
-                        key="id",
-                        match=models.MatchValue(value=message.thread_id)
-                    )
-                ]
+    async def save_message(self, message: MessageRecord):
+        """
+        Append a message to its thread.
+
+        Thread membership lives on the message itself (`thread_id` plus a
+        monotonic `seq`), so a save is a single upsert whatever the thread length,
+        and concurrent saves to one thread cannot overwrite each other.
+        """
+        await self.save_messages([message])
+
+    async def save_messages(self, messages: List[MessageRecord]):
+        """Append a batch of messages, possibly from different threads, in one upsert."""
+        try:
+            for message in messages:
+                if message.seq is None:
+                    message.seq = self.next_sequence()
+            points = [
+                VectorPoint(
+                    id=message.id,
+                    vector=message.vector,
+                    payload={
+                        "content": message.content,
+                        "thread_id": message.thread_id,
+                        "seq": message.seq,
+                        "role": message.role,
+                        "created_at": message.created_at,
+                        "step": message.step,
+                        "status": message.status
+                    }
+                )
+                for message in messages
+            ]
+            await self.vector_store.upsert(self.config.MESSAGES_COLLECTION, points)
+            if self.sparse_index is not None:
+                for point in points:
+                    self.sparse_index.add(point.id, point.payload["content"], point.payload)
+            self.retrieval_cache.invalidate(self.config.MESSAGES_COLLECTION, [point.payload for point in points])
+
+        except Exception as e:
+            logger.error(f"Error saving {len(messages)} messages: {e}")
+            raise
+
+    async def get_thread_message_ids(self, thread_id: str, batch_size: int = 256) -> List[str]:
+        """Return a thread's message ids in append order, via filtered scroll on the seq index."""
+        message_ids = []
+        after: Optional[int] = None
+        while True:
+            points = await self._scroll_thread(thread_id, after, batch_size, with_payload=["seq"])
+            message_ids.extend(str(point.id) for point in points)
+            if len(points) < batch_size:
+                return message_ids
+            after = points[-1].payload["seq"]
+
+    async def get_messages(
+        self, thread_id: str, cursor: Optional[int] = None, limit: int = 50, since: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        Return one page of a thread's messages in chronological order, without vectors.
+
+        Pass the returned cursor back to get the next page; it is None once the
+        thread is exhausted. `since` limits the page to messages created at or
+        after that ISO timestamp.
+        """
+        points = await self._scroll_thread(thread_id, cursor, limit, since=since)
+        messages = [
+            {
+                "id": str(point.id),
+                "thread_id": point.payload.get("thread_id", thread_id),
+                "seq": point.payload.get("seq"),
+                "content": point.payload.get("content", ""),
+                "role": point.payload.get("role", ""),
+                "created_at": point.payload.get("created_at", ""),
+                "step": point.payload.get("step", ""),
+                "status": point.payload.get("status", "")
+            }
+            for point in points
+        ]
+        next_cursor = messages[-1]["seq"] if len(messages) >= limit else None
+        return messages, next_cursor
+
+    async def _scroll_thread(
+        self, thread_id: str, after: Optional[int], limit: int, with_payload: Any = True, since: Optional[str] = None
+    ) -> List[models.Record]:
+        """
+        Up to `limit` of a thread's points with seq above `after`, in seq order.
+
+        Seqs from different processes can tie, and paging resumes after the
+        last seq, so a run of equal seqs is never split: a page that would end
+        inside one is extended to the whole run and can exceed `limit`.
+        `with_payload` must include "seq".
+        """
+        conditions = [models.FieldCondition(key="thread_id", match=models.MatchValue(value=thread_id))]
+        if since is not None:
+            conditions.append(models.FieldCondition(key="created_at", range=models.DatetimeRange(gte=since)))
+        after_condition = [models.FieldCondition(key="seq", range=models.Range(gt=after))] if after is not None else []
+        # order_by scrolls don't return a next offset, so page by seq instead; one
+        # extra point shows whether the page ends inside a run of equal seqs
+        points, _ = await self._call(
+            self.client.scroll,
+            collection_name=self.config.MESSAGES_COLLECTION,
+            scroll_filter=models.Filter(must=conditions + after_condition),
+            order_by=models.OrderBy(key="seq", direction=models.Direction.ASC),
+            limit=limit + 1,
+            with_payload=with_payload,
+            with_vectors=False
+        )
+        if len(points) <= limit:
+            return points
+        last_seq = points[limit - 1].payload["seq"]
+        if points[limit].payload["seq"] != last_seq:
+            return points[:limit]
+
+        tied: List[models.Record] = []
+        offset = None
+        while True:
+            batch, offset = await self._call(
+                self.client.scroll,
+                collection_name=self.config.MESSAGES_COLLECTION,
+                scroll_filter=models.Filter(
+                    must=conditions + [models.FieldCondition(key="seq", range=models.Range(gte=last_seq, lte=last_seq))]
+                ),
+                limit=limit,
+                offset=offset,
+                with_payload=with_payload,
+                with_vectors=False
             )
+            tied.extend(batch)
+            if offset is None:
+                break
+        return [point for point in points[:limit] if point.payload["seq"] != last_seq] + tied
+
+    async def migrate_thread_message_lists(self, batch_size: int = 64) -> int:
+        """
+        Move threads from the legacy `messages` id array to the per-message index.
 
-            # Get current thread state
-            scroll_result = self.client.scroll(
+        Each listed message gets `thread_id` and `seq` set to its position in the
+        array; legacy positions sort before the timestamp-based seqs of new
+        messages. The array is removed once its messages are indexed, so the
+        migration can be re-run after an interruption. Returns threads migrated.
+        """
+        migrated = 0
+        offset = None
+        while True:
+            threads, offset = await self._call(
+                self.client.scroll,
                 collection_name=self.config.CHAT_THREADS_COLLECTION,
-                scroll_filter=scroll_filter,
-                limit=1
+                limit=batch_size,
+                offset=offset,
+                with_payload=["messages"],
+                with_vectors=False
             )
+            for thread in threads:
+                message_ids = (thread.payload or {}).get("messages")
+                if not message_ids:
+                    continue
+                thread_id = str(thread.id)
+                await self._call(
+                    self.client.batch_update_points,
+                    collection_name=self.config.MESSAGES_COLLECTION,
+                    update_operations=[
+                        models.SetPayloadOperation(
+                            set_payload=models.SetPayload(payload={"thread_id": thread_id, "seq": seq}, points=[message_id])
+                        )
+                        for seq, message_id in enumerate(message_ids)
+                    ]
+                )
+                await self._call(
+                    self.client.delete_payload,
+                    collection_name=self.config.CHAT_THREADS_COLLECTION,
+                    keys=["messages"],
+                    points=[thread.id]
+                )
+                migrated += 1
+                logger.info(f"Migrated thread {thread_id} ({len(message_ids)} messages)")
+            if offset is None:
+                return migrated
 
-            points, _ = scroll_result
-            if not points:
-                raise Exception(f"Thread not found: {message.thread_id}")
+    async def compact_collection(self, collection: str, batch_size: int = 256) -> int:
+        """
+        Re-create `collection` with the configured compact storage, keeping every point.
 
-            # Update messages list
-            current_messages = points[0].payload.get("messages", [])
-            current_messages.append(message.id)
+        Points are copied with their vectors into `<collection>__compact`,
+        created with collection_params() at the original's vector size and
+        distance; once the counts match, the original is deleted and its name
+        becomes an alias of the copy, so readers and writers keep using the
+        same name. Every stage can be re-run after an interruption. Returns
+        points copied; 0 if the name is already an alias.
 
-            # Atomic update
-            self.client.update_payload(
-                collection_name=self.config.CHAT_THREADS_COLLECTION,
-                payload={"messages": current_messages},
-                points=[message.thread_id],
-                wait=True
-            )
+        Writers must be stopped for the whole run: points written to the
+        original after the copy starts are lost when it is deleted, and the
+        name does not resolve between the delete and the alias.
+        """
+        target = f"{collection}__compact"
+        if collection in await self._aliases():
+            logger.info(f"Collection {collection} is already compacted")
+            return 0
 
-        except Exception as e:
-            logger.error(f"Error saving message: {e}")
-            raise
+        copied = 0
+        if await self.client.collection_exists(collection):
+            if not await self.client.collection_exists(target):
+                info = await self._call(self.client.get_collection, collection_name=collection)
+                vectors = info.config.params.vectors
+                if not isinstance(vectors, models.VectorParams):
+                    raise RuntimeError(f"Collection {collection} uses named vectors, which compact_collection does not support")
+                await self._call(
+                    self.client.create_collection, collection_name=target, **collection_params(self.config, vectors)
+                )
+            offset = None
+            while True:
+                points, offset = await self._call(
+                    self.client.scroll,
+                    collection_name=collection,
+                    limit=batch_size,
+                    offset=offset,
+                    with_payload=True,
+                    with_vectors=True
+                )
+                if points:
+                    await self._call(
+                        self.client.upsert,
+                        collection_name=target,
+                        points=[models.PointStruct(id=point.id, vector=point.vector, payload=point.payload) for point in points]
+                    )
+                copied += len(points)
+                if offset is None:
+                    break
+            source_count = (await self._call(self.client.count, collection_name=collection, exact=True)).count
+            target_count = (await self._call(self.client.count, collection_name=target, exact=True)).count
+            if source_count != target_count:
+                raise RuntimeError(f"Compacted copy of {collection} has {target_count} points, expected {source_count}")
+            await self._call(self.client.delete_collection, collection_name=collection)
+        elif not await self.client.collection_exists(target):
+            raise RuntimeError(f"Collection {collection} does not exist")
+
+        await self._call(
+            self.client.update_collection_aliases,
+            change_aliases_operations=[
+                models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=target, alias_name=collection))
+            ]
+        )
+        logger.info(f"Compacted {collection} into {target} ({copied} points)")
+        return copied
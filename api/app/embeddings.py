@@ -0,0 +1,288 @@
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+import numpy as np
+from litellm import aembedding
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+EmbedFn = Callable[[List[str]], Awaitable[np.ndarray]]
+
+# Bytes of a key's SHA-256 stored next to its row in DiskVectorStore
+KEY_DIGEST_BYTES = 16
+
+def litellm_embed_fn(model: str, config: Config) -> EmbedFn:
+    """Build an upstream call that embeds a list of inputs in one batched async request."""
+    async def embed(inputs: List[str]) -> np.ndarray:
+        response = await aembedding(
+            model=f"azure/{model}",
+            input=inputs,
+            api_key=config.AZURE_API_KEY,
+            api_base=config.AZURE_API_BASE,
+            api_version=config.AZURE_API_VERSION
+        )
+        data = sorted(response['data'], key=lambda item: item['index'])
+        return np.asarray([item['embedding'] for item in data], dtype=np.float32)
+    return embed
+
+class EmbeddingBatcher:
+    """
+    Coalesce concurrent embedding requests into shared upstream calls.
+
+    Requests arriving within `max_wait` seconds of each other are merged into
+    one call of up to `max_batch_size` inputs; each caller gets back only the
+    rows for its own inputs.
+    """
+
+    def __init__(self, embed_fn: EmbedFn, max_batch_size: int = 16, max_wait: float = 0.01):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending: List[Tuple[List[str], asyncio.Future]] = []
+        self._pending_count = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed `texts`, returning a (len(texts), dim) float32 array."""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((texts, future))
+        self._pending_count += len(texts)
+        if self._pending_count >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        self._pending_count = 0
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[Tuple[List[str], asyncio.Future]]):
+        inputs = [text for texts, _ in batch for text in texts]
+        try:
+            # A single caller may bring more chunks than fit in one request
+            slices = [inputs[i:i + self.max_batch_size] for i in range(0, len(inputs), self.max_batch_size)]
+            results = await asyncio.gather(*(self.embed_fn(chunk) for chunk in slices))
+            vectors = np.concatenate(results, axis=0)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        logger.debug(f"Embedded {len(inputs)} inputs for {len(batch)} callers in {len(slices)} requests")
+        offset = 0
+        for texts, future in batch:
+            if not future.done():
+                future.set_result(vectors[offset:offset + len(texts)])
+            offset += len(texts)
+
+_batchers: Dict[str, EmbeddingBatcher] = {}
+
+def get_embedding_batcher(model: str, config: Optional[Config] = None) -> EmbeddingBatcher:
+    """Return the process-wide batcher for `model`, creating it on first use."""
+    batcher = _batchers.get(model)
+    if batcher is None:
+        config = config or Config()
+        batcher = EmbeddingBatcher(
+            litellm_embed_fn(model, config),
+            max_batch_size=config.EMBEDDING_BATCH_SIZE,
+            max_wait=config.EMBEDDING_BATCH_WAIT
+        )
+        _batchers[model] = batcher
+    return batcher
+
+class DiskVectorStore:
+    """
+    Fixed-capacity vector file that survives restarts.
+
+    Vectors live in a memory-mapped float32 matrix at `<path>.vectors`; an
+    append-only `<path>.index` log records which key owns each row. Rows are
+    reused ring-buffer style once the file is full, and replaying the log on
+    open (last writer wins) restores the key -> row mapping. The files are not
+    shared safely between processes, so give each worker its own path.
+
+    A row is overwritten before its new owner is logged, so `<path>.keys`
+    holds a digest of the key each row was last written for; get() treats a
+    mismatch, left by a crash between the two writes, as a miss.
+    """
+
+    def __init__(self, path: str, dim: int, capacity: int):
+        self.dim = dim
+        self.capacity = capacity
+        self._vectors_path = f"{path}.vectors"
+        self._index_path = f"{path}.index"
+        self._keys_path = f"{path}.keys"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        mode = "r+" if os.path.exists(self._vectors_path) else "w+"
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode=mode, shape=(capacity, dim))
+        mode = "r+" if os.path.exists(self._keys_path) else "w+"
+        self._keys = np.memmap(self._keys_path, dtype=np.uint8, mode=mode, shape=(capacity, KEY_DIGEST_BYTES))
+        self._rows: Dict[str, int] = {}
+        self._owners: Dict[int, str] = {}
+        self._next_row = 0
+        self._replay_index()
+        self._index = open(self._index_path, "a", encoding="utf-8")
+
+    def _replay_index(self):
+        if not os.path.exists(self._index_path):
+            return
+        entries = 0
+        with open(self._index_path, "r+b") as f:
+            replayed = 0
+            for line in f:
+                # A line cut short by a crash could name the wrong row ("key 12" for "key 123")
+                if not line.endswith(b"\n"):
+                    break
+                replayed += len(line)
+                key, _, row = line.decode("utf-8").strip().partition(" ")
+                if not row.isdigit():
+                    continue
+                row = int(row)
+                if row >= self.capacity:
+                    continue
+                self._assign(key, row)
+                self._next_row = (row + 1) % self.capacity
+                entries += 1
+            if replayed < f.seek(0, os.SEEK_END):
+                logger.warning(f"Dropping incomplete last entry of {self._index_path}")
+                f.truncate(replayed)
+        # Compact the log once it carries mostly overwritten entries
+        if entries > 2 * self.capacity:
+            with open(self._index_path, "w", encoding="utf-8") as f:
+                for row in sorted(self._owners, key=lambda r: (r - self._next_row) % self.capacity):
+                    f.write(f"{self._owners[row]} {row}\n")
+
+    def _assign(self, key: str, row: int):
+        previous = self._owners.get(row)
+        if previous is not None:
+            self._rows.pop(previous, None)
+        self._rows[key] = row
+        self._owners[row] = key
+
+    @staticmethod
+    def _digest(key: str) -> np.ndarray:
+        return np.frombuffer(hashlib.sha256(key.encode("utf-8")).digest()[:KEY_DIGEST_BYTES], dtype=np.uint8)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        if not np.array_equal(self._keys[row], self._digest(key)):
+            return None
+        return np.array(self._vectors[row])
+
+    def put(self, key: str, vector: np.ndarray):
+        if key in self._rows:
+            return
+        row = self._next_row
+        self._next_row = (row + 1) % self.capacity
+        # Claim the row before overwriting it, so a crash before the log write
+        # leaves the previous key's lookups missing rather than wrong
+        self._keys[row] = self._digest(key)
+        self._vectors[row] = vector
+        self._assign(key, row)
+        self._index.write(f"{key} {row}\n")
+        self._index.flush()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def close(self):
+        self._vectors.flush()
+        self._keys.flush()
+        self._index.close()
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache: an in-memory LRU over an optional disk tier.
+
+    Entries are keyed by model name plus a SHA-256 of the text, so identical
+    inputs are embedded once no matter which step or connection asks.
+    """
+
+    def __init__(self, max_entries: int = 4096, disk: Optional[DiskVectorStore] = None):
+        self.max_entries = max_entries
+        self.disk = disk
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model}:{digest}"
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        key = self.key(model, text)
+        vector = self._entries.get(key)
+        if vector is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+        if self.disk is not None:
+            vector = self.disk.get(key)
+            if vector is not None:
+                self.disk_hits += 1
+                self._remember(key, vector)
+                return vector
+        self.misses += 1
+        return None
+
+    def put(self, model: str, text: str, vector: np.ndarray):
+        key = self.key(model, text)
+        vector = np.asarray(vector, dtype=np.float32)
+        self._remember(key, vector)
+        if self.disk is not None:
+            self.disk.put(key, vector)
+
+    def _remember(self, key: str, vector: np.ndarray):
+        vector.flags.writeable = False
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "size": len(self._entries),
+            "disk_size": len(self.disk) if self.disk is not None else 0
+        }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+_embedding_cache: Optional[EmbeddingCache] = None
+
+def get_embedding_cache(config: Optional[Config] = None) -> EmbeddingCache:
+    """Return the process-wide embedding cache, creating it on first use."""
+    global _embedding_cache
+    if _embedding_cache is None:
+        config = config or Config()
+        disk = None
+        if config.EMBEDDING_CACHE_PATH:
+            disk = DiskVectorStore(config.EMBEDDING_CACHE_PATH, config.VECTOR_SIZE, config.EMBEDDING_CACHE_DISK_CAPACITY)
+        _embedding_cache = EmbeddingCache(config.EMBEDDING_CACHE_SIZE, disk)
+    return _embedding_cache
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, UTC
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+import numpy as np
+from .config import Config
+from .database import DatabaseClient
+from .embeddings import EmbedFn
+from .llm_gateway import is_retryable
+from .models import MessageRecord
+from .utils import chunk_text
+
+logger = logging.getLogger(__name__)
+
+# Lines without an "id" get a uuid5 of their text, so re-ingesting a line overwrites the same point
+INGEST_NAMESPACE = uuid.UUID("6f1c2b0e-5d4a-4c1e-9a7b-3e2f8d9c0a15")
+
+@dataclass
+class IngestStats:
+    messages: int = 0
+    chunks: int = 0
+    skipped: int = 0
+    line: int = 0  # input lines fully ingested, the resume point
+    elapsed: float = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.messages / self.elapsed if self.elapsed else 0.0
+
+def parse_record(line: str) -> Optional[MessageRecord]:
+    """A MessageRecord from one JSONL line, or None when the line has no content."""
+    data = json.loads(line)
+    content = data.get("content")
+    if not content:
+        return None
+    return MessageRecord(
+        id=str(data.get("id") or uuid.uuid5(INGEST_NAMESPACE, line)),
+        thread_id=str(data.get("thread_id", "")),
+        role=data.get("role", "user"),
+        content=content,
+        created_at=data.get("created_at") or datetime.now(UTC).isoformat(),
+        step=data.get("step"),
+        status=data.get("status", "approved"),
+        vector=data.get("vector"),
+        seq=data.get("seq")
+    )
+
+class BulkIngester:
+    """
+    Stream a JSONL file of messages into the messages collection.
+
+    Lines are read `batch_size` at a time and up to `concurrency` batches are
+    in flight. Each batch is chunked like get_embedding, embedded in requests
+    of `embed_batch_size` inputs, and upserted with one save_messages call;
+    lines that already carry a "vector" skip embedding. Batches can finish
+    out of order, so the checkpoint records the last line before which every
+    batch is stored. A re-run resumes from there, and ids are stable, so
+    batches finished past it are overwritten rather than duplicated.
+
+    Rate limits and other retryable embedding errors are retried up to
+    `max_retries` times with the gateway's jittered exponential backoff
+    (LLM_RETRY_BACKOFF, capped at `max_backoff` seconds), so a long run rides
+    them out instead of stopping.
+    """
+
+    def __init__(
+        self,
+        database: DatabaseClient,
+        embed_fn: EmbedFn,
+        config: Config,
+        batch_size: int = 256,
+        embed_batch_size: int = 512,
+        concurrency: int = 8,
+        checkpoint_path: Optional[str] = None,
+        report_interval: float = 10.0,
+        max_retries: int = 8,
+        max_backoff: float = 60.0
+    ):
+        self.database = database
+        self.embed_fn = embed_fn
+        self.config = config
+        self.batch_size = batch_size
+        self.embed_batch_size = embed_batch_size
+        self.concurrency = concurrency
+        self.checkpoint_path = checkpoint_path
+        self.report_interval = report_interval
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._embed_semaphore = asyncio.Semaphore(concurrency)
+
+    async def ingest(self, path: str) -> IngestStats:
+        checkpoint_path = self.checkpoint_path or f"{path}.checkpoint"
+        stats = IngestStats(line=self._load_checkpoint(checkpoint_path, path))
+        if stats.line:
+            logger.info(f"Resuming {path} after line {stats.line}")
+        started = time.monotonic()
+        last_report = started
+        finished: Dict[int, Tuple[int, int, int, int]] = {}
+        tasks: Set[asyncio.Task] = set()
+
+        async def collect(return_when):
+            nonlocal last_report
+            done, _ = await asyncio.wait(tasks, return_when=return_when)
+            for task in done:
+                tasks.discard(task)
+                start, end, messages, chunks, skipped = task.result()
+                finished[start] = (end, messages, chunks, skipped)
+            # Advance over the contiguous run of finished batches only
+            advanced = False
+            while stats.line in finished:
+                end, messages, chunks, skipped = finished.pop(stats.line)
+                stats.line = end
+                stats.messages += messages
+                stats.chunks += chunks
+                stats.skipped += skipped
+                advanced = True
+            if advanced:
+                self._save_checkpoint(checkpoint_path, path, stats.line)
+            now = time.monotonic()
+            stats.elapsed = now - started
+            if now - last_report >= self.report_interval:
+                last_report = now
+                logger.info(f"Ingested {stats.messages} messages ({stats.rate:.1f}/s, {stats.chunks} chunks), through line {stats.line}")
+
+        try:
+            for start, end, lines in self._read_batches(path, stats.line):
+                if len(tasks) >= self.concurrency:
+                    await collect(asyncio.FIRST_COMPLETED)
+                tasks.add(asyncio.ensure_future(self._ingest_batch(start, end, lines)))
+            while tasks:
+                await collect(asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+        stats.elapsed = time.monotonic() - started
+        logger.info(
+            f"Ingested {stats.messages} messages in {stats.elapsed:.1f}s ({stats.rate:.1f}/s, "
+            f"{stats.chunks} chunks embedded, {stats.skipped} lines skipped)"
+        )
+        return stats
+
+    def _read_batches(self, path: str, skip: int) -> Iterator[Tuple[int, int, List[str]]]:
+        with open(path, encoding="utf-8") as f:
+            line_number = 0
+            for _ in range(skip):
+                if not f.readline():
+                    return
+                line_number += 1
+            while True:
+                lines = []
+                for line in f:
+                    lines.append(line)
+                    if len(lines) == self.batch_size:
+                        break
+                if not lines:
+                    return
+                yield line_number, line_number + len(lines), lines
+                line_number += len(lines)
+
+    async def _ingest_batch(self, start: int, end: int, lines: List[str]) -> Tuple[int, int, int, int, int]:
+        records = []
+        skipped = 0
+        for offset, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                record = parse_record(line)
+            except (ValueError, TypeError, AttributeError) as e:
+                logger.warning(f"Skipping line {start + offset + 1}: {e}")
+                record = None
+            if record is None:
+                skipped += 1
+                continue
+            records.append(record)
+
+        chunks = await self._embed(records)
+        if records:
+            await self.database.save_messages(records)
+        return start, end, len(records), chunks, skipped
+
+    async def _embed(self, records: List[MessageRecord]) -> int:
+        """Fill in missing vectors, averaging chunk embeddings per message. Returns chunks embedded."""
+        pending = [record for record in records if not record.vector]
+        if not pending:
+            return 0
+        inputs: List[str] = []
+        counts: List[int] = []
+        for record in pending:
+            chunks = list(chunk_text(record.content, self.config.CHUNK_SIZE, self.config.CHUNK_OVERLAP, self.config.EMBEDDING_MODEL))
+            inputs.extend(chunks)
+            counts.append(len(chunks))
+
+        async def embed(batch: List[str]) -> np.ndarray:
+            attempt = 0
+            while True:
+                try:
+                    async with self._embed_semaphore:
+                        return await self.embed_fn(batch)
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_retryable(e):
+                        raise
+                    logger.warning(f"Embedding failed ({type(e).__name__}: {e}), retry {attempt + 1} of {self.max_retries}")
+                # Sleep outside the semaphore so other batches keep the slot busy
+                await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.config.LLM_RETRY_BACKOFF * 2 ** attempt)))
+                attempt += 1
+
+        results = await asyncio.gather(*(
+            embed(inputs[i:i + self.embed_batch_size]) for i in range(0, len(inputs), self.embed_batch_size)
+        ))
+        vectors = np.concatenate(results, axis=0)
+        if vectors.shape != (len(inputs), self.config.VECTOR_SIZE):
+            raise ValueError(f"Embedding returned shape {vectors.shape}, expected ({len(inputs)}, {self.config.VECTOR_SIZE})")
+        starts = np.cumsum([0] + counts[:-1])
+        averaged = np.add.reduceat(vectors, starts, axis=0) / np.asarray(counts, dtype=np.float32)[:, None]
+        for record, vector in zip(pending, averaged):
+            record.vector = vector.tolist()
+        return len(inputs)
+
+    @staticmethod
+    def _load_checkpoint(checkpoint_path: str, path: str) -> int:
+        if not os.path.exists(checkpoint_path):
+            return 0
+        with open(checkpoint_path, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("input") != os.path.abspath(path):
+            raise ValueError(f"Checkpoint {checkpoint_path} belongs to {checkpoint.get('input')}, not {path}")
+        return int(checkpoint["line"])
+
+    @staticmethod
+    def _save_checkpoint(checkpoint_path: str, path: str, line: int):
+        # Write then rename, so an interrupted write never leaves a truncated checkpoint
+        temporary = f"{checkpoint_path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump({"input": os.path.abspath(path), "line": line}, f)
+        os.replace(temporary, checkpoint_path)
+
+async def export_messages(database: DatabaseClient, path: str, batch_size: int = 1024) -> int:
+    """Write the messages collection to JSONL without vectors, e.g. to re-embed it with BulkIngester. Returns messages written."""
+    written = 0
+    offset = None
+    with open(path, "w", encoding="utf-8") as f:
+        while True:
+            points, offset = await database.client.scroll(
+                collection_name=database.config.MESSAGES_COLLECTION,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False
+            )
+            for point in points:
+                f.write(json.dumps({"id": str(point.id), **(point.payload or {})}) + "\n")
+            written += len(points)
+            if offset is None:
+                return written
@@ -0,0 +1,280 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import defaultdict, deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Tuple, Union
+import litellm
+import numpy as np
+from litellm import acompletion
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+CompletionBackend = Callable[..., Awaitable[Any]]
+# (model, max_tokens, "complete" or "first_chunk")
+LatencyKey = Tuple[Any, Any, str]
+
+# A response every Chorus step model accepts, served by the fake backend
+FAKE_RESPONSE = json.dumps({
+    "proposed_response": "ok",
+    "synthesis": "ok",
+    "explicit_intent": "ok",
+    "implicit_intent": "ok",
+    "context_analysis": "ok",
+    "loop": False,
+    "reasoning": "ok",
+    "answer_confidence": 0.9,
+    "confidence": 0.9,
+    "final_response": "ok"
+})
+
+def is_retryable(error: BaseException) -> bool:
+    """Timeouts, connection failures, rate limits (429) and server errors (5xx) are worth retrying."""
+    if isinstance(error, (asyncio.TimeoutError, litellm.APIConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status == 429 or (isinstance(status, int) and 500 <= status < 600)
+
+class LLMGateway:
+    """
+    Async front door for chat completions.
+
+    Every upstream call goes through one per-process semaphore and is bounded
+    by `timeout` seconds. Retryable failures are retried up to `max_retries`
+    times with jittered exponential backoff. Latencies are tracked per model
+    and max_tokens, for full completions and for a stream's first chunk.
+    Once `hedge_min_samples` have been seen for a key, a call still waiting
+    after that key's `hedge_percentile` latency gets a duplicate request and
+    whichever answers first wins; a percentile of 0 disables hedging.
+    """
+
+    def __init__(
+        self,
+        backend: CompletionBackend = acompletion,
+        max_concurrency: int = 16,
+        timeout: float = 60.0,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+        hedge_percentile: float = 95.0,
+        hedge_min_samples: int = 20
+    ):
+        self.backend = backend
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._latencies: Dict[LatencyKey, Deque[float]] = defaultdict(lambda: deque(maxlen=256))
+        self.retries = 0
+        self.hedges = 0
+
+    @staticmethod
+    def latency_key(kwargs: Dict[str, Any], stream: bool = False) -> LatencyKey:
+        """Calls are only compared with others of the same model, reply size and kind."""
+        return (kwargs.get("model"), kwargs.get("max_tokens"), "first_chunk" if stream else "complete")
+
+    def hedge_delay(self, key: LatencyKey) -> Optional[float]:
+        latencies = self._latencies.get(key)
+        if not self.hedge_percentile or latencies is None or len(latencies) < self.hedge_min_samples:
+            return None
+        return float(np.percentile(latencies, self.hedge_percentile))
+
+    async def complete(self, **kwargs) -> Any:
+        """Run a non-streaming completion; `kwargs` are passed to the backend as for litellm.acompletion."""
+        key = self.latency_key(kwargs)
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged(lambda: self._attempt(kwargs, key), key)
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+            await self._sleep_before_retry(attempt)
+            attempt += 1
+
+    async def stream(self, **kwargs) -> AsyncIterator[Any]:
+        """
+        Run a streaming completion and yield its chunks.
+
+        Opening the stream, up to its first chunk, takes a concurrency slot and
+        is retried and hedged on time to first chunk. The slot is released
+        before any chunk is handed over, so a slow consumer never holds it.
+        Once tokens have been yielded an error is raised to the caller. Each
+        chunk must arrive within `timeout` seconds of the previous one.
+        """
+        key = self.latency_key(kwargs, stream=True)
+        attempt = 0
+        while True:
+            try:
+                opened = await self._hedged(lambda: self._open_stream(kwargs, key), key, discard=self._close_stream)
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+            else:
+                break
+            await self._sleep_before_retry(attempt)
+            attempt += 1
+
+        if opened is None:
+            return
+        chunks, first = opened
+        try:
+            yield first
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                except StopAsyncIteration:
+                    return
+                yield chunk
+        finally:
+            await self._close_stream(opened)
+
+    async def _attempt(self, kwargs: Dict[str, Any], key: LatencyKey) -> Any:
+        async with self._semaphore:
+            started = time.monotonic()
+            response = await asyncio.wait_for(self.backend(**kwargs), self.timeout)
+            self._latencies[key].append(time.monotonic() - started)
+            return response
+
+    async def _open_stream(self, kwargs: Dict[str, Any], key: LatencyKey) -> Optional[Tuple[AsyncIterator[Any], Any]]:
+        """Start a stream and wait for its first chunk; None if it ends without one."""
+        async with self._semaphore:
+            started = time.monotonic()
+            response = await asyncio.wait_for(self.backend(stream=True, **kwargs), self.timeout)
+            chunks = response.__aiter__()
+            try:
+                first = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+            except StopAsyncIteration:
+                return None
+            except BaseException:
+                await self._close_stream((chunks, None))
+                raise
+            self._latencies[key].append(time.monotonic() - started)
+            return chunks, first
+
+    @staticmethod
+    async def _close_stream(opened: Optional[Tuple[AsyncIterator[Any], Any]]):
+        aclose = getattr(opened[0], "aclose", None) if opened is not None else None
+        if aclose is not None:
+            try:
+                await aclose()
+            except Exception as e:
+                logger.debug("Error closing stream: %s", e)
+
+    async def _hedged(
+        self,
+        attempt: Callable[[], Awaitable[Any]],
+        key: LatencyKey,
+        discard: Optional[Callable[[Any], Awaitable[None]]] = None
+    ) -> Any:
+        """Run `attempt`, duplicating it past the hedge delay; `discard` releases a losing result."""
+        delay = self.hedge_delay(key)
+        primary = asyncio.ensure_future(attempt())
+        if delay is None:
+            return await primary
+
+        tasks = [primary]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.hedges += 1
+                logger.info(f"LLM call to {key[0]} exceeded p{self.hedge_percentile:g} {key[2]} latency of {delay:.2f}s, sending hedged request")
+                tasks.append(asyncio.ensure_future(attempt()))
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif discard is not None and task is not winner and not task.cancelled() and task.exception() is None:
+                    await discard(task.result())
+
+    def _should_retry(self, error: Exception, attempt: int) -> bool:
+        if attempt >= self.max_retries or not is_retryable(error):
+            return False
+        self.retries += 1
+        logger.warning(f"LLM call failed ({type(error).__name__}: {error}), retry {attempt + 1} of {self.max_retries}")
+        return True
+
+    async def _sleep_before_retry(self, attempt: int):
+        # Full jitter keeps retries from many callers from arriving together
+        await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+class FakeLLMBackend:
+    """
+    Local stand-in for litellm.acompletion, for tests and running without Azure.
+
+    Returns `content` (a string, or a function of the messages) after
+    `latency` seconds (a number, or a function returning one per call),
+    raising the queued `failures` first, one per call.
+    """
+
+    def __init__(
+        self,
+        content: Union[str, Callable[[List[Dict[str, str]]], str]] = FAKE_RESPONSE,
+        latency: Union[float, Callable[[], float]] = 0.0,
+        failures: Iterable[Exception] = ()
+    ):
+        self.content = content
+        self.latency = latency
+        self.failures = deque(failures)
+        self.calls = 0
+
+    async def __call__(self, model: str, messages: List[Dict[str, str]], stream: bool = False, **kwargs) -> Any:
+        self.calls += 1
+        await asyncio.sleep(self.latency() if callable(self.latency) else self.latency)
+        if self.failures:
+            raise self.failures.popleft()
+
+        content = self.content(messages) if callable(self.content) else self.content
+        prompt_tokens = sum(len(message.get("content") or "") for message in messages) // 4
+        completion_tokens = len(content) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+        if stream:
+            return self._stream(content, usage)
+        return litellm.ModelResponse(
+            model=model,
+            choices=[{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            usage=usage
+        )
+
+    async def _stream(self, content: str, usage: Dict[str, int]) -> AsyncIterator[Any]:
+        for i in range(0, len(content), 16):
+            yield litellm.ModelResponseStream(choices=[{"index": 0, "delta": {"content": content[i:i + 16]}}])
+        yield litellm.ModelResponseStream(choices=[], usage=usage)
+
+_gateway: Optional[LLMGateway] = None
+
+def get_llm_gateway(config: Optional[Config] = None) -> LLMGateway:
+    """Return the process-wide LLM gateway, creating it on first use."""
+    global _gateway
+    if _gateway is None:
+        config = config or Config()
+        _gateway = LLMGateway(
+            backend=FakeLLMBackend() if config.LLM_BACKEND == "fake" else acompletion,
+            max_concurrency=config.LLM_MAX_CONCURRENCY,
+            timeout=config.LLM_TIMEOUT,
+            max_retries=config.LLM_MAX_RETRIES,
+            backoff=config.LLM_RETRY_BACKOFF,
+            hedge_percentile=config.LLM_HEDGE_PERCENTILE,
+            hedge_min_samples=config.LLM_HEDGE_MIN_SAMPLES
+        )
+    return _gateway
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import random
+from typing import List, Optional, Tuple
+from qdrant_client.http.exceptions import ResponseHandlingException
+from .config import Config
+from .database import DatabaseClient
+from .llm_gateway import is_retryable
+from .models import MessageRecord
+from .utils import get_embedding
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingUnavailable(Exception):
+    """get_embedding fell back to a zero vector, which would be stored as a match for nothing."""
+
+def is_retryable_write(error: BaseException) -> bool:
+    """Transient embedding, network and Qdrant failures are worth retrying."""
+    return is_retryable(error) or isinstance(error, (ConnectionError, ResponseHandlingException, EmbeddingUnavailable))
+
+class MessageWriter:
+    """
+    Write-behind queue for message persistence.
+
+    Messages submitted from any connection are buffered and written in
+    batches: embeddings for the whole batch are fetched together and the points
+    go out in a single upsert. A batch is flushed once `flush_size` messages
+    are waiting or `flush_interval` seconds have passed, and close() writes
+    whatever is still queued. submit() returns a future that resolves to the
+    message id once it is stored.
+
+    Transient failures are retried up to WRITE_BEHIND_MAX_RETRIES times with
+    jittered exponential backoff. A message whose embedding keeps falling back
+    to zeros is never stored; its future fails, while the rest of its batch is
+    written.
+    """
+
+    def __init__(self, database: DatabaseClient, config: Config, flush_size: int = 64, flush_interval: float = 0.5):
+        self.database = database
+        self.config = config
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_retries = config.WRITE_BEHIND_MAX_RETRIES
+        self.backoff = config.WRITE_BEHIND_RETRY_BACKOFF
+        self._pending: List[Tuple[MessageRecord, asyncio.Future]] = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def submit(self, message: MessageRecord) -> asyncio.Future:
+        if self._closing:
+            raise RuntimeError("Message writer is closed")
+        # Fix the message's place in its thread now, not when the batch is written
+        if message.seq is None:
+            message.seq = self.database.next_sequence()
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._log_failure)
+        self._pending.append((message, future))
+        if len(self._pending) >= self.flush_size:
+            self._wakeup.set()
+        return future
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write every queued message, one batch of at most `flush_size` at a time."""
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.flush_size]
+                self._pending = self._pending[self.flush_size:]
+                await self._write(batch)
+
+    async def _write(self, batch: List[Tuple[MessageRecord, asyncio.Future]]):
+        error: Optional[BaseException] = None
+        attempt = 0
+        while True:
+            try:
+                await self._embed([message for message, _ in batch])
+                ready = [(message, future) for message, future in batch if message.vector is not None]
+                if ready:
+                    await self.database.save_messages([message for message, _ in ready])
+                    logger.debug("Wrote batch of %d messages", len(ready))
+                    for message, future in ready:
+                        if not future.done():
+                            future.set_result(message.id)
+                batch = [(message, future) for message, future in batch if message.vector is None]
+                if not batch:
+                    return
+                error = EmbeddingUnavailable(f"No embedding for {len(batch)} messages")
+            except Exception as e:
+                error = e
+            if attempt >= self.max_retries or not is_retryable_write(error):
+                break
+            attempt += 1
+            logger.warning(f"Retrying write of {len(batch)} messages (attempt {attempt}/{self.max_retries}): {error}")
+            await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+        logger.error(
+            f"Dropping {len(batch)} messages after {attempt + 1} attempts: {error} "
+            f"(ids {', '.join(message.id for message, _ in batch)})"
+        )
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _embed(self, messages: List[MessageRecord]):
+        """Fill in missing vectors; zero vectors from a failed embedding are left unset."""
+        missing = [message for message in messages if message.vector is None]
+        vectors = await asyncio.gather(*(get_embedding(message.content, self.config.EMBEDDING_MODEL) for message in missing))
+        for message, vector in zip(missing, vectors):
+            if any(vector):
+                message.vector = vector
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future):
+        # Retrieve the exception so callers may drop their futures without warnings;
+        # _write has already logged the failure
+        if not future.cancelled():
+            future.exception()
+
+    async def close(self):
+        """Stop the background loop and durably flush everything still queued."""
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+        await self.flush()
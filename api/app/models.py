@@ -2,6 +2,7 @@ from pydantic import BaseModel, validator
 from typing import Set, List, Optional, Union, Dict, Any
 from datetime import datetime
 from enum import Enum
+import time
 
 class StepEnum(str, Enum):
     ACTION = "action"
@@ -52,6 +53,18 @@ class Message(BaseState):
             raise ValueError("Content exceeds maximum length")
         return v
 
+class MessageRecord(BaseModel):
+    """A message as stored in the messages collection."""
+    id: str
+    thread_id: str
+    role: str
+    content: str
+    created_at: str
+    step: Optional[str] = None
+    status: str = "approved"
+    vector: Optional[List[float]] = None
+    seq: Optional[int] = None  # Position in the thread; assigned on save when missing
+
 class ThreadStatus(str, Enum):
     ACTIVE = "active"
     CLOSED = "closed"
@@ -84,6 +97,95 @@ class Effect(BaseModel):
     type: str
     payload: Dict[str, Any]
 
+class CycleBudget(BaseModel):
+    """Limits on one chorus cycle, and what it has used so far."""
+    max_iterations: int
+    max_tokens: int
+    time_limit: float  # seconds
+    exit_confidence: float
+    started_at: float  # time.monotonic()
+    iterations: int = 0
+    tokens_used: int = 0
+    exit_reason: Optional[str] = None
+    partial_results: Dict[str, Any] = {}
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def remaining(self) -> float:
+        return max(self.time_limit - self.elapsed(), 0.0)
+
+    def exhausted(self) -> Optional[str]:
+        """Return why the hard limits are used up, or None if the cycle may continue."""
+        if self.tokens_used >= self.max_tokens:
+            return "max_tokens"
+        if self.remaining() <= 0:
+            return "deadline"
+        return None
+
+    def stop_reason(self, answer_confidence: float) -> Optional[str]:
+        """
+        Decide whether a loop requested by UPDATE should be cut short.
+
+        `answer_confidence` is UPDATE's confidence that the current answer is
+        already good enough, not its confidence in the loop decision.
+        """
+        if answer_confidence >= self.exit_confidence:
+            return "confidence"
+        if self.iterations >= self.max_iterations:
+            return "max_iterations"
+        return self.exhausted()
+
+    def best_partial_result(self) -> Optional[str]:
+        """The latest successful EXPERIENCE or ACTION output, or None if neither produced one."""
+        for step in (StepEnum.EXPERIENCE, StepEnum.ACTION):
+            result = self.partial_results.get(step.value)
+            if isinstance(result, str) and result:
+                return result
+        return None
+
+    def usage(self) -> Dict[str, Any]:
+        return {
+            "iterations": self.iterations,
+            "max_iterations": self.max_iterations,
+            "tokens_used": self.tokens_used,
+            "max_tokens": self.max_tokens,
+            "elapsed": round(self.elapsed(), 3),
+            "time_limit": self.time_limit,
+            "exit_reason": self.exit_reason
+        }
+
+class ModelRoute(BaseModel):
+    """Model and sampling settings for one step; unset fields fall back to the global config."""
+    model: str
+    max_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    fallback_model: Optional[str] = None
+
+class CycleContextEntry(BaseModel):
+    step: StepEnum
+    iteration: int
+    content: str
+
+class CycleContext(BaseModel):
+    """
+    Rolling record of step outputs within one cycle, oldest first.
+
+    Entries are only ever appended, so each rendering extends the previous
+    one and prompts built from it keep a stable prefix.
+    """
+    entries: List[CycleContextEntry] = []
+
+    @property
+    def iteration(self) -> int:
+        return 1 + sum(1 for entry in self.entries if entry.step == StepEnum.UPDATE)
+
+    def append(self, step: StepEnum, content: str) -> "CycleContext":
+        return CycleContext(entries=self.entries + [CycleContextEntry(step=step, iteration=self.iteration, content=content)])
+
+    def render(self) -> str:
+        return "\n".join(f"[{entry.step.value} {entry.iteration}] {entry.content}" for entry in self.entries)
+
 class ChorusState(BaseModel):
     messages: List[Message]
     current_step: StepEnum
@@ -91,6 +193,7 @@ class ChorusState(BaseModel):
     error_state: Optional[Dict[str, Any]] = None
     priors: Optional[List[Dict[str, Any]]] = None
     current_response: Optional[Dict[str, Any]] = None
+    context: CycleContext = CycleContext()
 
 class User(BaseModel):
     id: str
@@ -98,10 +201,14 @@ class User(BaseModel):
     created_at: str
     chat_threads: List[str]
 
+# Step responses: fields a step reads are required and typed. Lists the model
+# may shape freely (strings, objects or a single string) are Any, so a reply
+# that only varies in those still parses.
 class ActionResponse(BaseModel):
-    initial_thoughts: str
     proposed_response: str
-    confidence: float
+    confidence: Optional[float] = 0.5
+    reasoning: str = ""
+    initial_thoughts: str = ""
 
 class Prior(BaseModel):
     id: str
@@ -114,30 +221,32 @@ class Prior(BaseModel):
 
 class ExperienceResponse(BaseModel):
     synthesis: str
-    confidence: float
-    all_priors: List[Prior]  # Store all 80 priors
+    confidence: Optional[float] = 0.5
+    key_insights: Any = []
+    all_priors: Any = []  # Priors echoed back by the model; not read by the step
 
 class IntentionResponse(BaseModel):
     explicit_intent: str
     implicit_intent: str
-    confidence: float
-    selected_priors: List[Prior]  # The most relevant priors selected from all_priors
-    selection_reasoning: str  # Why these priors were selected
+    confidence: Optional[float] = 0.5
+    selected_priors: Any = []  # Priors the model picked as most relevant; not read by the step
+    selection_reasoning: str = ""  # Why these priors were selected
 
 class ObservationResponse(BaseModel):
-    patterns: List[str]
+    patterns: Any = []
     context_analysis: str
-    user_state: str
-    confidence: float
+    user_state: str = ""
+    confidence: Optional[float] = 0.5
 
 class UpdateResponse(BaseModel):
     loop: bool  # True to continue cycle, False to proceed to yield
     reasoning: str
-    confidence: float
-    key_insights: List[str]
+    answer_confidence: float = 0.0  # How likely the current answer is good enough; gates early exit
+    confidence: Optional[float] = 0.5
+    key_insights: Any = []
 
 class YieldResponse(BaseModel):
     final_response: str
-    reasoning: str
-    confidence: float
-    priors_used: Optional[List[str]] = None
+    reasoning: str = ""
+    confidence: Optional[float] = 0.5
+    priors_used: Any = None
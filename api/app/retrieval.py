@@ -0,0 +1,86 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+def mmr_select(
+    query_vector: Sequence[float],
+    vectors: np.ndarray,
+    k: int,
+    diversity: float = 0.7,
+    duplicate_threshold: float = 0.95,
+    groups: Optional[Sequence[str]] = None,
+    per_group: Optional[int] = None,
+    relevance: Optional[Sequence[float]] = None
+) -> List[int]:
+    """
+    Pick up to `k` rows of `vectors` by maximal marginal relevance.
+
+    Each pick maximises `diversity * relevance - (1 - diversity) * redundancy`,
+    where redundancy is the highest cosine similarity to anything already
+    picked. Candidates at or above `duplicate_threshold` similarity to a pick
+    are dropped outright, and when `groups` is given no group contributes more
+    than `per_group` rows. `relevance` replaces the cosine similarity to the
+    query, e.g. with fused hybrid scores. Returns row indices in pick order.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    n = len(vectors)
+    if n == 0 or k <= 0:
+        return []
+
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    relevance = vectors @ query if relevance is None else np.asarray(relevance, dtype=np.float32)
+    similarity = vectors @ vectors.T
+
+    if groups is not None and per_group:
+        _, group_ids = np.unique(np.asarray(groups, dtype=object).astype(str), return_inverse=True)
+        group_counts = np.zeros(group_ids.max() + 1, dtype=np.int64)
+    else:
+        group_ids = None
+
+    available = np.ones(n, dtype=bool)
+    redundancy = np.zeros(n, dtype=np.float32)
+    selected: List[int] = []
+    while len(selected) < k and available.any():
+        scores = np.where(available, diversity * relevance - (1 - diversity) * redundancy, -np.inf)
+        pick = int(np.argmax(scores))
+        selected.append(pick)
+        available[pick] = False
+        redundancy = np.maximum(redundancy, similarity[pick])
+        available &= similarity[pick] < duplicate_threshold
+        if group_ids is not None:
+            group = group_ids[pick]
+            group_counts[group] += 1
+            if group_counts[group] >= per_group:
+                available &= group_ids != group
+    return selected
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Fuse ranked id lists: each id scores the sum of 1 / (k + rank) over the lists it appears in.
+
+    Only ranks are used, so scores on different scales (cosine, BM25) combine
+    without normalization. Returns (id, score) pairs, best first.
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda entry: entry[1], reverse=True)
+
+def group_by_thread(priors: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Order priors so each thread's results sit together.
+
+    Threads are ranked by their best similarity and results keep their
+    similarity order within a thread.
+    """
+    if not priors:
+        return []
+    similarity = np.asarray([prior.get("similarity") or 0.0 for prior in priors], dtype=np.float64)
+    _, thread_ids = np.unique(np.asarray([str(prior.get("thread_id", "")) for prior in priors], dtype=object), return_inverse=True)
+    best = np.full(thread_ids.max() + 1, -np.inf)
+    np.maximum.at(best, thread_ids, similarity)
+    # lexsort sorts by the last key first: thread rank, then thread, then similarity
+    order = np.lexsort((-similarity, thread_ids, -best[thread_ids]))
+    return [priors[i] for i in order]
@@ -0,0 +1,81 @@
+import heapq
+import math
+import re
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+from .vector_store import PayloadFilter
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens; identifiers such as snake_case names stay whole."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """
+    In-process BM25 keyword index over message content, updated one message at a time.
+
+    Postings map each term to the documents containing it and their term
+    frequency, so a search only visits documents sharing a term with the
+    query. Adding an existing id replaces its document. Payloads are kept
+    without content, for PayloadFilter checks.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._lengths: Dict[str, int] = {}
+        self._terms: Dict[str, List[str]] = {}
+        self._payloads: Dict[str, Dict[str, Any]] = {}
+        self._total_length = 0
+
+    def add(self, doc_id: str, text: str, payload: Optional[Dict[str, Any]] = None):
+        if doc_id in self._lengths:
+            self.remove(doc_id)
+        tokens = tokenize(text)
+        counts: Dict[str, int] = defaultdict(int)
+        for token in tokens:
+            counts[token] += 1
+        for term, count in counts.items():
+            self._postings[term][doc_id] = count
+        self._lengths[doc_id] = len(tokens)
+        self._terms[doc_id] = list(counts)
+        self._total_length += len(tokens)
+        self._payloads[doc_id] = {key: value for key, value in (payload or {}).items() if key != "content"}
+
+    def remove(self, doc_id: str):
+        if doc_id not in self._lengths:
+            return
+        for term in self._terms.pop(doc_id):
+            del self._postings[term][doc_id]
+            if not self._postings[term]:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop(doc_id)
+        del self._payloads[doc_id]
+
+    def search(self, query: str, limit: int, search_filter: Optional[PayloadFilter] = None) -> List[Tuple[str, float]]:
+        """Return up to `limit` (id, score) pairs, best first."""
+        count = len(self._lengths)
+        if count == 0 or limit <= 0:
+            return []
+        average_length = self._total_length / count or 1.0
+        scores: Dict[str, float] = defaultdict(float)
+        allowed: Dict[str, bool] = {}
+        for term in set(tokenize(query)):
+            docs = self._postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                if search_filter is not None:
+                    if doc_id not in allowed:
+                        allowed[doc_id] = search_filter.matches(self._payloads[doc_id])
+                    if not allowed[doc_id]:
+                        continue
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / average_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def __len__(self) -> int:
+        return len(self._lengths)
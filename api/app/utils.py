@@ -1,9 +1,13 @@
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Iterator, Type, TypeVar
 from .config import Config
-from litellm import completion, embedding
+from .embeddings import get_embedding_batcher, get_embedding_cache
+from .chunking import batched, iter_chunks
+from .context import get_encoder
+from .llm_gateway import get_llm_gateway
+from .models import ModelRoute
 import json
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -11,95 +15,94 @@ logger = logging.getLogger(__name__)
 
 async def get_embedding(input_text: str, model: str) -> List[float]:
     try:
-        # Chunk the input text
-        chunks = chunk_text(input_text, chunk_size=4000, overlap=200)
         config = Config()  # Instantiate Config
+        cache = get_embedding_cache(config)
+        cached = cache.get(model, input_text)
+        if cached is not None:
+            return cached.tolist()
+
+        # Chunk lazily on token boundaries and embed one batch at a time, keeping a
+        # running sum so large documents never hold every chunk in memory at once
+        batcher = get_embedding_batcher(model, config)
+        total = None
+        count = 0
+        for batch in batched(chunk_text(input_text, config.CHUNK_SIZE, config.CHUNK_OVERLAP, model), config.EMBEDDING_BATCH_SIZE):
+            chunk_embeddings = await batcher.embed(batch)
 
-        # Get embeddings for each chunk
-        chunk_embeddings = []
-        for chunk in chunks:
-            response = embedding(
-                model=f"azure/{model}",
-                input=chunk,
-                api_key=config.AZURE_API_KEY,
-                api_base=config.AZURE_API_BASE,
-                api_version=config.AZURE_API_VERSION
-            )
-            embedding_vector = response['data'][0]['embedding']
             # Validate vector size
-            if len(embedding_vector) != config.VECTOR_SIZE:
-                logger.error(f"Embedding vector size mismatch: got {len(embedding_vector)}, expected {config.VECTOR_SIZE}")
-                continue
-            chunk_embeddings.append(embedding_vector)
+            if chunk_embeddings.shape[1] != config.VECTOR_SIZE:
+                logger.error(f"Embedding vector size mismatch: got {chunk_embeddings.shape[1]}, expected {config.VECTOR_SIZE}")
+                return [0.0] * config.VECTOR_SIZE  # Return zero vector as fallback
+            batch_sum = chunk_embeddings.sum(axis=0)
+            total = batch_sum if total is None else total + batch_sum
+            count += len(chunk_embeddings)
 
-        # Average the embeddings if there are multiple chunks
-        if len(chunk_embeddings) > 1:
-            averaged_embedding = [sum(x) / len(chunk_embeddings) for x in zip(*chunk_embeddings)]
-            return averaged_embedding
-        elif len(chunk_embeddings) == 1:
-            return chunk_embeddings[0]
-        else:
+        if count == 0:
             logger.error("No valid embeddings generated")
             return [0.0] * config.VECTOR_SIZE  # Return zero vector as fallback
+
+        # Average the embeddings if there are multiple chunks
+        averaged_embedding = total / count
+        cache.put(model, input_text, averaged_embedding)
+        return averaged_embedding.tolist()
     except Exception as e:
         logger.error(f"Error getting embedding: {e}", exc_info=True)
         return [0.0] * Config().VECTOR_SIZE  # Return zero vector as fallback
 
 async def chat_completion(messages: List[Dict[str, str]], model: str, max_tokens: int, temperature: float, functions: List[Dict[str, Any]] = None) -> str:
-    try:
-        response = completion(
-            model=model,
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            functions=functions
-        )
-        if response and response.choices:
-            return response.choices[0].message.content or ""
-        else:
-            logger.error("No choices returned in chat completion response")
-            return "error"
-    except Exception as e:
-        logger.error(f"Error during chat completion: {e}")
-        return "error"
-
-def chunk_text(text: str, chunk_size: int, overlap: int) -> List[str]:
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = min(start + chunk_size, len(text))
-        chunks.append(text[start:end])
-        start += chunk_size - overlap
-    return chunks
+    """Return the completion text. Errors left after the gateway's retries are raised, not returned as text."""
+    response = await get_llm_gateway().complete(
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        functions=functions
+    )
+    if not response or not response.choices:
+        raise ValueError("No choices returned in chat completion response")
+    return response.choices[0].message.content or ""
+
+def chunk_text(text: str, chunk_size: int, overlap: int, model: Optional[str] = None) -> Iterator[str]:
+    """Lazily split `text` into chunks of `chunk_size` tokens overlapping by `overlap`, using `model`'s tokenizer."""
+    encoder = get_encoder(model) if model else None
+    return iter_chunks(text, chunk_size, overlap, encoder)
 
 async def structured_chat_completion(
     messages: List[Dict[str, str]],
     config: Config,
-    response_format: Optional[Dict[str, Any]] = None
+    response_format: Optional[Dict[str, Any]] = None,
+    on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+    route: Optional[ModelRoute] = None
 ) -> Dict[str, Any]:
     """
     Make a structured chat completion call that returns data in a specified format.
+
+    When `on_delta` is given the completion is streamed and each content token
+    is passed to it as it arrives; the returned content is the full text.
+    `route` picks the model and sampling settings (CHAT_MODEL and the global
+    settings by default). If the routed model fails, its fallback model is
+    tried once, unless tokens have already been streamed.
     """
+    route = route or ModelRoute(model=config.CHAT_MODEL)
     try:
-        # Debug log the inputs
-        logger.info(f"Messages: {messages}")
-        logger.info(f"Response format: {response_format}")
+        # Debug log the inputs; %-style args are only formatted when DEBUG is enabled
+        logger.debug("Messages: %s", messages)
+        logger.debug("Response format: %s", response_format)
 
-        response = completion(
-            model=config.CHAT_MODEL,
-            messages=messages,
-            max_tokens=config.MAX_TOKENS,
-            temperature=config.TEMPERATURE,
-            response_format=response_format
-        )
+        streamed = False
+        if on_delta is not None:
+            async def forward(delta: str):
+                nonlocal streamed
+                streamed = True
+                await on_delta(delta)
 
-        # Debug log the response
-        logger.info(f"Response: {response}")
-
-        return {
-            "status": "success",
-            "content": response.choices[0].message.content
-        }
+        try:
+            return await _routed_chat_completion(messages, config, route.model, route, response_format, forward if on_delta else None)
+        except Exception as e:
+            if not route.fallback_model or streamed:
+                raise
+            logger.warning(f"Model {route.model} failed ({e}), falling back to {route.fallback_model}")
+            return await _routed_chat_completion(messages, config, route.fallback_model, route, response_format, on_delta)
 
     except Exception as e:
         logger.error(f"Error in structured chat completion: {str(e)}")
@@ -108,4 +111,83 @@ async def structured_chat_completion(
             "content": f"An error occurred: {str(e)}"
         }
 
-__all__ = ['get_embedding', 'chat_completion', 'chunk_text', 'structured_chat_completion']
+async def _routed_chat_completion(
+    messages: List[Dict[str, str]],
+    config: Config,
+    model: str,
+    route: ModelRoute,
+    response_format: Optional[Dict[str, Any]],
+    on_delta: Optional[Callable[[str], Awaitable[None]]]
+) -> Dict[str, Any]:
+    params = {
+        "model": model,
+        "messages": messages,
+        "max_tokens": route.max_tokens or config.MAX_TOKENS,
+        "temperature": route.temperature if route.temperature is not None else config.TEMPERATURE,
+        "response_format": response_format
+    }
+    if on_delta is not None:
+        return await _stream_chat_completion(config, params, on_delta)
+
+    response = await get_llm_gateway(config).complete(**params)
+
+    # Debug log the response
+    logger.debug("Response: %s", response)
+
+    return {
+        "status": "success",
+        "content": response.choices[0].message.content,
+        "model": model,
+        "usage": _usage_dict(getattr(response, "usage", None))
+    }
+
+async def _stream_chat_completion(
+    config: Config,
+    params: Dict[str, Any],
+    on_delta: Callable[[str], Awaitable[None]]
+) -> Dict[str, Any]:
+    parts = []
+    usage = None
+    async for chunk in get_llm_gateway(config).stream(stream_options={"include_usage": True}, **params):
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            parts.append(delta)
+            await on_delta(delta)
+        # The last chunk carries token usage for the whole completion
+        usage = getattr(chunk, "usage", None) or usage
+
+    return {
+        "status": "success",
+        "content": "".join(parts),
+        "model": params["model"],
+        "usage": _usage_dict(usage)
+    }
+
+def _usage_dict(usage: Any) -> Dict[str, int]:
+    if usage is None:
+        return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "total_tokens": getattr(usage, "total_tokens", 0) or 0
+    }
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+def parse_structured_response(content: Optional[str], model: Type[ModelT]) -> Optional[ModelT]:
+    """
+    Parse and validate a JSON completion straight into `model`.
+
+    Uses pydantic's native JSON parser, so there is no intermediate dict.
+    Returns None when the content is not valid JSON for the model.
+    """
+    if not content:
+        return None
+    try:
+        return model.model_validate_json(content)
+    except ValidationError as e:
+        logger.warning("Invalid %s: %d validation errors", model.__name__, e.error_count())
+        logger.debug("Rejected content: %s", content)
+        return None
+
+__all__ = ['get_embedding', 'chat_completion', 'chunk_text', 'structured_chat_completion', 'parse_structured_response']
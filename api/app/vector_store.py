@@ -0,0 +1,487 @@
+import asyncio
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, UTC
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from qdrant_client import AsyncQdrantClient, models
+
+logger = logging.getLogger(__name__)
+
+# Searches touching more matrix elements than this run in a worker thread
+INLINE_SEARCH_ELEMENTS = 1 << 22
+# Rows dequantized per step when scoring an int8 matrix
+QUANTIZED_BLOCK_ROWS = 32768
+# Payload fields LocalVectorIndex keeps as columns for filtering: strings as
+# dictionary codes, numbers (created_at as epoch seconds) as float64 with NaN when missing
+CODED_FIELDS = ("thread_id", "role", "step", "status")
+NUMERIC_FIELDS = ("token_value", "created_at")
+
+def epoch_seconds(timestamp: Any) -> float:
+    """An ISO timestamp as epoch seconds (naive ones read as UTC), or NaN when missing or unparseable."""
+    if not isinstance(timestamp, str) or not timestamp:
+        return np.nan
+    try:
+        parsed = datetime.fromisoformat(timestamp)
+    except ValueError:
+        return np.nan
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=UTC)
+    return parsed.timestamp()
+
+@dataclass
+class VectorPoint:
+    id: str
+    vector: Sequence[float]
+    payload: Dict[str, Any]
+
+@dataclass
+class VectorHit:
+    id: str
+    score: float
+    payload: Dict[str, Any]
+    vector: Optional[np.ndarray] = None
+
+@dataclass(frozen=True)
+class PayloadFilter:
+    """
+    Conditions on message payloads, applied inside the index during a search.
+
+    Set fields are ANDed. Range conditions only match points that have the
+    field, so `min_token_value` drops messages without a token value.
+    `created_after` and `created_before` are ISO timestamps, inclusive.
+    """
+    thread_id: Optional[str] = None
+    exclude_thread_id: Optional[str] = None
+    roles: Optional[Tuple[str, ...]] = None
+    steps: Optional[Tuple[str, ...]] = None
+    exclude_steps: Optional[Tuple[str, ...]] = None
+    statuses: Optional[Tuple[str, ...]] = None
+    exclude_statuses: Optional[Tuple[str, ...]] = None
+    min_token_value: Optional[int] = None
+    created_after: Optional[str] = None
+    created_before: Optional[str] = None
+
+    def to_qdrant(self) -> Optional[models.Filter]:
+        must: List[models.Condition] = []
+        must_not: List[models.Condition] = []
+        if self.thread_id is not None:
+            must.append(models.FieldCondition(key="thread_id", match=models.MatchValue(value=self.thread_id)))
+        if self.exclude_thread_id is not None:
+            must_not.append(models.FieldCondition(key="thread_id", match=models.MatchValue(value=self.exclude_thread_id)))
+        for key, values, conditions in [
+            ("role", self.roles, must),
+            ("step", self.steps, must),
+            ("step", self.exclude_steps, must_not),
+            ("status", self.statuses, must),
+            ("status", self.exclude_statuses, must_not)
+        ]:
+            if values is not None:
+                conditions.append(models.FieldCondition(key=key, match=models.MatchAny(any=list(values))))
+        if self.min_token_value is not None:
+            must.append(models.FieldCondition(key="token_value", range=models.Range(gte=self.min_token_value)))
+        if self.created_after is not None or self.created_before is not None:
+            must.append(models.FieldCondition(
+                key="created_at", range=models.DatetimeRange(gte=self.created_after, lte=self.created_before)
+            ))
+        if not must and not must_not:
+            return None
+        return models.Filter(must=must or None, must_not=must_not or None)
+
+    def matches(self, payload: Dict[str, Any]) -> bool:
+        """The same conditions evaluated in Python, for the local index."""
+        thread_id = payload.get("thread_id")
+        if self.thread_id is not None and thread_id != self.thread_id:
+            return False
+        if self.exclude_thread_id is not None and thread_id == self.exclude_thread_id:
+            return False
+        for key, values, wanted in [
+            ("role", self.roles, True),
+            ("step", self.steps, True),
+            ("step", self.exclude_steps, False),
+            ("status", self.statuses, True),
+            ("status", self.exclude_statuses, False)
+        ]:
+            if values is not None and (payload.get(key) in values) != wanted:
+                return False
+        if self.min_token_value is not None:
+            token_value = payload.get("token_value")
+            if token_value is None or token_value < self.min_token_value:
+                return False
+        if self.created_after is not None or self.created_before is not None:
+            created_at = epoch_seconds(payload.get("created_at"))
+            if np.isnan(created_at):
+                return False
+            if self.created_after is not None and created_at < epoch_seconds(self.created_after):
+                return False
+            if self.created_before is not None and created_at > epoch_seconds(self.created_before):
+                return False
+        return True
+
+class VectorStore(ABC):
+    """The vector operations search_similar and save_messages need, independent of where vectors live."""
+
+    @abstractmethod
+    async def search(
+        self, collection: str, query_vector: Sequence[float], limit: int, with_vectors: bool = False,
+        search_filter: Optional[PayloadFilter] = None
+    ) -> List[VectorHit]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def retrieve(self, collection: str, ids: List[str]) -> List[VectorHit]:
+        """Points by id, with payloads and vectors and a score of 0; unknown ids are skipped."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def upsert(self, collection: str, points: List[VectorPoint]):
+        raise NotImplementedError
+
+    def close(self):
+        """Release local resources; stores backed only by a remote client have none."""
+
+class QdrantVectorStore(VectorStore):
+    """
+    Vectors in Qdrant; `call` runs each client call under the database's concurrency bound.
+
+    `search_params` are sent with every query, e.g. the oversampling and
+    rescoring settings for a quantized collection.
+    """
+
+    def __init__(self, client: AsyncQdrantClient, call: Callable[..., Awaitable[Any]], search_params: Optional[models.SearchParams] = None):
+        self.client = client
+        self._call = call
+        self.search_params = search_params
+
+    async def search(
+        self, collection: str, query_vector: Sequence[float], limit: int, with_vectors: bool = False,
+        search_filter: Optional[PayloadFilter] = None
+    ) -> List[VectorHit]:
+        response = await self._call(
+            self.client.query_points,
+            collection_name=collection,
+            query=list(query_vector),
+            limit=limit,
+            with_payload=True,
+            with_vectors=with_vectors,
+            query_filter=search_filter.to_qdrant() if search_filter else None,
+            search_params=self.search_params
+        )
+        return [
+            VectorHit(str(point.id), point.score, point.payload or {}, np.asarray(point.vector, dtype=np.float32) if with_vectors else None)
+            for point in response.points
+        ]
+
+    async def retrieve(self, collection: str, ids: List[str]) -> List[VectorHit]:
+        points = await self._call(self.client.retrieve, collection_name=collection, ids=ids, with_payload=True, with_vectors=True)
+        return [VectorHit(str(point.id), 0.0, point.payload or {}, np.asarray(point.vector, dtype=np.float32)) for point in points]
+
+    async def upsert(self, collection: str, points: List[VectorPoint]):
+        await self._call(
+            self.client.upsert,
+            collection_name=collection,
+            points=[models.PointStruct(id=point.id, vector=list(point.vector), payload=point.payload) for point in points]
+        )
+
+class LocalVectorIndex:
+    """
+    Exact in-process cosine index over one NumPy matrix.
+
+    Vectors are L2-normalized on insert and stored as float32 rows, or as
+    int8 codes with `quantize` (a quarter of the memory, scores off by well
+    under 1%). With a `path` the matrix is a memory-mapped file and ids and
+    payloads are replayed from an append-only log, so the index survives
+    restarts. A search is one matrix-vector product plus argpartition for
+    the top k. Upserting an existing id overwrites its row.
+
+    The payload fields a PayloadFilter tests are also kept as columns, so a
+    filtered search builds its mask with array comparisons instead of
+    visiting each payload.
+    """
+
+    def __init__(self, dim: int, path: Optional[str] = None, capacity: int = 1024, quantize: bool = False):
+        self.dim = dim
+        self.quantize = quantize
+        self._dtype = np.int8 if quantize else np.float32
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._payloads: List[Dict[str, Any]] = []
+        self._codes: Dict[str, Dict[Any, int]] = {field: {} for field in CODED_FIELDS}
+        self._columns: Dict[str, np.ndarray] = {
+            **{field: np.zeros(capacity, dtype=np.int32) for field in CODED_FIELDS},
+            **{field: np.full(capacity, np.nan) for field in NUMERIC_FIELDS}
+        }
+        self._matrix_path = None
+        self._log = None
+        if path is None:
+            self._matrix = np.zeros((capacity, dim), dtype=self._dtype)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._matrix_path = f"{path}.{'i8' if quantize else 'f32'}"
+            self._log_path = f"{self._matrix_path}.log"
+            row_bytes = dim * np.dtype(self._dtype).itemsize
+            if os.path.exists(self._matrix_path):
+                capacity = max(capacity, os.path.getsize(self._matrix_path) // row_bytes)
+                self._resize_file(capacity)
+                self._matrix = np.memmap(self._matrix_path, dtype=self._dtype, mode="r+", shape=(capacity, dim))
+            else:
+                self._matrix = np.memmap(self._matrix_path, dtype=self._dtype, mode="w+", shape=(capacity, dim))
+            self._replay_log()
+            self._log = open(self._log_path, "a", encoding="utf-8")
+
+    def _replay_log(self):
+        if not os.path.exists(self._log_path):
+            return
+        with open(self._log_path, "r+b") as f:
+            replayed = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                replayed += len(line)
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self._assign(entry["id"], entry["row"], entry["payload"])
+            # A crash mid-append leaves a partial last line; drop it so new
+            # entries start on a line of their own
+            if replayed < f.seek(0, os.SEEK_END):
+                logger.warning(f"Dropping incomplete last entry of {self._log_path}")
+                f.truncate(replayed)
+
+    def _assign(self, point_id: str, row: int, payload: Dict[str, Any]):
+        if row == len(self._ids):
+            self._ids.append(point_id)
+            self._payloads.append(payload)
+        else:
+            self._ids[row] = point_id
+            self._payloads[row] = payload
+        self._rows[point_id] = row
+        self._set_columns(row, payload)
+
+    def _set_columns(self, row: int, payload: Dict[str, Any]):
+        capacity = len(self._columns["token_value"])
+        if row >= capacity:
+            capacity = max(row + 1, capacity * 2)
+            for field, column in self._columns.items():
+                grown = np.full(capacity, np.nan) if field in NUMERIC_FIELDS else np.zeros(capacity, dtype=np.int32)
+                grown[:len(column)] = column
+                self._columns[field] = grown
+        for field in CODED_FIELDS:
+            # Missing fields get a code too, for None, so they match like Python's `in`
+            codes = self._codes[field]
+            self._columns[field][row] = codes.setdefault(payload.get(field), len(codes))
+        token_value = payload.get("token_value")
+        self._columns["token_value"][row] = token_value if isinstance(token_value, (int, float)) else np.nan
+        self._columns["created_at"][row] = epoch_seconds(payload.get("created_at"))
+
+    def _filter_mask(self, search_filter: PayloadFilter, count: int) -> np.ndarray:
+        """Rows that pass `search_filter`; the vectorised equivalent of PayloadFilter.matches."""
+        allowed = np.ones(count, dtype=bool)
+
+        def coded(field: str, values: Sequence[Any]) -> np.ndarray:
+            codes = [self._codes[field][value] for value in values if value in self._codes[field]]
+            return np.isin(self._columns[field][:count], codes)
+
+        if search_filter.thread_id is not None:
+            allowed &= coded("thread_id", [search_filter.thread_id])
+        if search_filter.exclude_thread_id is not None:
+            allowed &= ~coded("thread_id", [search_filter.exclude_thread_id])
+        for field, values, wanted in [
+            ("role", search_filter.roles, True),
+            ("step", search_filter.steps, True),
+            ("step", search_filter.exclude_steps, False),
+            ("status", search_filter.statuses, True),
+            ("status", search_filter.exclude_statuses, False)
+        ]:
+            if values is not None:
+                allowed &= coded(field, values) if wanted else ~coded(field, values)
+        # NaN compares False, so range conditions drop rows without the field
+        if search_filter.min_token_value is not None:
+            allowed &= self._columns["token_value"][:count] >= search_filter.min_token_value
+        created_at = self._columns["created_at"][:count]
+        if search_filter.created_after is not None:
+            allowed &= created_at >= epoch_seconds(search_filter.created_after)
+        if search_filter.created_before is not None:
+            allowed &= created_at <= epoch_seconds(search_filter.created_before)
+        return allowed
+
+    def _resize_file(self, capacity: int):
+        with open(self._matrix_path, "r+b") as f:
+            f.truncate(capacity * self.dim * np.dtype(self._dtype).itemsize)
+
+    def _ensure_capacity(self, rows: int):
+        capacity = len(self._matrix)
+        if rows <= capacity:
+            return
+        capacity = max(rows, capacity * 2)
+        if self._matrix_path is None:
+            grown = np.zeros((capacity, self.dim), dtype=self._dtype)
+            grown[:len(self._ids)] = self._matrix[:len(self._ids)]
+            self._matrix = grown
+        else:
+            self._matrix.flush()
+            self._resize_file(capacity)
+            self._matrix = np.memmap(self._matrix_path, dtype=self._dtype, mode="r+", shape=(capacity, self.dim))
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        if not self.quantize:
+            return vectors
+        return np.clip(np.rint(vectors * 127), -127, 127).astype(np.int8)
+
+    def upsert(self, ids: Sequence[str], vectors: Any, payloads: Sequence[Dict[str, Any]]):
+        if not ids:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dim)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        next_row = len(self._ids)
+        new_rows: Dict[str, int] = {}
+        rows = []
+        for point_id in ids:
+            row = self._rows.get(point_id, new_rows.get(point_id))
+            if row is None:
+                row = new_rows[point_id] = next_row
+                next_row += 1
+            rows.append(row)
+        self._ensure_capacity(next_row)
+        self._matrix[rows] = self._encode(vectors)
+        for point_id, row, payload in zip(ids, rows, payloads):
+            self._assign(point_id, row, payload)
+        if self._log is not None:
+            self._log.write("".join(
+                json.dumps({"id": point_id, "row": row, "payload": payload}) + "\n"
+                for point_id, row, payload in zip(ids, rows, payloads)
+            ))
+            self._log.flush()
+
+    def scores(self, query_vector: Sequence[float]) -> np.ndarray:
+        """Cosine similarity of the query to every stored row."""
+        count = len(self._ids)
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        if not self.quantize:
+            return self._matrix[:count] @ query
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, QUANTIZED_BLOCK_ROWS):
+            stop = min(start + QUANTIZED_BLOCK_ROWS, count)
+            scores[start:stop] = self._matrix[start:stop].astype(np.float32) @ query
+        return scores / 127
+
+    def search(
+        self, query_vector: Sequence[float], limit: int, with_vectors: bool = False, search_filter: Optional[PayloadFilter] = None
+    ) -> List[VectorHit]:
+        count = len(self._ids)
+        if count == 0 or limit <= 0:
+            return []
+        scores = self.scores(query_vector)
+        if search_filter is not None:
+            allowed = self._filter_mask(search_filter, count)
+            count = int(allowed.sum())
+            if count == 0:
+                return []
+            scores = np.where(allowed, scores, -np.inf)
+        k = min(limit, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            VectorHit(self._ids[row], float(scores[row]), self._payloads[row], self.vector(row) if with_vectors else None)
+            for row in top
+        ]
+
+    def get(self, point_id: str) -> Optional[VectorHit]:
+        row = self._rows.get(point_id)
+        if row is None:
+            return None
+        return VectorHit(point_id, 0.0, self._payloads[row], self.vector(row))
+
+    def vector(self, row: int) -> np.ndarray:
+        vector = np.asarray(self._matrix[row], dtype=np.float32)
+        return vector / 127 if self.quantize else vector
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def close(self):
+        if self._matrix_path is not None:
+            self._matrix.flush()
+        if self._log is not None:
+            self._log.close()
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process stand-in for Qdrant: one LocalVectorIndex per collection.
+
+    Only vector search and upserts are served; thread history and other
+    payload queries still need Qdrant.
+    """
+
+    def __init__(self, dim: int, path: Optional[str] = None, capacity: int = 1024, quantize: bool = False):
+        self.dim = dim
+        self.path = path
+        self.capacity = capacity
+        self.quantize = quantize
+        self.indexes: Dict[str, LocalVectorIndex] = {}
+
+    def index(self, collection: str) -> LocalVectorIndex:
+        index = self.indexes.get(collection)
+        if index is None:
+            path = os.path.join(self.path, collection) if self.path else None
+            index = LocalVectorIndex(self.dim, path, self.capacity, self.quantize)
+            self.indexes[collection] = index
+        return index
+
+    async def search(
+        self, collection: str, query_vector: Sequence[float], limit: int, with_vectors: bool = False,
+        search_filter: Optional[PayloadFilter] = None
+    ) -> List[VectorHit]:
+        index = self.index(collection)
+        # Small (hot) indexes answer inline; large scans go to a thread to keep the loop responsive
+        if len(index) * self.dim <= INLINE_SEARCH_ELEMENTS:
+            return index.search(query_vector, limit, with_vectors, search_filter)
+        return await asyncio.to_thread(index.search, query_vector, limit, with_vectors, search_filter)
+
+    async def retrieve(self, collection: str, ids: List[str]) -> List[VectorHit]:
+        index = self.index(collection)
+        return [hit for hit in (index.get(point_id) for point_id in ids) if hit is not None]
+
+    async def upsert(self, collection: str, points: List[VectorPoint]):
+        self.index(collection).upsert(
+            [point.id for point in points],
+            [point.vector for point in points],
+            [point.payload for point in points]
+        )
+
+    def close(self):
+        for index in self.indexes.values():
+            index.close()
+
+class CachedVectorStore(VectorStore):
+    """
+    Hot-shard cache: searches are served by a local store, writes go to both.
+
+    Warm it from the remote collection at startup with DatabaseClient.warm_vector_cache().
+    Writes made by other processes are not seen until the next warm-up.
+    """
+
+    def __init__(self, local: LocalVectorStore, remote: VectorStore):
+        self.local = local
+        self.remote = remote
+
+    async def search(
+        self, collection: str, query_vector: Sequence[float], limit: int, with_vectors: bool = False,
+        search_filter: Optional[PayloadFilter] = None
+    ) -> List[VectorHit]:
+        return await self.local.search(collection, query_vector, limit, with_vectors, search_filter)
+
+    async def retrieve(self, collection: str, ids: List[str]) -> List[VectorHit]:
+        return await self.local.retrieve(collection, ids)
+
+    async def upsert(self, collection: str, points: List[VectorPoint]):
+        await self.remote.upsert(collection, points)
+        await self.local.upsert(collection, points)
+
+    def close(self):
+        self.local.close()
+        self.remote.close()
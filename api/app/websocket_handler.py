@@ -1,8 +1,8 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from .chorus_cycle import ChorusCycle
-from .models import ConnectionState, ClientMessage, ServerMessage
-from .database import DatabaseClient
-from .config import Config
+from .models import ConnectionState, ClientMessage, ServerMessage, Effect
+from typing import Optional
+import asyncio
 import logging
 
 # Configure logging
@@ -10,15 +10,82 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+async def send_effect(websocket: WebSocket, effect: Effect):
+    logger.debug(f"Processing effect type: {effect.type}")
+    if effect.type == "send_messages":
+        await websocket.send_json(ServerMessage(type="thread_messages", data=effect.payload).dict())
+        logger.info(f"Sent thread messages")
+    elif effect.type == "new_thread":
+        await websocket.send_json(ServerMessage(type="new_thread", data=effect.payload).dict())
+        logger.info(f"Sent new thread notification")
+    elif effect.type == "chorus_response":
+        await websocket.send_json(ServerMessage(type="chorus_response", data=effect.payload).dict())
+        if effect.payload.get("final", True):
+            logger.info(f"Sent chorus response for step: {effect.payload.get('step')}")
+    elif effect.type == "error":
+        await websocket.send_json(ServerMessage(type="error", data=effect.payload).dict())
+        logger.info(f"Sent error message")
+
+class EffectSender:
+    """
+    Per-socket outbound queue drained by a background task.
+
+    Producers await once `max_pending` effects are waiting, so a slow client
+    slows down its own cycle instead of growing server memory. If a send
+    fails, later calls raise that error so the producer stops early.
+    """
+
+    def __init__(self, websocket: WebSocket, max_pending: int):
+        self.websocket = websocket
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._error: Optional[Exception] = None
+        self._task = asyncio.create_task(self._run())
+
+    async def __call__(self, effect: Effect):
+        if self._error is not None:
+            raise self._error
+        await self._queue.put(effect)
+
+    async def _run(self):
+        while True:
+            effect = await self._queue.get()
+            if effect is None:
+                break
+            # Keep draining after a failure so blocked producers are released
+            if self._error is None:
+                try:
+                    await send_effect(self.websocket, effect)
+                except Exception as e:
+                    self._error = e
+
+    async def close(self):
+        """Send everything still queued, then stop the sender task."""
+        await self._queue.put(None)
+        await self._task
+
+    def abort(self):
+        """Stop sending immediately, dropping anything still queued."""
+        self._task.cancel()
+
 @router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     logger.info("New WebSocket connection attempt")
     await websocket.accept()
     logger.info("WebSocket connection accepted")
 
-    config = Config.from_env()
-    db = DatabaseClient(config)
-    chorus = ChorusCycle(db, config)
+    # Reuse the process-wide config and database client created at startup
+    config = websocket.app.state.config
+    db = websocket.app.state.database
+
+    writer = websocket.app.state.message_writer
+    chorus = ChorusCycle(
+        db,
+        config,
+        stream_tokens=config.STREAM_RESPONSES,
+        writer=writer,
+        completion_cache=websocket.app.state.completion_cache
+    )
+    sender = EffectSender(websocket, config.WS_SEND_QUEUE_SIZE)
     state = ConnectionState(client_id="", user=None, thread_id=None, status="connected", error_state=None)
     logger.info("Initial connection state established")
 
@@ -26,25 +93,13 @@ async def websocket_endpoint(websocket: WebSocket):
         while True:
             data = await websocket.receive_json()
             logger.info(f"Received message type: {data.get('type')}")
-            logger.debug(f"Message data: {data}")
+            logger.debug("Message data: %s", data)
 
             client_message = ClientMessage(type=data.get('type'), data=data.get('data', {}))
             logger.info(f"Processing client message type: {client_message.type}")
 
-            new_state, effects = await chorus.handle_client_message(state, client_message)
-            logger.debug(f"Generated {len(effects)} effects")
-
-            for effect in effects:
-                logger.debug(f"Processing effect type: {effect.type}")
-                if effect.type == "send_messages":
-                    await websocket.send_json(ServerMessage(type="thread_messages", data=effect.payload).dict())
-                    logger.info(f"Sent thread messages")
-                elif effect.type == "new_thread":
-                    await websocket.send_json(ServerMessage(type="new_thread", data=effect.payload).dict())
-                    logger.info(f"Sent new thread notification")
-                elif effect.type == "chorus_response":
-                    await websocket.send_json(ServerMessage(type="chorus_response", data=effect.payload).dict())
-                    logger.info(f"Sent chorus response for step: {effect.payload.get('step')}")
+            # Effects are forwarded through the sender as each one is produced
+            new_state, _ = await chorus.handle_client_message(state, client_message, sink=sender)
 
             state = new_state
             logger.debug("State updated successfully")
@@ -55,9 +110,11 @@ async def websocket_endpoint(websocket: WebSocket):
         logger.error(f"WebSocket error: {str(e)}", exc_info=True)
         try:
             new_state, error_msg = await chorus.handle_connection_error(e, state)
+            await sender.close()
             await websocket.send_json(ServerMessage(type="error", data={"message": error_msg}).dict())
             logger.info("Error message sent to client")
         except Exception as send_error:
             logger.error(f"Failed to send error message to client: {str(send_error)}")
     finally:
+        sender.abort()
         logger.info("WebSocket connection closed")
@@ -0,0 +1,68 @@
+"""
+Chunking benchmark over multi-megabyte documents.
+
+Compares the old fixed character windows (4000 chars, 200 overlap, every
+chunk materialised as a list of copies) against the lazy token-aware
+chunker at Config.CHUNK_SIZE/CHUNK_OVERLAP. Reports wall time, peak traced
+memory and the number of chunks, i.e. embedding inputs sent upstream.
+
+    cd api && python -m benchmarks.bench_chunking --megabytes 8
+"""
+import argparse
+import logging
+import random
+import time
+import tracemalloc
+from app.chunking import iter_chunks
+from app.config import Config
+from app.context import get_encoder
+
+WORDS = ["choir", "harmony", "voice", "collective", "signal", "response", "thread", "prior",
+         "naïve", "café", "résumé", "über", "—", "42", "\n\n"]
+
+def make_document(megabytes: float) -> str:
+    rng = random.Random(0)
+    target = int(megabytes * 1024 * 1024)
+    parts, size = [], 0
+    while size < target:
+        word = rng.choice(WORDS)
+        parts.append(word)
+        size += len(word) + 1
+    return " ".join(parts)
+
+def legacy_chunk_text(text: str, chunk_size: int = 4000, overlap: int = 200):
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        chunks.append(text[start:end])
+        start += chunk_size - overlap
+    return chunks
+
+def measure(label: str, run):
+    tracemalloc.start()
+    start = time.perf_counter()
+    chunks = run()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<10} {elapsed:8.3f}s  peak {peak / 1024 / 1024:8.1f} MiB  chunks {chunks}")
+
+def main(megabytes: float):
+    config = Config()
+    document = make_document(megabytes)
+    encoder = get_encoder(config.EMBEDDING_MODEL)
+    tokenizer = encoder.name if encoder is not None else f"estimated ({config.EMBEDDING_MODEL} tokenizer unavailable)"
+    print(f"document {len(document) / 1024 / 1024:.1f}M chars, tokenizer {tokenizer}")
+    print(f"chunk size {config.CHUNK_SIZE} tokens, overlap {config.CHUNK_OVERLAP}")
+
+    measure("legacy", lambda: len(legacy_chunk_text(document)))
+    # Consume the generator without keeping chunks, as get_embedding does batch by batch
+    measure("lazy", lambda: sum(1 for _ in iter_chunks(document, config.CHUNK_SIZE, config.CHUNK_OVERLAP, encoder)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--megabytes", type=float, default=8, help="size of the generated document")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    main(args.megabytes)
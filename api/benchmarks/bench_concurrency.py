@@ -0,0 +1,133 @@
+"""
+Concurrency benchmark for submit_prompt cycles.
+
+Runs N chorus cycles one after another and then all at once against an
+in-memory Qdrant with injected round-trip latency and a fake LLM. If the
+storage layer never blocks the event loop, the concurrent run should take
+roughly as long as a single cycle rather than N of them.
+
+    cd api && python -m benchmarks.bench_concurrency --cycles 16
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+from qdrant_client import AsyncQdrantClient, models
+from app import chorus_cycle
+from app.chorus_cycle import ChorusCycle
+from app.config import Config
+from app.database import DatabaseClient
+from app.models import ClientMessage, ConnectionState
+
+STEP_RESPONSE = json.dumps({
+    "proposed_response": "ok",
+    "synthesis": "ok",
+    "explicit_intent": "ok",
+    "implicit_intent": "ok",
+    "context_analysis": "ok",
+    "loop": False,
+    "reasoning": "ok",
+    "confidence": 0.9,
+    "final_response": "ok"
+})
+
+class LatencyClient:
+    """Proxy an async Qdrant client, sleeping before each call to simulate a network round trip."""
+
+    def __init__(self, client: AsyncQdrantClient, latency: float):
+        self._client = client
+        self._latency = latency
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(self._latency)
+            return await method(*args, **kwargs)
+
+        return call
+
+def install_fake_llm(latency: float):
+    async def fake_completion(messages, config, response_format=None, on_delta=None, route=None):
+        await asyncio.sleep(latency)
+        return {"status": "success", "content": STEP_RESPONSE}
+
+    async def fake_embedding(input_text, model):
+        await asyncio.sleep(latency)
+        return [random.random() for _ in range(Config.VECTOR_SIZE)]
+
+    chorus_cycle.structured_chat_completion = fake_completion
+    chorus_cycle.get_embedding = fake_embedding
+
+async def make_database(config: Config, latency: float, points: int) -> DatabaseClient:
+    client = AsyncQdrantClient(location=":memory:")
+    for collection in [config.MESSAGES_COLLECTION, config.CHAT_THREADS_COLLECTION, config.USERS_COLLECTION]:
+        await client.create_collection(
+            collection_name=collection,
+            vectors_config=models.VectorParams(size=config.VECTOR_SIZE, distance=models.Distance.COSINE)
+        )
+    await client.upsert(
+        collection_name=config.MESSAGES_COLLECTION,
+        points=[
+            models.PointStruct(
+                id=str(uuid.uuid4()),
+                vector=[random.random() for _ in range(config.VECTOR_SIZE)],
+                payload={"content": f"message {i}", "thread_id": "bench", "role": "assistant"}
+            )
+            for i in range(points)
+        ]
+    )
+    return DatabaseClient(config, LatencyClient(client, latency))
+
+async def run_cycle(chorus: ChorusCycle, i: int):
+    state = ConnectionState(client_id=str(i), user=None, thread_id=None, status="connected", error_state=None)
+    message = ClientMessage(type="submit_prompt", data={"thread_id": "bench", "content": f"prompt {i}"})
+    await chorus.handle_client_message(state, message)
+
+async def monitor_loop_lag(stop: asyncio.Event, interval: float = 0.005) -> float:
+    """Return the worst observed event-loop stall while the benchmark runs."""
+    loop = asyncio.get_running_loop()
+    worst = 0.0
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        worst = max(worst, loop.time() - start - interval)
+    return worst
+
+async def main(cycles: int, llm_latency: float, db_latency: float, points: int):
+    config = Config()
+    install_fake_llm(llm_latency)
+    database = await make_database(config, db_latency, points)
+    chorus = ChorusCycle(database, config)
+
+    start = time.perf_counter()
+    for i in range(cycles):
+        await run_cycle(chorus, i)
+    sequential = time.perf_counter() - start
+
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(run_cycle(chorus, i) for i in range(cycles)))
+    concurrent = time.perf_counter() - start
+    stop.set()
+    worst_lag = await monitor
+
+    print(f"cycles={cycles} llm_latency={llm_latency * 1000:.0f}ms db_latency={db_latency * 1000:.0f}ms")
+    print(f"sequential: {sequential:.3f}s ({sequential / cycles * 1000:.1f}ms/cycle)")
+    print(f"concurrent: {concurrent:.3f}s")
+    print(f"overlap:    {sequential / concurrent:.1f}x (ideal {cycles}x)")
+    print(f"worst event-loop stall: {worst_lag * 1000:.1f}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cycles", type=int, default=16)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds per fake LLM/embedding call")
+    parser.add_argument("--db-latency", type=float, default=0.02, help="seconds per Qdrant round trip")
+    parser.add_argument("--points", type=int, default=500, help="messages seeded into the collection")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    asyncio.run(main(args.cycles, args.llm_latency, args.db_latency, args.points))
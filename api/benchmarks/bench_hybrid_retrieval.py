@@ -0,0 +1,92 @@
+"""
+Hybrid retrieval benchmark: dense-only against BM25 + dense fused by reciprocal rank.
+
+Builds a synthetic corpus of topic clusters in which each message also
+names one identifier (ticket ids, function names). Queries ask about one
+message's identifier; their embedding only captures the topic, as ada-002
+would, so dense search must pick the target out of its whole cluster.
+Reports recall@limit of the target and search_similar latency for both
+modes, on the local vector store so nothing leaves the process.
+
+    cd api && python -m benchmarks.bench_hybrid_retrieval --messages 5000
+"""
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+import numpy as np
+from qdrant_client import AsyncQdrantClient
+from app.config import Config
+from app.database import DatabaseClient
+from app.models import MessageRecord
+from app.vector_store import LocalVectorStore
+
+WORDS = ["deploy", "pipeline", "latency", "thread", "prior", "voice", "choir", "index", "retry", "cache",
+         "queue", "token", "budget", "model", "stream", "socket", "vector", "summary", "yield", "update"]
+
+def percentile_ms(samples, q):
+    return np.percentile(samples, q) * 1000
+
+def make_corpus(messages: int, topics: int, dim: int, rng: np.random.Generator):
+    centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    records, topic_of = [], []
+    for i in range(messages):
+        topic = i % topics
+        words = " ".join(rng.choice(WORDS, size=12))
+        records.append(MessageRecord(
+            id=str(uuid.uuid4()),
+            thread_id=f"thread-{i // 4}",
+            role="user",
+            content=f"{words} see ticket_{i:06d}",
+            created_at="2024-11-01T00:00:00+00:00",
+            vector=(centers[topic] + 0.3 * rng.standard_normal(dim)).tolist()
+        ))
+        topic_of.append(topic)
+    return records, centers, topic_of
+
+async def run(database: DatabaseClient, queries, limit: int, hybrid: bool):
+    samples, found = [], 0
+    for target, text, vector in queries:
+        start = time.perf_counter()
+        results = await database.search_similar(
+            database.config.MESSAGES_COLLECTION, vector, limit, query_text=text if hybrid else None
+        )
+        samples.append(time.perf_counter() - start)
+        found += any(result["id"] == target for result in results)
+    return found / len(queries), samples
+
+async def main(messages: int, topics: int, queries: int, limit: int):
+    logging.disable(logging.INFO)
+    config = Config()
+    config.RETRIEVAL_CACHE_TTL = 0
+    rng = np.random.default_rng(0)
+    records, centers, topic_of = make_corpus(messages, topics, config.VECTOR_SIZE, rng)
+    database = DatabaseClient(config, AsyncQdrantClient(location=":memory:"), LocalVectorStore(config.VECTOR_SIZE, capacity=messages))
+    for start in range(0, messages, 512):
+        await database.save_messages(records[start:start + 512])
+
+    picks = rng.choice(messages, size=queries, replace=False)
+    query_set = [
+        (
+            records[i].id,
+            f"what happened with ticket_{i:06d}",
+            (centers[topic_of[i]] + 0.3 * rng.standard_normal(config.VECTOR_SIZE)).tolist()
+        )
+        for i in picks
+    ]
+
+    print(f"messages={messages} topics={topics} queries={queries} limit={limit} candidates={config.SEARCH_LIMIT}")
+    for label, hybrid in (("dense", False), ("hybrid", True)):
+        recall, samples = await run(database, query_set, limit, hybrid)
+        print(f"{label:<8} recall@{limit} {recall:6.3f}  p50 {percentile_ms(samples, 50):8.3f}ms  p99 {percentile_ms(samples, 99):8.3f}ms")
+    await database.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--topics", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=12, help="priors returned, as PRIOR_LIMIT")
+    args = parser.parse_args()
+    asyncio.run(main(args.messages, args.topics, args.queries, args.limit))
@@ -0,0 +1,71 @@
+"""
+Vector search benchmark: in-memory Qdrant against the local NumPy index.
+
+Seeds the same random vectors into an in-process Qdrant collection and into
+LocalVectorIndex (float32 and int8), then reports per-query latency and
+the int8 index's recall against exact float32 results. Nothing leaves the
+process, so the numbers are reproducible on any machine.
+
+    cd api && python -m benchmarks.bench_vector_search --points 20000
+"""
+import argparse
+import asyncio
+import time
+import numpy as np
+from qdrant_client import AsyncQdrantClient, models
+from app.vector_store import LocalVectorIndex
+
+def percentile_ms(samples, q):
+    return np.percentile(samples, q) * 1000
+
+def report(label: str, samples):
+    print(f"{label:<16} p50 {percentile_ms(samples, 50):8.3f}ms  p99 {percentile_ms(samples, 99):8.3f}ms")
+
+async def main(points: int, dim: int, queries: int, limit: int):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((points, dim)).astype(np.float32)
+    query_vectors = rng.standard_normal((queries, dim)).astype(np.float32)
+    ids = [str(i) for i in range(points)]
+
+    client = AsyncQdrantClient(location=":memory:")
+    await client.create_collection("bench", vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE))
+    for start in range(0, points, 1000):
+        await client.upsert("bench", points=[
+            models.PointStruct(id=i, vector=vectors[i].tolist(), payload={"n": i})
+            for i in range(start, min(start + 1000, points))
+        ])
+    exact = LocalVectorIndex(dim, capacity=points)
+    quantized = LocalVectorIndex(dim, capacity=points, quantize=True)
+    for index in (exact, quantized):
+        index.upsert(ids, vectors, [{"n": i} for i in range(points)])
+
+    print(f"points={points} dim={dim} queries={queries} limit={limit}")
+    samples = []
+    for query in query_vectors:
+        start = time.perf_counter()
+        await client.query_points("bench", query=query.tolist(), limit=limit, with_payload=True)
+        samples.append(time.perf_counter() - start)
+    report("qdrant :memory:", samples)
+
+    results = {}
+    for label, index in (("local float32", exact), ("local int8", quantized)):
+        samples, results[label] = [], []
+        for query in query_vectors:
+            start = time.perf_counter()
+            hits = index.search(query, limit)
+            samples.append(time.perf_counter() - start)
+            results[label].append({hit.id for hit in hits})
+        report(label, samples)
+
+    recall = np.mean([len(a & b) / limit for a, b in zip(results["local float32"], results["local int8"])])
+    print(f"int8 recall@{limit}: {recall:.3f}")
+    await client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=80, help="candidates per search, as SEARCH_LIMIT")
+    args = parser.parse_args()
+    asyncio.run(main(args.points, args.dim, args.queries, args.limit))
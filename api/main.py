@@ -1,12 +1,49 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.websocket_handler import router as websocket_router
+from app.database import DatabaseClient, create_qdrant_client
+from app.embeddings import get_embedding_cache
+from app.completion_cache import get_completion_cache
+from app.message_writer import MessageWriter
+from app.context import get_encoder
 from app.config import Config
 
-app = FastAPI()
-
 config = Config.from_env()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load tokenizers up front, off the event loop, rather than on the first request
+    for model in {config.CHAT_MODEL, config.EMBEDDING_MODEL}:
+        await asyncio.to_thread(get_encoder, model)
+    # One pooled Qdrant client per process, shared by every WebSocket connection
+    database = DatabaseClient(config, create_qdrant_client(config))
+    await database.verify_collections()
+    await database.ensure_indexes()
+    await database.warm_vector_cache()
+    await database.warm_sparse_index()
+    writer = None
+    if config.PERSIST_MESSAGES:
+        writer = MessageWriter(database, config, config.WRITE_BEHIND_FLUSH_SIZE, config.WRITE_BEHIND_FLUSH_INTERVAL)
+        writer.start()
+    app.state.config = config
+    app.state.database = database
+    app.state.message_writer = writer
+    app.state.completion_cache = get_completion_cache(config) if config.COMPLETION_CACHE else None
+    try:
+        yield
+    finally:
+        # Flush queued messages before the client they are written through goes away
+        if writer is not None:
+            await writer.close()
+        await database.close()
+        get_embedding_cache(config).close()
+        if app.state.completion_cache is not None:
+            app.state.completion_cache.close()
+
+app = FastAPI(lifespan=lifespan)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -22,3 +59,12 @@ app.include_router(websocket_router)
 @app.get("/")
 async def root():
     return {"message": "Choir Collective API"}
+
+@app.get("/metrics")
+async def metrics():
+    """Cache hit rates for this process."""
+    completion_cache = getattr(app.state, "completion_cache", None)
+    return {
+        "completion_cache": completion_cache.stats() if completion_cache is not None else None,
+        "embedding_cache": get_embedding_cache(config).stats()
+    }
@@ -0,0 +1,52 @@
+"""
+Bulk-load messages from JSONL into the messages collection, or export it for re-embedding.
+
+Each line is a JSON object with "content" and optionally "id", "thread_id",
+"role", "created_at", "step", "status", "seq" and "vector". Progress is
+checkpointed to <input>.checkpoint; re-run the same command to resume.
+
+    cd api && python -m scripts.ingest_messages messages.jsonl --concurrency 8
+    cd api && python -m scripts.ingest_messages messages.jsonl --export
+"""
+import argparse
+import asyncio
+from app.config import Config
+from app.database import DatabaseClient
+from app.embeddings import litellm_embed_fn
+from app.ingest import BulkIngester, export_messages
+from app.utils import logger
+
+async def main(args):
+    config = Config.from_env()
+    # Write straight to Qdrant; a hot cache or keyword index in this process would only hold memory
+    config.VECTOR_STORE = "qdrant"
+    config.HYBRID_SEARCH = False
+    database = DatabaseClient(config)
+    try:
+        await database.verify_collections()
+        if args.export:
+            exported = await export_messages(database, args.input)
+            logger.info(f"Exported {exported} messages to {args.input}")
+            return
+        ingester = BulkIngester(
+            database,
+            litellm_embed_fn(config.EMBEDDING_MODEL, config),
+            config,
+            batch_size=args.batch_size,
+            embed_batch_size=args.embed_batch_size,
+            concurrency=args.concurrency,
+            checkpoint_path=args.checkpoint
+        )
+        await ingester.ingest(args.input)
+    finally:
+        await database.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="JSONL file to read, or to write with --export")
+    parser.add_argument("--export", action="store_true", help="write the collection to INPUT instead of loading it")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: INPUT.checkpoint)")
+    parser.add_argument("--batch-size", type=int, default=256, help="messages per upsert")
+    parser.add_argument("--embed-batch-size", type=int, default=512, help="inputs per embedding request (ada-002 allows 2048)")
+    parser.add_argument("--concurrency", type=int, default=8, help="batches and embedding requests in flight")
+    asyncio.run(main(parser.parse_args()))
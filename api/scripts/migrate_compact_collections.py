@@ -0,0 +1,31 @@
+"""
+Re-create the messages collection with compact vector storage (VECTOR_QUANTIZATION, VECTORS_ON_DISK).
+
+The collection is copied into `<name>__compact` and the original name
+becomes an alias of the copy. Safe to re-run after an interruption.
+chat_threads and users are small and keep their own storage.
+
+Stop the API and any ingest jobs first: messages written during the copy
+are lost, and the collection name is briefly missing during the swap.
+
+    cd api && VECTOR_QUANTIZATION=scalar VECTORS_ON_DISK=true python -m scripts.migrate_compact_collections
+"""
+import asyncio
+from app.config import Config
+from app.database import DatabaseClient
+from app.utils import logger
+
+async def main():
+    config = Config.from_env()
+    database = DatabaseClient(config)
+    try:
+        copied = await database.compact_collection(config.MESSAGES_COLLECTION)
+        logger.info(f"Copied {copied} points from {config.MESSAGES_COLLECTION}")
+        # Payload indexes belong to the old collection; rebuild them on the new one
+        await database.ensure_indexes()
+        await database.verify_collections()
+    finally:
+        await database.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
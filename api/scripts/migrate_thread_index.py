@@ -0,0 +1,23 @@
+"""
+Migrate threads from the legacy `messages` id array to the per-message index.
+
+    cd api && python -m scripts.migrate_thread_index
+"""
+import asyncio
+from app.config import Config
+from app.database import DatabaseClient
+from app.utils import logger
+
+async def main():
+    config = Config.from_env()
+    database = DatabaseClient(config)
+    try:
+        await database.verify_collections()
+        await database.ensure_indexes()
+        migrated = await database.migrate_thread_message_lists()
+        logger.info(f"Migrated {migrated} threads")
+    finally:
+        await database.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
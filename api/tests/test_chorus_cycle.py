@@ -0,0 +1,475 @@
+import asyncio
+import json
+import pytest
+from app import chorus_cycle, message_writer
+from app.chorus_cycle import ChorusCycle
+from app.completion_cache import CompletionCache
+from app.config import Config
+from app.message_writer import MessageWriter
+from app.models import ChorusState, ClientMessage, ConnectionState, StepEnum
+from tests.test_database import make_database
+
+STEP_RESPONSE = {
+    "proposed_response": "action output",
+    "synthesis": "experience output",
+    "explicit_intent": "explicit",
+    "implicit_intent": "implicit",
+    "context_analysis": "observation output",
+    "loop": False,
+    "reasoning": "done",
+    "answer_confidence": 0.9,
+    "final_response": "yield output"
+}
+
+class FakeDatabase:
+    def __init__(self, thread=()):
+        self.searches = 0
+        self.search_filters = []
+        self.thread = list(thread)
+        self.seq = 0
+
+    def next_sequence(self):
+        self.seq += 1
+        return self.seq
+
+    async def search_similar(self, collection, query_vector, limit=10, search_filter=None, query_text=None):
+        self.searches += 1
+        self.search_filters.append(search_filter)
+        return [{"id": "p1", "content": "prior", "thread_id": "t", "similarity": 0.9}]
+
+    async def get_messages(self, thread_id, cursor=None, limit=50, since=None):
+        start = cursor or 0
+        page = [{"seq": seq, "content": content} for seq, content in enumerate(self.thread) if seq >= start][:limit]
+        next_cursor = page[-1]["seq"] + 1 if len(page) == limit else None
+        return page, next_cursor
+
+class FakeLLM:
+    def __init__(self):
+        self.calls = []
+        self.routes = []
+        self.response = dict(STEP_RESPONSE)
+        self.tokens = 0
+        self.delay = 0.0
+
+    async def completion(self, messages, config, response_format=None, on_delta=None, route=None):
+        self.calls.append(messages)
+        self.routes.append(route)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        content = json.dumps(self.response)
+        if on_delta is not None:
+            for i in range(0, len(content), 16):
+                await on_delta(content[i:i + 16])
+        return {"status": "success", "content": content, "usage": {"total_tokens": self.tokens}}
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    llm = FakeLLM()
+
+    async def fake_embedding(input_text, model):
+        return [0.0] * Config.VECTOR_SIZE
+
+    monkeypatch.setattr(chorus_cycle, "structured_chat_completion", llm.completion)
+    monkeypatch.setattr(chorus_cycle, "get_embedding", fake_embedding)
+    return llm
+
+def new_state() -> ChorusState:
+    return ChorusState(messages=[], current_step=StepEnum.ACTION, thread_id="t")
+
+class RecordingSink:
+    def __init__(self):
+        self.effects = []
+
+    async def __call__(self, effect):
+        self.effects.append(effect)
+
+    def finals(self):
+        return [effect for effect in self.effects if effect.payload.get("final", True)]
+
+class CollectingWriter:
+    def __init__(self):
+        self.messages = []
+
+    def submit(self, message):
+        self.messages.append(message)
+        return asyncio.get_running_loop().create_future()
+
+@pytest.mark.asyncio
+async def test_cycle_emits_one_final_effect_per_step(fake_llm):
+    chorus = ChorusCycle(FakeDatabase(), Config())
+    sink = RecordingSink()
+
+    state = await chorus.run_chorus_cycle(new_state(), "hello", sink)
+
+    steps = [effect.payload["step"] for effect in sink.effects]
+    assert steps == ["action", "experience", "intention", "observation", "update", "yield"]
+    assert sink.effects[-1].payload["content"] == "yield output"
+    assert state.current_step == StepEnum.YIELD
+
+@pytest.mark.asyncio
+async def test_experience_searches_without_intermediate_step_outputs(fake_llm):
+    database = FakeDatabase()
+    await ChorusCycle(database, Config()).run_chorus_cycle(new_state(), "hello", RecordingSink())
+
+    search_filter = database.search_filters[0]
+    assert "yield" not in search_filter.exclude_steps
+    assert {"action", "observation"} <= set(search_filter.exclude_steps)
+    assert search_filter.exclude_statuses == ("rejected",)
+
+@pytest.mark.asyncio
+async def test_each_step_is_emitted_before_the_next_step_runs(fake_llm, monkeypatch):
+    sink = RecordingSink()
+    seen_before_call = []
+    original = chorus_cycle.structured_chat_completion
+
+    async def tracking_completion(*args, **kwargs):
+        seen_before_call.append(len(sink.finals()))
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(chorus_cycle, "structured_chat_completion", tracking_completion)
+    config = Config()
+    config.PARALLEL_STEPS = False
+    chorus = ChorusCycle(FakeDatabase(), config)
+    await chorus.run_chorus_cycle(new_state(), "hello", sink)
+
+    assert seen_before_call == [0, 1, 2, 3, 4, 5]
+
+@pytest.mark.asyncio
+async def test_independent_steps_run_concurrently_in_deterministic_order(fake_llm, monkeypatch):
+    in_flight = 0
+    peak = 0
+    original = chorus_cycle.structured_chat_completion
+
+    async def slow_completion(*args, **kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(chorus_cycle, "structured_chat_completion", slow_completion)
+    sink = RecordingSink()
+    await ChorusCycle(FakeDatabase(), Config()).run_chorus_cycle(new_state(), "hello", sink)
+
+    # EXPERIENCE and INTENTION both read only ACTION's output
+    assert peak == 2
+    assert [effect.payload["step"] for effect in sink.effects] == [
+        "action", "experience", "intention", "observation", "update", "yield"
+    ]
+
+def test_dependent_step_starts_a_new_group(monkeypatch):
+    chorus = ChorusCycle(FakeDatabase(), Config())
+
+    assert chorus.independent_steps(StepEnum.ACTION) == [StepEnum.ACTION]
+    assert chorus.independent_steps(StepEnum.EXPERIENCE) == [StepEnum.EXPERIENCE, StepEnum.INTENTION]
+    assert chorus.independent_steps(StepEnum.OBSERVATION) == [StepEnum.OBSERVATION]
+
+    for step in chorus.STEP_ORDER:
+        monkeypatch.setitem(chorus.STEP_DEPENDENCIES, step, set())
+    assert chorus.independent_steps(StepEnum.ACTION) == chorus.STEP_ORDER
+
+@pytest.mark.asyncio
+async def test_handle_client_message_collects_effects_without_sink(fake_llm):
+    chorus = ChorusCycle(FakeDatabase(), Config())
+    state = ConnectionState(client_id="", user=None, thread_id=None, status="connected", error_state=None)
+
+    _, effects = await chorus.handle_client_message(
+        state, ClientMessage(type="submit_prompt", data={"thread_id": "t", "content": "hello"})
+    )
+
+    assert [effect.payload["step"] for effect in effects][-1] == "yield"
+
+@pytest.mark.asyncio
+async def test_streaming_sends_deltas_before_each_final_frame(fake_llm):
+    sink = RecordingSink()
+    chorus = ChorusCycle(FakeDatabase(), Config(), stream_tokens=True)
+
+    await chorus.run_chorus_cycle(new_state(), "hello", sink)
+
+    action_frames = [effect.payload for effect in sink.effects if effect.payload["step"] == "action"]
+    assert all(not frame["final"] for frame in action_frames[:-1])
+    assert action_frames[-1]["final"] and action_frames[-1]["content"] == "action output"
+    assert "".join(frame["delta"] for frame in action_frames[:-1]) == json.dumps(STEP_RESPONSE)
+
+async def run_cycle(config: Config) -> RecordingSink:
+    sink = RecordingSink()
+    await ChorusCycle(FakeDatabase(), config).run_chorus_cycle(new_state(), "hello", sink)
+    return sink
+
+@pytest.mark.asyncio
+async def test_loop_stops_at_max_iterations(fake_llm):
+    fake_llm.response.update(loop=True, answer_confidence=0.5)
+    config = Config()
+    config.CYCLE_MAX_ITERATIONS = 2
+
+    sink = await run_cycle(config)
+
+    steps = [effect.payload["step"] for effect in sink.effects]
+    assert steps.count("update") == 2
+    budget = sink.effects[-1].payload["budget"]
+    assert budget["iterations"] == 2
+    assert budget["exit_reason"] == "max_iterations"
+    assert sink.effects[-1].payload["content"] == "yield output"
+
+@pytest.mark.asyncio
+async def test_confident_update_exits_early(fake_llm):
+    fake_llm.response.update(loop=True, answer_confidence=0.95)
+
+    sink = await run_cycle(Config())
+
+    assert [effect.payload["step"] for effect in sink.effects].count("update") == 1
+    assert sink.effects[-1].payload["budget"]["exit_reason"] == "confidence"
+
+@pytest.mark.asyncio
+async def test_confident_loop_decision_does_not_exit_early(fake_llm):
+    # A confident request to loop is not confidence in the answer
+    fake_llm.response.update(loop=True, confidence=0.95, answer_confidence=0.2)
+    config = Config()
+    config.CYCLE_MAX_ITERATIONS = 2
+
+    sink = await run_cycle(config)
+
+    assert [effect.payload["step"] for effect in sink.effects].count("update") == 2
+    assert sink.effects[-1].payload["budget"]["exit_reason"] == "max_iterations"
+
+@pytest.mark.asyncio
+async def test_token_budget_forces_yield_with_partial_results(fake_llm):
+    fake_llm.response.update(loop=True, answer_confidence=0.5)
+    fake_llm.tokens = 1000
+    config = Config()
+    config.CYCLE_MAX_TOKENS = 3000
+
+    sink = await run_cycle(config)
+
+    final = sink.effects[-1].payload
+    assert final["step"] == "yield"
+    assert final["budget"]["exit_reason"] == "max_tokens"
+    # No further completion is spent once the budget is gone
+    assert final["content"] == "experience output"
+    assert len(fake_llm.calls) == 3
+
+@pytest.mark.asyncio
+async def test_deadline_cuts_off_slow_steps(fake_llm):
+    fake_llm.delay = 1.0
+    config = Config()
+    config.CYCLE_TIME_LIMIT = 0.05
+
+    sink = await run_cycle(config)
+
+    assert [effect.payload["step"] for effect in sink.effects] == ["yield"]
+    assert sink.effects[-1].payload["budget"]["exit_reason"] == "deadline"
+
+@pytest.mark.asyncio
+async def test_thread_history_is_sent_as_incremental_pages():
+    config = Config()
+    config.THREAD_PAGE_SIZE = 2
+    chorus = ChorusCycle(FakeDatabase(thread=["a", "b", "c"]), config)
+    state = ConnectionState(client_id="", user=None, thread_id=None, status="connected", error_state=None)
+    sink = RecordingSink()
+
+    await chorus.handle_client_message(state, ClientMessage(type="get_thread_messages", data={"thread_id": "t"}), sink)
+
+    pages = [effect.payload for effect in sink.effects]
+    assert [[m["content"] for m in page["messages"]] for page in pages] == [["a", "b"], ["c"]]
+    assert [page["done"] for page in pages] == [False, True]
+
+@pytest.mark.asyncio
+async def test_thread_history_request_is_validated():
+    config = Config()
+    config.THREAD_PAGE_SIZE = 2
+    chorus = ChorusCycle(FakeDatabase(thread=["a", "b", "c"]), config)
+    state = ConnectionState(client_id="", user=None, thread_id=None, status="connected", error_state=None)
+
+    for data in [{}, {"thread_id": "t", "limit": "many"}, {"thread_id": "t", "cursor": "abc"}]:
+        sink = RecordingSink()
+        await chorus.handle_client_message(state, ClientMessage(type="get_thread_messages", data=data), sink)
+        assert [effect.type for effect in sink.effects] == ["error"]
+
+    sink = RecordingSink()
+    await chorus.handle_client_message(state, ClientMessage(type="get_thread_messages", data={"thread_id": "t", "limit": 0}), sink)
+    # A limit below 1 is clamped to single-message pages
+    assert [m["content"] for effect in sink.effects for m in effect.payload["messages"]] == ["a", "b", "c"]
+    assert all(len(effect.payload["messages"]) <= 1 for effect in sink.effects)
+
+@pytest.mark.asyncio
+async def test_prompt_and_step_outputs_are_queued_for_persistence(fake_llm):
+    database = FakeDatabase()
+
+    class QueueingWriter:
+        def __init__(self):
+            self.messages = []
+
+        def submit(self, message):
+            if message.seq is None:
+                message.seq = database.next_sequence()
+            self.messages.append(message)
+            return asyncio.get_running_loop().create_future()
+
+    writer = QueueingWriter()
+    chorus = ChorusCycle(database, Config(), writer=writer)
+    await chorus.run_chorus_cycle(new_state(), "hello", RecordingSink())
+
+    # The prompt is queued after the cycle but keeps its place at the head of the thread
+    assert (writer.messages[-1].role, writer.messages[-1].content) == ("user", "hello")
+    assert [(m.role, m.step) for m in sorted(writer.messages, key=lambda m: m.seq)] == [
+        ("user", None),
+        ("assistant", "action"),
+        ("assistant", "experience"),
+        ("assistant", "intention"),
+        ("assistant", "observation"),
+        ("assistant", "update"),
+        ("assistant", "yield"),
+    ]
+    assert all(m.thread_id == "t" for m in writer.messages)
+
+@pytest.mark.asyncio
+async def test_failed_step_outputs_are_stored_as_rejected(fake_llm, monkeypatch):
+    async def failing_completion(messages, config, response_format=None, on_delta=None, route=None):
+        return {"status": "error", "content": "An error occurred: rate limited"}
+
+    monkeypatch.setattr(chorus_cycle, "structured_chat_completion", failing_completion)
+    database = FakeDatabase()
+
+    writer = CollectingWriter()
+    sink = RecordingSink()
+    await ChorusCycle(database, Config(), writer=writer).run_chorus_cycle(new_state(), "hello", sink)
+
+    assert sink.effects[-1].payload["content"] == "Error generating final response"
+    statuses = {(m.role, m.step): m.status for m in writer.messages}
+    assert statuses[("user", None)] == "approved"
+    assert statuses[("assistant", "yield")] == "rejected"
+    assert statuses[("assistant", "action")] == "rejected"
+
+@pytest.mark.asyncio
+async def test_budget_yield_without_partial_result_is_rejected(fake_llm):
+    fake_llm.delay = 1.0
+    config = Config()
+    config.CYCLE_TIME_LIMIT = 0.05
+
+    writer = CollectingWriter()
+    await ChorusCycle(FakeDatabase(), config, writer=writer).run_chorus_cycle(new_state(), "hello", RecordingSink())
+
+    [answer] = [m for m in writer.messages if m.step == "yield"]
+    assert answer.content == chorus_cycle.NO_RESPONSE
+    assert answer.status == "rejected"
+
+@pytest.mark.asyncio
+async def test_prompt_is_not_retrieved_as_its_own_prior(fake_llm, monkeypatch):
+    database = await make_database()
+    await database.ensure_indexes()
+    config = database.config
+    writer = MessageWriter(database, config, flush_size=64, flush_interval=0.01)
+    writer.start()
+
+    async def fake_embedding(input_text, model):
+        return [1.0] + [0.0] * (Config.VECTOR_SIZE - 1)
+
+    monkeypatch.setattr(message_writer, "get_embedding", fake_embedding)
+    monkeypatch.setattr(chorus_cycle, "get_embedding", fake_embedding)
+    fake_llm.delay = 0.05
+    chorus = ChorusCycle(database, config, writer=writer)
+
+    state = await chorus.run_chorus_cycle(new_state(), "What is the capital of France?", RecordingSink())
+    await writer.close()
+
+    assert all(prior["content"] != "What is the capital of France?" for prior in state.priors or [])
+    assert (await database.get_messages("t"))[0][0]["content"] == "What is the capital of France?"
+    await database.close()
+
+@pytest.mark.asyncio
+async def test_lightweight_steps_are_routed_to_fast_model(fake_llm):
+    config = Config()
+    await ChorusCycle(FakeDatabase(), config).run_chorus_cycle(new_state(), "hello", RecordingSink())
+
+    models = {route.model for route in fake_llm.routes}
+    assert models == {config.CHAT_MODEL, config.FAST_MODEL}
+    assert ChorusCycle(FakeDatabase(), config).route(StepEnum.UPDATE).model == config.FAST_MODEL
+    assert ChorusCycle(FakeDatabase(), config).route(StepEnum.YIELD).fallback_model == config.FAST_MODEL
+
+@pytest.mark.asyncio
+async def test_later_steps_see_earlier_outputs_behind_a_shared_prefix(fake_llm):
+    config = Config()
+    config.PARALLEL_STEPS = False
+    await ChorusCycle(FakeDatabase(), config).run_chorus_cycle(new_state(), "hello", RecordingSink())
+
+    action, experience, intention, observation, update, yield_ = fake_llm.calls
+    assert len(action) == 3  # no context yet
+    assert "[action 1] action output" in intention[2]["content"]
+    assert "[update 1]" in yield_[2]["content"]
+    # Each step's context message extends the previous one, so prompts share a prefix
+    contexts = [call[2]["content"] for call in (intention, observation, update, yield_)]
+    assert all(later.startswith(earlier) for earlier, later in zip(contexts, contexts[1:]))
+    assert all(call[:2] == action[:2] for call in fake_llm.calls)
+
+@pytest.mark.asyncio
+async def test_long_step_output_is_summarized_for_context(fake_llm, monkeypatch):
+    fake_llm.response["proposed_response"] = "word " * 2000
+    config = Config()
+    config.PARALLEL_STEPS = False
+    summaries = []
+
+    async def completion(messages, config, response_format=None, on_delta=None, route=None):
+        if route is not None and route.model == config.SUMMARY_MODEL and route.max_tokens == config.CONTEXT_SUMMARY_TOKENS:
+            summaries.append(messages[-1]["content"])
+            return {"status": "success", "content": "short summary", "usage": {"total_tokens": 0}}
+        return await fake_llm.completion(messages, config, response_format, on_delta, route)
+
+    monkeypatch.setattr(chorus_cycle, "structured_chat_completion", completion)
+    await ChorusCycle(FakeDatabase(), config).run_chorus_cycle(new_state(), "hello", RecordingSink())
+
+    assert len(summaries) == 1 and summaries[0].startswith("word")
+    yield_context = fake_llm.calls[-1][2]["content"]
+    assert "[action 1] short summary" in yield_context
+    assert "word word" not in yield_context
+
+@pytest.mark.asyncio
+async def test_step_result_is_sent_before_its_summary_finishes(fake_llm, monkeypatch):
+    fake_llm.response["proposed_response"] = "word " * 2000
+    events = []
+
+    async def completion(messages, config, response_format=None, on_delta=None, route=None):
+        if route is not None and route.model == config.SUMMARY_MODEL and route.max_tokens == config.CONTEXT_SUMMARY_TOKENS:
+            await asyncio.sleep(0.05)
+            events.append("summary")
+            return {"status": "success", "content": "short summary", "usage": {"total_tokens": 0}}
+        return await fake_llm.completion(messages, config, response_format, on_delta, route)
+
+    class OrderedSink(RecordingSink):
+        async def __call__(self, effect):
+            events.append(effect.payload["step"])
+            await super().__call__(effect)
+
+    monkeypatch.setattr(chorus_cycle, "structured_chat_completion", completion)
+    await ChorusCycle(FakeDatabase(), Config()).run_chorus_cycle(new_state(), "hello", OrderedSink())
+
+    assert events[:2] == ["action", "summary"]
+
+@pytest.mark.asyncio
+async def test_repeated_prompt_is_served_from_completion_cache(fake_llm):
+    config = Config()
+    config.COMPLETION_CACHE_MAX_TEMPERATURE = 1.0  # cache every step, not just the near-deterministic ones
+    cache = CompletionCache()
+    chorus = ChorusCycle(FakeDatabase(), config, completion_cache=cache)
+
+    first = RecordingSink()
+    await chorus.run_chorus_cycle(new_state(), "hello", first)
+    calls = len(fake_llm.calls)
+    second = RecordingSink()
+    await chorus.run_chorus_cycle(new_state(), "hello", second)
+
+    assert len(fake_llm.calls) == calls
+    assert [e.payload["content"] for e in second.effects] == [e.payload["content"] for e in first.effects]
+    assert cache.stats()["hits"] == 6
+
+@pytest.mark.asyncio
+async def test_completion_cache_bypassed_above_temperature_threshold(fake_llm):
+    cache = CompletionCache()
+    chorus = ChorusCycle(FakeDatabase(), Config(), completion_cache=cache)
+
+    await chorus.run_chorus_cycle(new_state(), "hello", RecordingSink())
+    await chorus.run_chorus_cycle(new_state(), "hello", RecordingSink())
+
+    # By default only UPDATE (temperature 0.2) is cached
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["bypassed"] == 10
@@ -0,0 +1,59 @@
+import pytest
+from app.chunking import batched, iter_chunk_spans, iter_chunks
+
+class CharEncoder:
+    """One token per character, so chunk sizes are easy to reason about."""
+
+    def encode_ordinary(self, text):
+        return [ord(c) for c in text]
+
+    def decode_bytes(self, tokens):
+        return "".join(chr(t) for t in tokens).encode("utf-8")
+
+def test_chunks_respect_token_size_and_overlap():
+    chunks = list(iter_chunks("abcdefghij", chunk_tokens=4, overlap_tokens=1, encoder=CharEncoder()))
+
+    assert chunks == ["abcd", "defg", "ghij"]
+
+def test_spans_are_character_offsets():
+    text = "héllo wörld ñ" * 50
+
+    spans = list(iter_chunk_spans(text, chunk_tokens=7, overlap_tokens=2, encoder=CharEncoder()))
+
+    assert spans[0] == (0, 7)
+    assert spans[1] == (5, 12)
+    assert spans[-1][1] == len(text)
+
+def test_character_split_across_tokens_stays_whole():
+    class ByteEncoder(CharEncoder):
+        """One token per UTF-8 byte, like byte-level BPE on rare characters."""
+
+        def encode_ordinary(self, text):
+            return list(text.encode("utf-8"))
+
+        def decode_bytes(self, tokens):
+            return bytes(tokens)
+
+    chunks = list(iter_chunks("aéb" * 4, chunk_tokens=2, overlap_tokens=0, encoder=ByteEncoder()))
+
+    assert "".join(chunks) == "aéb" * 4
+    assert all(len(chunk.encode("utf-8")) <= 2 for chunk in chunks)
+
+def test_estimated_chunks_without_encoder_cover_the_text():
+    text = "x" * 100
+
+    chunks = list(iter_chunks(text, chunk_tokens=10, overlap_tokens=0))
+
+    assert [len(chunk) for chunk in chunks] == [40, 40, 20]
+    assert "".join(chunks) == text
+
+def test_chunking_is_lazy():
+    chunks = iter_chunks("a" * 10_000, chunk_tokens=4, overlap_tokens=0, encoder=CharEncoder())
+
+    assert next(chunks) == "aaaa"
+
+def test_invalid_sizes_and_batching():
+    with pytest.raises(ValueError):
+        list(iter_chunks("abc", chunk_tokens=0, overlap_tokens=0))
+    assert list(iter_chunks("", chunk_tokens=4, overlap_tokens=0)) == []
+    assert list(batched(iter("abcde"), 2)) == [["a", "b"], ["c", "d"], ["e"]]
@@ -0,0 +1,44 @@
+import pytest
+from app.completion_cache import CompletionCache, SQLiteCompletionStore
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+PARAMS = {"max_tokens": 100, "temperature": 0.2}
+
+def test_key_covers_model_step_messages_and_params():
+    key = CompletionCache.key("m", "action", MESSAGES, PARAMS)
+
+    assert key == CompletionCache.key("m", "action", [dict(MESSAGES[0])], dict(PARAMS))
+    assert key != CompletionCache.key("other", "action", MESSAGES, PARAMS)
+    assert key != CompletionCache.key("m", "update", MESSAGES, PARAMS)
+    assert key != CompletionCache.key("m", "action", MESSAGES + MESSAGES, PARAMS)
+    assert key != CompletionCache.key("m", "action", MESSAGES, {**PARAMS, "temperature": 0.3})
+
+@pytest.mark.asyncio
+async def test_memory_tier_evicts_lru_and_expires():
+    cache = CompletionCache(max_entries=2)
+    await cache.put("a", "A")
+    await cache.put("b", "B")
+    assert await cache.get("a") == "A"  # refresh "a"
+    await cache.put("c", "C")
+
+    assert await cache.get("b") is None
+    assert cache.stats()["hit_rate"] == 0.5
+
+    expired = CompletionCache(ttl=-1)
+    await expired.put("a", "A")
+    assert await expired.get("a") is None
+
+@pytest.mark.asyncio
+async def test_sqlite_tier_survives_restart_and_caps_size(tmp_path):
+    path = str(tmp_path / "completions.sqlite")
+    cache = CompletionCache(max_entries=1, disk=SQLiteCompletionStore(path, max_entries=2))
+    for key in ["a", "b", "c"]:
+        await cache.put(key, key.upper())
+    cache.close()
+
+    reopened = CompletionCache(max_entries=1, disk=SQLiteCompletionStore(path, max_entries=2))
+    assert await reopened.get("a") is None
+    assert await reopened.get("c") == "C"
+    assert reopened.stats()["disk_hits"] == 1
+    assert len(reopened.disk) == 2
+    reopened.close()
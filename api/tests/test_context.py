@@ -0,0 +1,77 @@
+from app import context
+from app.context import ContextBuilder, TokenCounter, count_tokens
+
+class WordCounter(TokenCounter):
+    """Counts one token per word so tests don't depend on downloading a BPE file."""
+
+    def __init__(self):
+        super().__init__("test-model")
+        self.encoded = 0
+
+    def count(self, text, key=None):
+        self.encoded += 1
+        return len(text.split())
+
+def test_required_text_is_reserved_and_priorities_fill_in_order():
+    builder = ContextBuilder(max_tokens=10, counter=WordCounter())
+    builder.reserve("system prompt here")  # 3 tokens
+    builder.add_section("history", [{"id": "h1", "content": "one two"}], priority=2)
+    builder.add_section("priors", [
+        {"id": "p1", "content": "a b c"},
+        {"id": "p2", "content": "d e f g h"},  # does not fit the section cap
+        {"id": "p3", "content": "i"},
+    ], priority=1, max_tokens=4)
+
+    packed = builder.build()
+
+    assert [item["id"] for item in packed["priors"]] == ["p1", "p3"]
+    assert [item["id"] for item in packed["history"]] == ["h1"]
+
+def test_lower_priority_sections_get_what_is_left():
+    builder = ContextBuilder(max_tokens=5, counter=WordCounter())
+    builder.add_section("priors", [{"content": "a b c d"}], priority=1)
+    builder.add_section("history", [{"content": "x y"}], priority=2)
+
+    assert builder.build()["history"] == []
+
+def test_token_counts_are_memoized_per_message_id(monkeypatch):
+    calls = []
+
+    def fake_count(text, model):
+        calls.append(text)
+        return len(text)
+
+    monkeypatch.setattr(context, "count_tokens", fake_count)
+    monkeypatch.setattr(context, "get_encoder", lambda model: object())
+    counter = TokenCounter("test-model", max_entries=2)
+
+    assert counter.count("hello", key="m1") == 5
+    assert counter.count("hello", key="m1") == 5
+    assert counter.count("hello") == 5
+    assert calls == ["hello", "hello"]
+
+def test_count_tokens_falls_back_without_encoder(monkeypatch):
+    monkeypatch.setattr(context, "get_encoder", lambda model: None)
+
+    assert count_tokens("x" * 40, "azure/gpt-4o") == 10
+
+def test_failed_tokenizer_load_is_retried(monkeypatch):
+    loads = []
+    encoding = object()
+
+    def encoding_for_model(name):
+        loads.append(name)
+        if len(loads) == 1:
+            raise ConnectionError("BPE download failed")
+        return encoding
+
+    monkeypatch.setattr(context.tiktoken, "encoding_for_model", encoding_for_model)
+    monkeypatch.setattr(context, "_encoders", {})
+    monkeypatch.setattr(context, "_encoder_failures", {})
+
+    assert context.get_encoder("azure/gpt-4o") is None
+    assert context.get_encoder("azure/gpt-4o") is None  # within the retry interval
+    monkeypatch.setattr(context, "ENCODER_RETRY_INTERVAL", 0.0)
+    assert context.get_encoder("azure/gpt-4o") is encoding
+    assert context.get_encoder("azure/gpt-4o") is encoding
+    assert loads == ["gpt-4o", "gpt-4o"]
@@ -0,0 +1,317 @@
+import asyncio
+import uuid
+import numpy as np
+import pytest
+from qdrant_client import AsyncQdrantClient, models
+from app.config import Config
+from app.database import DatabaseClient, RetrievalCache, collection_params, search_params
+from app.models import MessageRecord
+from app.vector_store import PayloadFilter
+
+VECTOR_SIZE = Config.VECTOR_SIZE
+
+async def make_database(create_collections: bool = True) -> DatabaseClient:
+    config = Config()
+    client = AsyncQdrantClient(location=":memory:")
+    if create_collections:
+        for collection in [config.MESSAGES_COLLECTION, config.CHAT_THREADS_COLLECTION, config.USERS_COLLECTION]:
+            await client.create_collection(
+                collection_name=collection,
+                vectors_config=models.VectorParams(size=VECTOR_SIZE, distance=models.Distance.COSINE)
+            )
+    return DatabaseClient(config, client)
+
+def make_message(thread_id: str, content: str, created_at: str = "2024-11-01T00:00:00+00:00", **fields) -> MessageRecord:
+    return MessageRecord(
+        id=str(uuid.uuid4()),
+        thread_id=thread_id,
+        role=fields.pop("role", "user"),
+        content=content,
+        created_at=created_at,
+        vector=[0.1] * VECTOR_SIZE,
+        **fields
+    )
+
+@pytest.mark.asyncio
+async def test_verify_collections_raises_when_missing():
+    database = await make_database(create_collections=False)
+    with pytest.raises(RuntimeError):
+        await database.verify_collections()
+    await database.close()
+
+@pytest.mark.asyncio
+async def test_clients_share_one_qdrant_client():
+    database = await make_database()
+    await database.verify_collections()
+    other = DatabaseClient(database.config, database.client)
+    assert other.client is database.client
+    await database.close()
+
+@pytest.mark.asyncio
+async def test_repeated_search_is_served_from_cache():
+    database = await make_database()
+    await database.client.upsert(
+        collection_name=database.config.MESSAGES_COLLECTION,
+        points=[models.PointStruct(id=1, vector=[1.0] * VECTOR_SIZE, payload={"content": "hello"})]
+    )
+    query = [1.0] * VECTOR_SIZE
+
+    first = await database.search_similar(database.config.MESSAGES_COLLECTION, query)
+    second = await database.search_similar(database.config.MESSAGES_COLLECTION, query)
+
+    assert first == second
+    assert first[0]["content"] == "hello"
+    assert database.retrieval_cache.hits == 1
+    await database.close()
+
+@pytest.mark.asyncio
+async def test_search_honors_limit_and_drops_near_duplicates():
+    database = await make_database()
+    base = [1.0] * VECTOR_SIZE
+    other = [1.0] * (VECTOR_SIZE // 2) + [0.0] * (VECTOR_SIZE // 2)
+    await database.client.upsert(
+        collection_name=database.config.MESSAGES_COLLECTION,
+        points=[models.PointStruct(id=i, vector=base, payload={"content": f"copy {i}", "thread_id": f"t{i}"}) for i in range(5)]
+        + [models.PointStruct(id=10, vector=other, payload={"content": "distinct", "thread_id": "t10"})]
+    )
+
+    results = await database.search_similar(database.config.MESSAGES_COLLECTION, base, limit=3)
+
+    assert len(results) == 2
+    assert [r["content"] for r in results][1] == "distinct"
+    assert "vector" not in results[0]
+    await database.close()
+
+@pytest.mark.asyncio
+async def test_search_filter_is_applied_in_the_index():
+    database = await make_database()
+    await database.ensure_indexes()
+    messages = [
+        make_message("thread-1", "question"),
+        make_message("thread-1", "draft", role="assistant", step="action"),
+        make_message("thread-1", "answer", role="assistant", step="yield"),
+        make_message("thread-2", "rejected answer", role="assistant", step="yield", status="rejected"),
+        make_message("thread-2", "old question", "2024-01-01T00:00:00+00:00")
+    ]
+    # Orthogonal vectors so none are pruned as near-duplicates
+    for i, message in enumerate(messages):
+        message.vector = [1.0 if j == i else 0.0 for j in range(VECTOR_SIZE)]
+    await database.save_messages(messages)
+    collection = database.config.MESSAGES_COLLECTION
+    query = [1.0] * 5 + [0.0] * (VECTOR_SIZE - 5)
+
+    async def contents(search_filter):
+        results = await database.search_similar(collection, query, limit=10, search_filter=search_filter)
+        return sorted(result["content"] for result in results)
+
+    assert await contents(PayloadFilter(exclude_steps=("action",), exclude_statuses=("rejected",))) == ["answer", "old question", "question"]
+    assert await contents(PayloadFilter(thread_id="thread-1", roles=("assistant",))) == ["answer", "draft"]
+    assert await contents(PayloadFilter(created_before="2024-06-01T00:00:00+00:00")) == ["old question"]
+    # Filtered and unfiltered searches are cached separately
+    assert len(await contents(None)) == 5
+    await database.close()
+
+@pytest.mark.asyncio
+async def test_hybrid_search_finds_keyword_match_with_distant_embedding():
+    database = await make_database()
+    messages = [make_message(f"thread-{i}", f"general discussion number {i}") for i in range(10)]
+    messages[7].content = "the failing job is ingest_worker_42"
+    # Similarity to the query falls with i, so message 7 ranks low on embeddings alone
+    for i, message in enumerate(messages):
+        vector = np.zeros(VECTOR_SIZE)
+        vector[0], vector[i + 1] = 1 - 0.08 * i, np.sqrt(1 - (1 - 0.08 * i) ** 2)
+        message.vector = vector.tolist()
+    await database.save_messages(messages)
+    collection = database.config.MESSAGES_COLLECTION
+    query = [1.0] + [0.0] * (VECTOR_SIZE - 1)
+
+    dense = await database.search_similar(collection, query, limit=2)
+    hybrid = await database.search_similar(collection, query, limit=2, query_text="why did ingest_worker_42 fail")
+
+    assert messages[7].id not in [result["id"] for result in dense]
+    assert hybrid[0]["id"] == messages[7].id
+    assert hybrid[0]["similarity"] == pytest.approx(0.44, abs=1e-3)
+
+    # A fresh client rebuilds the keyword index from the collection
+    other = DatabaseClient(database.config, database.client)
+    assert await other.warm_sparse_index() == 10
+    assert other.sparse_index.search("ingest_worker_42", 1)[0][0] == messages[7].id
+    await database.close()
+
+def test_retrieval_cache_invalidation_and_ttl():
+    cache = RetrievalCache(ttl=60)
+    key = cache.key("choir", [0.5] * 4, 10)
+    cache.put(key, [{"id": "1"}], cache.generation("choir"))
+    assert cache.get(key) == [{"id": "1"}]
+
+    cache.invalidate("choir")
+    assert cache.get(key) is None
+
+    # Results from a search that raced a write are not stored
+    stale_generation = cache.generation("choir")
+    cache.invalidate("choir")
+    cache.put(key, [{"id": "1"}], stale_generation)
+    assert cache.get(key) is None
+
+    # Writes a filter excludes leave its entries and in-flight searches alone
+    priors = PayloadFilter(exclude_steps=("action",))
+    filtered_key = cache.key("choir", [0.5] * 4, 10, priors)
+    generation = cache.generation("choir", priors)
+    cache.put(filtered_key, [{"id": "1"}], generation)
+    cache.invalidate("choir", [{"step": "action"}])
+    assert cache.get(filtered_key) == [{"id": "1"}]
+    assert cache.generation("choir", priors) == generation
+    cache.invalidate("choir", [{"step": "yield"}])
+    assert cache.get(filtered_key) is None
+
+    expired = RetrievalCache(ttl=-1)
+    expired.put(key, [{"id": "1"}], 0)
+    assert expired.get(key) is None
+
+@pytest.mark.asyncio
+async def test_concurrent_saves_append_to_thread_in_order():
+    database = await make_database()
+    await database.ensure_indexes()
+    messages = [make_message("thread-1", f"message {i}") for i in range(5)]
+
+    await asyncio.gather(*(database.save_message(message) for message in messages))
+    await database.save_message(make_message("thread-2", "elsewhere"))
+
+    ids = await database.get_thread_message_ids("thread-1", batch_size=2)
+    assert ids == [message.id for message in sorted(messages, key=lambda m: m.seq)]
+    assert len(set(message.seq for message in messages)) == 5
+    await database.close()
+
+@pytest.mark.asyncio
+async def test_migrate_thread_message_lists():
+    database = await make_database()
+    config = database.config
+    thread_id = str(uuid.uuid4())
+    legacy_ids = [str(uuid.uuid4()) for _ in range(3)]
+    await database.client.upsert(
+        collection_name=config.MESSAGES_COLLECTION,
+        points=[models.PointStruct(id=i, vector=[0.1] * VECTOR_SIZE, payload={"content": "old"}) for i in legacy_ids]
+    )
+    await database.client.upsert(
+        collection_name=config.CHAT_THREADS_COLLECTION,
+        points=[models.PointStruct(id=thread_id, vector=[0.1] * VECTOR_SIZE, payload={"messages": legacy_ids})]
+    )
+
+    assert await database.migrate_thread_message_lists() == 1
+    new_message = make_message(thread_id, "new")
+    await database.save_message(new_message)
+
+    assert await database.get_thread_message_ids(thread_id) == legacy_ids + [new_message.id]
+    thread = (await database.client.retrieve(config.CHAT_THREADS_COLLECTION, [thread_id]))[0]
+    assert "messages" not in thread.payload
+    assert await database.migrate_thread_message_lists() == 0
+    await database.close()
+
+@pytest.mark.asyncio
+async def test_get_messages_pages_through_thread_with_cursor():
+    database = await make_database()
+    await database.ensure_indexes()
+    for i in range(5):
+        await database.save_message(make_message("thread-1", f"message {i}", f"2024-11-0{i + 1}T00:00:00+00:00"))
+
+    pages = []
+    cursor = None
+    while True:
+        messages, cursor = await database.get_messages("thread-1", cursor=cursor, limit=2)
+        pages.append(messages)
+        if cursor is None:
+            break
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [m["content"] for page in pages for m in page] == [f"message {i}" for i in range(5)]
+    assert "vector" not in pages[0][0]
+
+    recent, _ = await database.get_messages("thread-1", since="2024-11-04T00:00:00+00:00")
+    assert [m["content"] for m in recent] == ["message 3", "message 4"]
+    await database.close()
+
+@pytest.mark.asyncio
+async def test_paging_does_not_skip_tied_sequences():
+    # Two processes can stamp the same seq; a page boundary inside the tie must not drop either message
+    database = await make_database()
+    await database.ensure_indexes()
+    seqs = [1, 2, 2, 2, 3]
+    await database.save_messages([make_message("thread-1", f"message {i}", seq=seq) for i, seq in enumerate(seqs)])
+
+    contents = []
+    cursor = None
+    while True:
+        messages, cursor = await database.get_messages("thread-1", cursor=cursor, limit=2)
+        contents.extend(m["content"] for m in messages)
+        if cursor is None:
+            break
+
+    assert sorted(contents) == [f"message {i}" for i in range(5)]
+    assert len(await database.get_thread_message_ids("thread-1", batch_size=2)) == 5
+    await database.close()
+
+def test_collection_params_follow_quantization_setting():
+    config = Config()
+    config.VECTOR_QUANTIZATION = "product"
+    config.VECTORS_ON_DISK = True
+    params = collection_params(config)
+    assert params["quantization_config"].product.compression == models.CompressionRatio.X16
+    assert params["vectors_config"].on_disk
+    assert search_params(config).quantization.rescore
+
+    config.VECTOR_QUANTIZATION = "none"
+    assert collection_params(config)["quantization_config"] is None
+    assert search_params(config) is None
+
+    config.VECTOR_QUANTIZATION = "binary"
+    with pytest.raises(ValueError):
+        collection_params(config)
+
+@pytest.mark.asyncio
+async def test_compact_collection_keeps_points_behind_alias():
+    database = await make_database()
+    database.config.VECTOR_QUANTIZATION = "scalar"
+    database.config.VECTORS_ON_DISK = True
+    collection = database.config.MESSAGES_COLLECTION
+    messages = [make_message("thread-1", f"message {i}") for i in range(5)]
+    await database.save_messages(messages)
+
+    assert await database.compact_collection(collection, batch_size=2) == 5
+    assert await database.compact_collection(collection) == 0
+
+    await database.verify_collections()
+    info = await database.client.get_collection(f"{collection}__compact")
+    assert info.config.params.vectors.on_disk
+    await database.ensure_indexes()
+    assert await database.get_thread_message_ids("thread-1") == [m.id for m in messages]
+    await database.close()
+
+@pytest.mark.asyncio
+async def test_compact_collection_resumes_after_original_was_dropped():
+    database = await make_database()
+    collection = database.config.USERS_COLLECTION
+    await database.client.create_collection(f"{collection}__compact", **collection_params(database.config))
+    await database.client.delete_collection(collection)
+
+    assert await database.compact_collection(collection) == 0
+    await database.verify_collections()
+    await database.close()
+
+@pytest.mark.asyncio
+async def test_compact_collection_keeps_original_vector_params():
+    database = await make_database()
+    collection = database.config.USERS_COLLECTION
+    await database.client.delete_collection(collection)
+    await database.client.create_collection(
+        collection_name=collection,
+        vectors_config=models.VectorParams(size=4, distance=models.Distance.DOT)
+    )
+    await database.client.upsert(
+        collection_name=collection,
+        points=[models.PointStruct(id=str(uuid.uuid4()), vector=[0.1, 0.2, 0.3, 0.4], payload={"name": "a"})]
+    )
+
+    assert await database.compact_collection(collection) == 1
+    vectors = (await database.client.get_collection(f"{collection}__compact")).config.params.vectors
+    assert (vectors.size, vectors.distance) == (4, models.Distance.DOT)
+    await database.close()
@@ -0,0 +1,114 @@
+import asyncio
+import numpy as np
+import pytest
+from app.embeddings import DiskVectorStore, EmbeddingBatcher, EmbeddingCache
+
+class FakeEmbedder:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, inputs):
+        self.calls.append(list(inputs))
+        await asyncio.sleep(0)
+        return np.asarray([[float(len(text)), 1.0] for text in inputs], dtype=np.float32)
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_upstream_call():
+    embedder = FakeEmbedder()
+    batcher = EmbeddingBatcher(embedder, max_batch_size=16, max_wait=0.01)
+
+    a, b, c = await asyncio.gather(
+        batcher.embed(["a"]),
+        batcher.embed(["bb", "ccc"]),
+        batcher.embed(["dddd"]),
+    )
+
+    assert embedder.calls == [["a", "bb", "ccc", "dddd"]]
+    assert a[:, 0].tolist() == [1.0]
+    assert b[:, 0].tolist() == [2.0, 3.0]
+    assert c[:, 0].tolist() == [4.0]
+
+@pytest.mark.asyncio
+async def test_oversized_request_is_split_by_batch_size():
+    embedder = FakeEmbedder()
+    batcher = EmbeddingBatcher(embedder, max_batch_size=2, max_wait=0.01)
+
+    vectors = await batcher.embed(["a", "bb", "ccc", "dddd", "eeeee"])
+
+    assert [len(call) for call in embedder.calls] == [2, 2, 1]
+    assert vectors[:, 0].tolist() == [1.0, 2.0, 3.0, 4.0, 5.0]
+
+@pytest.mark.asyncio
+async def test_upstream_error_propagates_to_every_caller():
+    async def failing(inputs):
+        raise RuntimeError("upstream down")
+
+    batcher = EmbeddingBatcher(failing, max_batch_size=16, max_wait=0.01)
+    results = await asyncio.gather(batcher.embed(["a"]), batcher.embed(["b"]), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+def test_cache_evicts_least_recently_used_and_counts_hits():
+    cache = EmbeddingCache(max_entries=2)
+    cache.put("m", "a", np.ones(4))
+    cache.put("m", "b", np.ones(4) * 2)
+    assert cache.get("m", "a") is not None  # refresh "a"
+    cache.put("m", "c", np.ones(4) * 3)
+
+    assert cache.get("m", "b") is None
+    assert cache.get("m", "a")[0] == 1.0
+    assert cache.get("other-model", "a") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 2
+
+def test_disk_tier_survives_reopen(tmp_path):
+    path = str(tmp_path / "embeddings")
+    cache = EmbeddingCache(max_entries=1, disk=DiskVectorStore(path, dim=4, capacity=8))
+    cache.put("m", "persisted", np.arange(4))
+    cache.close()
+
+    reopened = EmbeddingCache(max_entries=1, disk=DiskVectorStore(path, dim=4, capacity=8))
+    assert reopened.get("m", "persisted").tolist() == [0.0, 1.0, 2.0, 3.0]
+    assert reopened.stats()["disk_hits"] == 1
+    reopened.close()
+
+def test_disk_tier_reuses_rows_when_full(tmp_path):
+    store = DiskVectorStore(str(tmp_path / "ring"), dim=2, capacity=2)
+    for i, key in enumerate(["a", "b", "c"]):
+        store.put(key, np.full(2, i))
+    store.close()
+
+    reopened = DiskVectorStore(str(tmp_path / "ring"), dim=2, capacity=2)
+    assert reopened.get("a") is None
+    assert reopened.get("c").tolist() == [2.0, 2.0]
+    assert len(reopened) == 2
+    reopened.close()
+
+def test_disk_tier_misses_row_overwritten_before_it_was_logged(tmp_path):
+    path = str(tmp_path / "ring")
+    store = DiskVectorStore(path, dim=2, capacity=1)
+    store.put("old", np.full(2, 1))
+    # Crash after the row was rewritten for "new" but before "new" reached the log
+    store._index.write = lambda line: None
+    store.put("new", np.full(2, 2))
+    store.close()
+
+    reopened = DiskVectorStore(path, dim=2, capacity=1)
+    assert reopened.get("old") is None
+    reopened.close()
+
+def test_disk_tier_ignores_truncated_index_line(tmp_path):
+    path = str(tmp_path / "ring")
+    store = DiskVectorStore(path, dim=2, capacity=200)
+    for i in range(123):
+        store.put(f"k{i}", np.full(2, i))
+    store.close()
+    with open(f"{path}.index", "a", encoding="utf-8") as f:
+        f.write("late 12")  # "late 123" cut short; row 12 belongs to k12
+
+    reopened = DiskVectorStore(path, dim=2, capacity=200)
+    assert reopened.get("late") is None
+    assert reopened.get("k12").tolist() == [12.0, 12.0]
+    reopened.put("later", np.full(2, 7))
+    reopened.close()
+    assert DiskVectorStore(path, dim=2, capacity=200).get("later").tolist() == [7.0, 7.0]
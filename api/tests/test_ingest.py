@@ -0,0 +1,105 @@
+import json
+import litellm
+import numpy as np
+import pytest
+from app.ingest import BulkIngester, export_messages
+from tests.test_database import VECTOR_SIZE, make_database
+
+class FakeEmbedder:
+    def __init__(self, fail_on_call=None, rate_limited_calls=0):
+        self.calls = []
+        self.fail_on_call = fail_on_call
+        self.rate_limited_calls = rate_limited_calls
+
+    async def __call__(self, inputs):
+        self.calls.append(list(inputs))
+        if self.fail_on_call == len(self.calls):
+            raise RuntimeError("embedding service unavailable")
+        if len(self.calls) <= self.rate_limited_calls:
+            raise litellm.RateLimitError("slow down", llm_provider="azure", model="text-embedding-ada-002")
+        return np.ones((len(inputs), VECTOR_SIZE), dtype=np.float32)
+
+def write_jsonl(path, count):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            f.write(json.dumps({"thread_id": f"thread-{i % 3}", "content": f"message {i}"}) + "\n")
+        f.write("not json\n")
+        f.write("\n")
+        f.write(json.dumps({"content": "with vector", "vector": [0.5] * VECTOR_SIZE}) + "\n")
+
+async def count_points(database):
+    return (await database.client.count(database.config.MESSAGES_COLLECTION, exact=True)).count
+
+@pytest.mark.asyncio
+async def test_ingest_embeds_in_batches_and_checkpoints(tmp_path):
+    database = await make_database()
+    path = str(tmp_path / "messages.jsonl")
+    write_jsonl(path, 10)
+    embedder = FakeEmbedder()
+    ingester = BulkIngester(database, embedder, database.config, batch_size=4, embed_batch_size=3, concurrency=2)
+
+    stats = await ingester.ingest(path)
+
+    assert (stats.messages, stats.skipped, stats.line) == (11, 1, 13)
+    assert stats.chunks == 10  # the line with a vector is not embedded
+    assert max(len(call) for call in embedder.calls) <= 3
+    assert await count_points(database) == 11
+    with open(f"{path}.checkpoint", encoding="utf-8") as f:
+        assert json.load(f)["line"] == 13
+
+    # Everything is checkpointed, so a re-run has nothing left to do
+    assert (await ingester.ingest(path)).messages == 0
+    await database.close()
+
+@pytest.mark.asyncio
+async def test_ingest_resumes_after_failure_without_duplicates(tmp_path):
+    database = await make_database()
+    path = str(tmp_path / "messages.jsonl")
+    write_jsonl(path, 10)
+
+    failing = BulkIngester(database, FakeEmbedder(fail_on_call=3), database.config, batch_size=2, embed_batch_size=2, concurrency=1)
+    with pytest.raises(RuntimeError):
+        await failing.ingest(path)
+    with open(f"{path}.checkpoint", encoding="utf-8") as f:
+        assert json.load(f)["line"] == 4
+
+    stats = await BulkIngester(database, FakeEmbedder(), database.config, batch_size=2, concurrency=1).ingest(path)
+
+    assert stats.messages == 7
+    assert await count_points(database) == 11
+    await database.close()
+
+@pytest.mark.asyncio
+async def test_rate_limited_embeddings_are_retried(tmp_path):
+    database = await make_database()
+    database.config.LLM_RETRY_BACKOFF = 0.001
+    path = str(tmp_path / "messages.jsonl")
+    write_jsonl(path, 4)
+    embedder = FakeEmbedder(rate_limited_calls=3)
+
+    stats = await BulkIngester(database, embedder, database.config, batch_size=2, concurrency=2).ingest(path)
+
+    assert stats.messages == 5
+    assert len(embedder.calls) == 3 + 2  # three refused requests, then one per batch with text
+    await database.close()
+
+@pytest.mark.asyncio
+async def test_export_round_trips_through_ingest(tmp_path):
+    source = await make_database()
+    path = str(tmp_path / "messages.jsonl")
+    write_jsonl(path, 5)
+    await BulkIngester(source, FakeEmbedder(), source.config).ingest(path)
+
+    exported = str(tmp_path / "export.jsonl")
+    assert await export_messages(source, exported) == 6
+
+    target = await make_database()
+    stats = await BulkIngester(target, FakeEmbedder(), target.config).ingest(exported)
+    assert stats.messages == 6
+    with open(exported, encoding="utf-8") as f:
+        first_id = json.loads(f.readline())["id"]
+    original = await source.client.retrieve(source.config.MESSAGES_COLLECTION, [first_id])
+    copied = await target.client.retrieve(target.config.MESSAGES_COLLECTION, [original[0].id])
+    assert copied[0].payload["content"] == original[0].payload["content"]
+    await source.close()
+    await target.close()
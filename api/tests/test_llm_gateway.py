@@ -0,0 +1,146 @@
+import asyncio
+import litellm
+import pytest
+from app import llm_gateway, utils
+from app.config import Config
+from app.llm_gateway import FakeLLMBackend, LLMGateway, is_retryable
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+def rate_limited():
+    return litellm.RateLimitError("slow down", llm_provider="azure", model="m")
+
+def test_retryable_errors():
+    assert is_retryable(rate_limited())
+    assert is_retryable(litellm.InternalServerError("boom", llm_provider="azure", model="m"))
+    assert is_retryable(asyncio.TimeoutError())
+    assert not is_retryable(litellm.BadRequestError("bad", llm_provider="azure", model="m"))
+    assert not is_retryable(ValueError("bug"))
+
+@pytest.mark.asyncio
+async def test_retries_rate_limits_then_succeeds():
+    backend = FakeLLMBackend(content="done", failures=[rate_limited(), rate_limited()])
+    gateway = LLMGateway(backend, max_retries=3, backoff=0.001)
+
+    response = await gateway.complete(model="m", messages=MESSAGES)
+
+    assert response.choices[0].message.content == "done"
+    assert backend.calls == 3
+    assert gateway.retries == 2
+
+@pytest.mark.asyncio
+async def test_non_retryable_error_is_raised_immediately():
+    backend = FakeLLMBackend(failures=[litellm.BadRequestError("bad", llm_provider="azure", model="m")])
+    gateway = LLMGateway(backend, backoff=0.001)
+
+    with pytest.raises(litellm.BadRequestError):
+        await gateway.complete(model="m", messages=MESSAGES)
+    assert backend.calls == 1
+
+@pytest.mark.asyncio
+async def test_slow_attempt_times_out_and_is_retried():
+    latencies = iter([1.0, 0.0])
+    backend = FakeLLMBackend(content="fast", latency=lambda: next(latencies))
+    gateway = LLMGateway(backend, timeout=0.05, backoff=0.001)
+
+    response = await gateway.complete(model="m", messages=MESSAGES)
+
+    assert response.choices[0].message.content == "fast"
+    assert backend.calls == 2
+
+@pytest.mark.asyncio
+async def test_slow_call_is_hedged_after_latency_percentile():
+    latencies = iter([0.01] * 5 + [1.0, 0.01])
+    backend = FakeLLMBackend(latency=lambda: next(latencies))
+    gateway = LLMGateway(backend, hedge_percentile=50, hedge_min_samples=5)
+    for _ in range(5):
+        await gateway.complete(model="m", messages=MESSAGES)
+
+    started = asyncio.get_running_loop().time()
+    await gateway.complete(model="m", messages=MESSAGES)
+
+    assert asyncio.get_running_loop().time() - started < 0.5
+    assert gateway.hedges == 1
+    assert backend.calls == 7
+
+@pytest.mark.asyncio
+async def test_hedge_latencies_are_kept_per_model():
+    backend = FakeLLMBackend(latency=0.05)
+    gateway = LLMGateway(backend, hedge_percentile=50, hedge_min_samples=2)
+    for _ in range(2):
+        await gateway.complete(model="fast", messages=MESSAGES, max_tokens=500)
+
+    # Slower than the fast model's calls, but this model has no history of its own
+    await gateway.complete(model="large", messages=MESSAGES, max_tokens=4000)
+
+    assert gateway.hedge_delay(gateway.latency_key({"model": "fast", "max_tokens": 500})) is not None
+    assert gateway.hedges == 0
+
+@pytest.mark.asyncio
+async def test_slow_stream_is_hedged_on_time_to_first_chunk():
+    latencies = iter([0.01] * 3 + [1.0, 0.01])
+    backend = FakeLLMBackend(content="streamed", latency=lambda: next(latencies))
+    gateway = LLMGateway(backend, hedge_percentile=50, hedge_min_samples=3)
+    for _ in range(3):
+        [chunk async for chunk in gateway.stream(model="m", messages=MESSAGES)]
+
+    started = asyncio.get_running_loop().time()
+    chunks = [chunk async for chunk in gateway.stream(model="m", messages=MESSAGES)]
+
+    assert asyncio.get_running_loop().time() - started < 0.5
+    assert "".join(chunk.choices[0].delta.content or "" for chunk in chunks if chunk.choices) == "streamed"
+    assert gateway.hedges == 1
+
+@pytest.mark.asyncio
+async def test_slow_stream_consumer_does_not_hold_a_slot():
+    gateway = LLMGateway(FakeLLMBackend(content="x" * 64), max_concurrency=1, timeout=1.0, hedge_percentile=0)
+    stream = gateway.stream(model="m", messages=MESSAGES)
+    await stream.__anext__()
+
+    # The consumer is paused mid-stream; other calls still get through
+    response = await asyncio.wait_for(gateway.complete(model="m", messages=MESSAGES), 0.5)
+
+    assert response.choices[0].message.content
+    await stream.aclose()
+
+@pytest.mark.asyncio
+async def test_concurrency_is_capped():
+    in_flight = 0
+    peak = 0
+
+    async def backend(**kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return "ok"
+
+    gateway = LLMGateway(backend, max_concurrency=2, hedge_percentile=0)
+    await asyncio.gather(*(gateway.complete(model="m", messages=MESSAGES) for _ in range(6)))
+
+    assert peak == 2
+
+@pytest.mark.asyncio
+async def test_stream_retries_before_first_chunk(monkeypatch):
+    backend = FakeLLMBackend(content="x" * 40, failures=[rate_limited()])
+    monkeypatch.setattr(llm_gateway, "_gateway", LLMGateway(backend, backoff=0.001))
+    deltas = []
+
+    async def on_delta(delta):
+        deltas.append(delta)
+
+    result = await utils.structured_chat_completion(MESSAGES, Config(), on_delta=on_delta)
+
+    assert result["content"] == "x" * 40
+    assert "".join(deltas) == "x" * 40
+    assert result["usage"]["completion_tokens"] == 10
+    assert backend.calls == 2
+
+@pytest.mark.asyncio
+async def test_chat_completion_raises_instead_of_returning_error_text(monkeypatch):
+    backend = FakeLLMBackend(failures=[litellm.BadRequestError("bad", llm_provider="azure", model="m")])
+    monkeypatch.setattr(llm_gateway, "_gateway", LLMGateway(backend))
+
+    with pytest.raises(litellm.BadRequestError):
+        await utils.chat_completion(MESSAGES, "m", max_tokens=10, temperature=0)
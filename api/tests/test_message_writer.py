@@ -0,0 +1,122 @@
+import asyncio
+import uuid
+import pytest
+from app import message_writer
+from app.config import Config
+from app.message_writer import MessageWriter
+from app.models import MessageRecord
+
+class RecordingDatabase:
+    def __init__(self):
+        self.batches = []
+        self._seq = 0
+
+    def next_sequence(self):
+        self._seq += 1
+        return self._seq
+
+    async def save_messages(self, messages):
+        self.batches.append([message.id for message in messages])
+
+def make_message(content: str) -> MessageRecord:
+    return MessageRecord(
+        id=str(uuid.uuid4()),
+        thread_id="thread-1",
+        role="assistant",
+        content=content,
+        created_at="2024-11-01T00:00:00+00:00"
+    )
+
+def fast_retry_config() -> Config:
+    config = Config()
+    config.WRITE_BEHIND_RETRY_BACKOFF = 0.001
+    return config
+
+@pytest.fixture(autouse=True)
+def fake_embedding(monkeypatch):
+    async def embed(text, model):
+        return [0.1] * Config.VECTOR_SIZE
+    monkeypatch.setattr(message_writer, "get_embedding", embed)
+
+@pytest.mark.asyncio
+async def test_messages_are_coalesced_into_batched_writes():
+    database = RecordingDatabase()
+    writer = MessageWriter(database, Config(), flush_size=3, flush_interval=10)
+    writer.start()
+
+    messages = [make_message(f"m{i}") for i in range(7)]
+    futures = [writer.submit(message) for message in messages]
+    await asyncio.gather(*futures[:6])
+
+    assert [len(batch) for batch in database.batches] == [3, 3]
+    assert not futures[6].done()
+
+    await writer.close()
+    assert await futures[6] == messages[6].id
+    assert [len(batch) for batch in database.batches] == [3, 3, 1]
+    assert [message.seq for message in messages] == list(range(1, 8))
+    assert all(message.vector is not None for message in messages)
+
+@pytest.mark.asyncio
+async def test_flush_interval_writes_partial_batches():
+    database = RecordingDatabase()
+    writer = MessageWriter(database, Config(), flush_size=100, flush_interval=0.01)
+    writer.start()
+
+    message = make_message("lonely")
+    assert await asyncio.wait_for(writer.submit(message), timeout=1) == message.id
+    await writer.close()
+
+@pytest.mark.asyncio
+async def test_failed_write_fails_every_future_in_the_batch():
+    class FailingDatabase(RecordingDatabase):
+        async def save_messages(self, messages):
+            raise ConnectionError("qdrant unavailable")
+
+    writer = MessageWriter(FailingDatabase(), fast_retry_config(), flush_size=2, flush_interval=10)
+    writer.start()
+    futures = [writer.submit(make_message("a")), writer.submit(make_message("b"))]
+
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    assert all(isinstance(result, ConnectionError) for result in results)
+    await writer.close()
+
+@pytest.mark.asyncio
+async def test_transient_write_failure_is_retried():
+    class FlakyDatabase(RecordingDatabase):
+        def __init__(self):
+            super().__init__()
+            self.failures = 2
+
+        async def save_messages(self, messages):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("qdrant unavailable")
+            await super().save_messages(messages)
+
+    database = FlakyDatabase()
+    writer = MessageWriter(database, fast_retry_config(), flush_size=2, flush_interval=10)
+    writer.start()
+    messages = [make_message("a"), make_message("b")]
+
+    assert await asyncio.gather(*(writer.submit(message) for message in messages)) == [m.id for m in messages]
+    assert database.batches == [[m.id for m in messages]]
+    await writer.close()
+
+@pytest.mark.asyncio
+async def test_zero_vector_embeddings_are_not_stored(monkeypatch):
+    async def embed(text, model):
+        # get_embedding answers a failure with zeros
+        return [0.0] * Config.VECTOR_SIZE if text == "unlucky" else [0.1] * Config.VECTOR_SIZE
+
+    monkeypatch.setattr(message_writer, "get_embedding", embed)
+    database = RecordingDatabase()
+    writer = MessageWriter(database, fast_retry_config(), flush_size=2, flush_interval=10)
+    writer.start()
+    stored, unlucky = make_message("fine"), make_message("unlucky")
+
+    results = await asyncio.gather(writer.submit(stored), writer.submit(unlucky), return_exceptions=True)
+    assert results[0] == stored.id
+    assert isinstance(results[1], message_writer.EmbeddingUnavailable)
+    assert database.batches == [[stored.id]]
+    await writer.close()
@@ -0,0 +1,51 @@
+import numpy as np
+from app.retrieval import group_by_thread, mmr_select, reciprocal_rank_fusion
+
+def test_mmr_prefers_diverse_results_over_near_duplicates():
+    query = [1.0, 0.0, 0.0]
+    vectors = np.array([
+        [1.0, 0.0, 0.0],
+        [0.999, 0.01, 0.0],  # near-duplicate of the best match
+        [0.7, 0.7, 0.0],
+        [0.0, 0.0, 1.0],
+    ])
+
+    selected = mmr_select(query, vectors, k=3, diversity=0.7, duplicate_threshold=0.95)
+
+    assert selected[0] == 0
+    assert 1 not in selected
+    assert selected[1] == 2
+
+def test_mmr_caps_results_per_group():
+    query = [1.0, 0.0]
+    vectors = np.array([[1.0, 0.0], [0.9, 0.3], [0.8, 0.5], [0.5, 0.8]])
+
+    selected = mmr_select(query, vectors, k=4, duplicate_threshold=1.1, groups=["a", "a", "a", "b"], per_group=2)
+
+    assert sorted(selected) == [0, 1, 3]
+
+def test_mmr_handles_empty_and_zero_vectors():
+    assert mmr_select([1.0, 0.0], np.empty((0, 2)), k=3) == []
+    assert mmr_select([0.0, 0.0], np.zeros((2, 2)), k=1) == [0]
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]], k=60)
+
+    ids = [item for item, _ in fused]
+    assert ids[0] == "c"  # in both lists
+    assert set(ids) == {"a", "b", "c", "d"}
+    assert dict(fused)["a"] == 1 / 61
+
+def test_mmr_uses_given_relevance():
+    vectors = np.array([[1.0, 0.0], [0.0, 1.0]])
+    assert mmr_select([1.0, 0.0], vectors, k=1, relevance=[0.1, 1.0]) == [1]
+
+def test_group_by_thread_orders_threads_by_best_match():
+    priors = [
+        {"id": "1", "thread_id": "a", "similarity": 0.5},
+        {"id": "2", "thread_id": "b", "similarity": 0.9},
+        {"id": "3", "thread_id": "a", "similarity": 0.8},
+        {"id": "4", "thread_id": "b", "similarity": 0.6},
+    ]
+
+    assert [prior["id"] for prior in group_by_thread(priors)] == ["2", "4", "3", "1"]
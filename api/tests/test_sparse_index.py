@@ -0,0 +1,31 @@
+from app.sparse_index import BM25Index, tokenize
+from app.vector_store import PayloadFilter
+
+def test_tokenize_keeps_identifiers_whole():
+    assert tokenize("Call get_user_id() on Qdrant") == ["call", "get_user_id", "on", "qdrant"]
+
+def test_rare_terms_outrank_common_ones():
+    index = BM25Index()
+    index.add("1", "the weather is nice today")
+    index.add("2", "the deploy failed with error E1234")
+    index.add("3", "the the the the")
+
+    results = index.search("the E1234 error", limit=3)
+
+    assert results[0][0] == "2"
+    assert [doc_id for doc_id, _ in results] == ["2", "3", "1"]
+
+def test_add_replaces_document_and_filters_apply():
+    index = BM25Index()
+    index.add("1", "alpha beta", {"thread_id": "t1", "step": "action"})
+    index.add("2", "alpha", {"thread_id": "t2", "step": "yield"})
+    index.add("1", "gamma", {"thread_id": "t1", "step": "yield"})
+
+    assert [doc_id for doc_id, _ in index.search("alpha", 5)] == ["2"]
+    assert index.search("beta", 5) == []
+    assert [doc_id for doc_id, _ in index.search("gamma alpha", 5, PayloadFilter(thread_id="t1"))] == ["1"]
+    assert len(index) == 2
+
+    index.remove("1")
+    assert index.search("gamma", 5) == []
+    assert len(index) == 1
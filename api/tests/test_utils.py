@@ -0,0 +1,67 @@
+import litellm
+import pytest
+from app import llm_gateway
+from app.config import Config
+from app.llm_gateway import FakeLLMBackend, LLMGateway
+from app.models import ActionResponse, ExperienceResponse, ModelRoute, ObservationResponse, UpdateResponse
+from app.utils import parse_structured_response, structured_chat_completion
+
+def test_parse_structured_response_validates_into_model():
+    response = parse_structured_response(
+        '{"loop": "true", "reasoning": "needs work", "confidence": 0.4}', UpdateResponse
+    )
+
+    assert response == UpdateResponse(loop=True, reasoning="needs work", confidence=0.4)
+
+def test_parse_structured_response_rejects_invalid_content():
+    assert parse_structured_response("not json", ActionResponse) is None
+    assert parse_structured_response('{"confidence": 0.9}', ActionResponse) is None
+    assert parse_structured_response(None, ActionResponse) is None
+
+def test_parse_structured_response_ignores_shape_of_unread_fields():
+    experience = parse_structured_response(
+        '{"synthesis": "good answer", "key_insights": [{"insight": "x"}]}', ExperienceResponse
+    )
+    observation = parse_structured_response(
+        '{"context_analysis": "fine", "patterns": "one pattern"}', ObservationResponse
+    )
+
+    assert experience.synthesis == "good answer"
+    assert observation.context_analysis == "fine"
+
+@pytest.mark.asyncio
+async def test_routed_completion_falls_back_on_error(monkeypatch):
+    calls = []
+    fake = FakeLLMBackend(content='{"proposed_response": "from fallback"}')
+
+    async def backend(model, messages, **kwargs):
+        calls.append((model, kwargs["max_tokens"], kwargs["temperature"]))
+        if model == "strong":
+            raise litellm.BadRequestError("unavailable", llm_provider="azure", model=model)
+        return await fake(model, messages, **kwargs)
+
+    monkeypatch.setattr(llm_gateway, "_gateway", LLMGateway(backend))
+    route = ModelRoute(model="strong", max_tokens=100, temperature=0.1, fallback_model="fast")
+
+    result = await structured_chat_completion([{"role": "user", "content": "hi"}], Config(), route=route)
+
+    assert result["status"] == "success"
+    assert result["model"] == "fast"
+    assert calls == [("strong", 100, 0.1), ("fast", 100, 0.1)]
+
+@pytest.mark.asyncio
+async def test_unrouted_completion_uses_global_settings(monkeypatch):
+    calls = []
+    fake = FakeLLMBackend()
+
+    async def backend(model, messages, **kwargs):
+        calls.append((model, kwargs["max_tokens"]))
+        return await fake(model, messages, **kwargs)
+
+    monkeypatch.setattr(llm_gateway, "_gateway", LLMGateway(backend))
+    config = Config()
+
+    result = await structured_chat_completion([{"role": "user", "content": "hi"}], config)
+
+    assert result["status"] == "success"
+    assert calls == [(config.CHAT_MODEL, config.MAX_TOKENS)]
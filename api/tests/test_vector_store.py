@@ -0,0 +1,171 @@
+import numpy as np
+import pytest
+from qdrant_client import AsyncQdrantClient, models
+from app.config import Config
+from app.database import DatabaseClient
+from app.vector_store import CachedVectorStore, LocalVectorIndex, LocalVectorStore, PayloadFilter, QdrantVectorStore, VectorStore
+from tests.test_database import VECTOR_SIZE, make_database, make_message
+
+def random_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+
+def test_exact_top_k_matches_brute_force():
+    vectors = random_vectors(500, 32)
+    index = LocalVectorIndex(32, capacity=16)  # grows past its initial capacity
+    index.upsert([str(i) for i in range(500)], vectors, [{"n": i} for i in range(500)])
+    query = random_vectors(1, 32, seed=1)[0]
+
+    hits = index.search(query, limit=5, with_vectors=True)
+
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected = np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:5]
+    assert [hit.id for hit in hits] == [str(i) for i in expected]
+    assert hits[0].payload == {"n": int(expected[0])}
+    assert np.allclose(hits[0].vector, normalized[expected[0]], atol=1e-6)
+
+def test_quantized_scores_track_float_scores():
+    vectors = random_vectors(300, 64)
+    exact = LocalVectorIndex(64)
+    quantized = LocalVectorIndex(64, quantize=True)
+    for index in (exact, quantized):
+        index.upsert([str(i) for i in range(300)], vectors, [{}] * 300)
+    query = random_vectors(1, 64, seed=2)[0]
+
+    assert np.abs(exact.scores(query) - quantized.scores(query)).max() < 0.01
+    assert exact.search(query, 1)[0].id == quantized.search(query, 1)[0].id
+
+def test_local_search_applies_payload_filter():
+    index = LocalVectorIndex(2)
+    index.upsert(
+        ["a", "b", "c"],
+        [[1, 0], [0.9, 0.1], [0, 1]],
+        [
+            {"thread_id": "t1", "step": "action", "created_at": "2024-11-01T00:00:00+00:00"},
+            {"thread_id": "t1", "step": "yield", "created_at": "2024-11-02T00:00:00+00:00"},
+            {"thread_id": "t2", "step": "yield", "created_at": "2024-11-03T00:00:00+00:00"}
+        ]
+    )
+
+    assert [hit.id for hit in index.search([1, 0], 3, search_filter=PayloadFilter(exclude_steps=("action",)))] == ["b", "c"]
+    assert [hit.id for hit in index.search([1, 0], 3, search_filter=PayloadFilter(thread_id="t2"))] == ["c"]
+    after = PayloadFilter(created_after="2024-11-02T00:00:00+00:00", created_before="2024-11-02T12:00:00+00:00")
+    assert [hit.id for hit in index.search([1, 0], 3, search_filter=after)] == ["b"]
+    assert index.search([1, 0], 3, search_filter=PayloadFilter(min_token_value=1)) == []
+
+def test_filter_columns_agree_with_payload_matching(tmp_path):
+    rng = np.random.default_rng(3)
+    payloads = [
+        {
+            "thread_id": f"t{rng.integers(3)}",
+            "role": str(rng.choice(["user", "assistant"])),
+            "step": str(rng.choice(["action", "yield", "update"])),
+            "status": str(rng.choice(["approved", "rejected"])),
+            "created_at": f"2024-11-{rng.integers(1, 29):02d}T00:00:00+00:00",
+            **({"token_value": int(rng.integers(5))} if i % 3 else {})
+        }
+        for i in range(200)
+    ]
+    path = str(tmp_path / "choir")
+    index = LocalVectorIndex(4, path, capacity=8)  # columns grow with the matrix
+    index.upsert([str(i) for i in range(200)], random_vectors(200, 4), payloads)
+    index.upsert(["0"], random_vectors(1, 4), [{"role": "user"}])  # overwritten rows drop old values
+    payloads[0] = {"role": "user"}
+    index.close()
+    index = LocalVectorIndex(4, path)  # and are rebuilt from the log
+
+    filters = [
+        PayloadFilter(thread_id="t1", exclude_steps=("update",)),
+        PayloadFilter(exclude_thread_id="t0", roles=("user",), statuses=("approved",)),
+        PayloadFilter(exclude_statuses=("rejected",), min_token_value=2),
+        PayloadFilter(thread_id="missing"),
+        PayloadFilter(created_after="2024-11-10T00:00:00+00:00", created_before="2024-11-20T00:00:00+00:00")
+    ]
+    for search_filter in filters:
+        expected = {str(i) for i, payload in enumerate(payloads) if search_filter.matches(payload)}
+        assert {hit.id for hit in index.search(random_vectors(1, 4)[0], 200, search_filter=search_filter)} == expected
+    index.close()
+
+def test_upsert_overwrites_existing_id():
+    index = LocalVectorIndex(2)
+    index.upsert(["a", "b"], [[1, 0], [0, 1]], [{"v": 1}, {"v": 1}])
+    index.upsert(["a", "a"], [[0, 1], [0, 1]], [{"v": 2}, {"v": 3}])
+
+    assert len(index) == 2
+    assert index.search([0, 1], 2)[0].score == pytest.approx(1.0)
+    assert {hit.id: hit.payload["v"] for hit in index.search([0, 1], 2)} == {"a": 3, "b": 1}
+
+@pytest.mark.parametrize("quantize", [False, True])
+def test_memory_mapped_index_survives_reopen(tmp_path, quantize):
+    path = str(tmp_path / "choir")
+    vectors = random_vectors(40, 8)
+    index = LocalVectorIndex(8, path, capacity=4, quantize=quantize)
+    index.upsert([str(i) for i in range(40)], vectors, [{"n": i} for i in range(40)])
+    index.close()
+
+    reopened = LocalVectorIndex(8, path, quantize=quantize)
+    hit = reopened.search(vectors[7], 1)[0]
+    assert len(reopened) == 40
+    assert (hit.id, hit.payload) == ("7", {"n": 7})
+    reopened.close()
+
+def test_reopen_skips_partially_written_log_entry(tmp_path):
+    path = str(tmp_path / "choir")
+    vectors = random_vectors(3, 8)
+    index = LocalVectorIndex(8, path)
+    index.upsert(["a", "b"], vectors[:2], [{"n": 0}, {"n": 1}])
+    index.close()
+    with open(f"{path}.f32.log", "a", encoding="utf-8") as f:
+        f.write('{"id": "c", "row": 2, "payl')  # crash mid-append
+
+    index = LocalVectorIndex(8, path)
+    assert len(index) == 2
+    index.upsert(["c"], vectors[2:], [{"n": 2}])
+    index.close()
+
+    reopened = LocalVectorIndex(8, path)
+    assert len(reopened) == 3
+    assert reopened.search(vectors[2], 1)[0].payload == {"n": 2}
+    reopened.close()
+
+@pytest.mark.asyncio
+async def test_local_store_stands_in_for_qdrant():
+    config = Config()
+    # No collections exist in this client; vectors never reach it
+    database = DatabaseClient(config, AsyncQdrantClient(location=":memory:"), LocalVectorStore(VECTOR_SIZE))
+    message = make_message("thread-1", "kept locally")
+    await database.save_message(message)
+
+    results = await database.search_similar(config.MESSAGES_COLLECTION, [0.1] * VECTOR_SIZE, limit=3)
+
+    assert [(r["id"], r["content"]) for r in results] == [(message.id, "kept locally")]
+    assert results[0]["similarity"] == pytest.approx(1.0)
+    await database.close()
+
+@pytest.mark.asyncio
+async def test_hot_cache_is_warmed_and_written_through():
+    remote = await make_database()
+    config = remote.config
+    await remote.client.upsert(
+        collection_name=config.MESSAGES_COLLECTION,
+        points=[models.PointStruct(id=1, vector=[1.0] * VECTOR_SIZE, payload={"content": "existing", "thread_id": "t"})]
+    )
+    local = LocalVectorStore(VECTOR_SIZE)
+    database = DatabaseClient(config, remote.client, CachedVectorStore(local, QdrantVectorStore(remote.client, remote._call)))
+
+    assert await database.warm_vector_cache() == 1
+    message = make_message("thread-2", "new")
+    await database.save_message(message)
+
+    assert len(local.index(config.MESSAGES_COLLECTION)) == 2
+    assert len((await remote.client.retrieve(config.MESSAGES_COLLECTION, [message.id]))) == 1
+    results = await database.search_similar(config.MESSAGES_COLLECTION, [1.0] * VECTOR_SIZE, limit=1)
+    assert results[0]["content"] == "existing"
+    await database.close()
+
+def test_vector_store_requires_every_operation():
+    class SearchOnly(VectorStore):
+        async def search(self, collection, query_vector, limit, with_vectors=False, search_filter=None):
+            return []
+
+    with pytest.raises(TypeError):
+        SearchOnly()
@@ -0,0 +1,43 @@
+import asyncio
+import pytest
+from app.models import Effect
+from app.websocket_handler import EffectSender
+
+class SlowWebSocket:
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.sent = []
+
+    async def send_json(self, data):
+        await asyncio.sleep(self.delay)
+        self.sent.append(data)
+
+def chorus_effect(i: int) -> Effect:
+    return Effect(type="chorus_response", payload={"step": "action", "content": str(i), "final": True})
+
+@pytest.mark.asyncio
+async def test_sender_applies_backpressure_and_preserves_order():
+    websocket = SlowWebSocket()
+    sender = EffectSender(websocket, max_pending=2)
+
+    for i in range(6):
+        await sender(chorus_effect(i))
+        # The producer never runs more than the queue bound ahead of the socket
+        assert sender._queue.qsize() <= 2
+
+    await sender.close()
+    assert [frame["data"]["content"] for frame in websocket.sent] == [str(i) for i in range(6)]
+
+@pytest.mark.asyncio
+async def test_sender_surfaces_send_failures_to_producer():
+    class ClosedWebSocket:
+        async def send_json(self, data):
+            raise ConnectionError("socket closed")
+
+    sender = EffectSender(ClosedWebSocket(), max_pending=1)
+    await sender(chorus_effect(0))
+    await asyncio.sleep(0)
+
+    with pytest.raises(ConnectionError):
+        await sender(chorus_effect(1))
+    await sender.close()